@@ -1,10 +1,25 @@
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.core.cache import caches
 from django.db.models import F
+from django.utils.functional import cached_property
 from django.utils.module_loading import import_string
 
-from wagtail_personalisation.models import Segment
-from wagtail_personalisation.rules import AbstractBaseRule
+from wagtail_personalisation import cookies
+from wagtail_personalisation.catalog import aget_catalog, get_catalog
+from wagtail_personalisation.counters import get_visit_count_buffer
+from wagtail_personalisation.models import (
+    Segment,
+    UserSession,
+    aget_membership_version,
+    get_membership_version,
+)
+from wagtail_personalisation.planner import get_rule_statistics, order_rules
 from wagtail_personalisation.utils import create_segment_dictionary
+from wagtail_personalisation.visits import get_visit_store
 
 
 class BaseSegmentsAdapter:
@@ -18,21 +33,92 @@ class BaseSegmentsAdapter:
 
         """
         self.request = request
+        self._catalog = None
+
+    @property
+    def catalog(self):
+        """Return the segment catalog, fetched once per adapter."""
+        if self._catalog is None:
+            self._catalog = get_catalog()
+        return self._catalog
 
     def setup(self):
         """Prepare the adapter for segment storage."""
 
+    async def aload(self):
+        """Load the adapter storage without blocking the event loop.
+
+        Called by the asynchronous methods of the adapter, afterwards the
+        storage can be used without blocking.
+
+        """
+
+    def flush_page_visits(self):
+        """Write the page visits of the request, if they are buffered."""
+
+    async def aflush_page_visits(self):
+        """Asynchronous version of :meth:`flush_page_visits`."""
+        await sync_to_async(self.flush_page_visits)()
+
+    def process_response(self, response):
+        """Persist the adapter storage at the end of the request.
+
+        Called by ``wagtail_personalisation.middleware.SegmentMiddleware``.
+
+        :param response: The http response
+        :type response: django.http.HttpResponse
+
+        """
+
+    async def aprocess_response(self, response):
+        """Asynchronous version of :meth:`process_response`."""
+        await sync_to_async(self.process_response)(response)
+
     def get_segments(self):
         """Return the segments stored in the adapter storage."""
 
+    async def aget_segments(self):
+        """Asynchronous version of :meth:`get_segments`."""
+        return await sync_to_async(self.get_segments)()
+
     def get_segment_by_id(self):
         """Return a single segment stored in the adapter storage."""
 
     def add(self):
         """Add a new segment to the adapter storage."""
 
-    def refresh(self):
-        """Refresh the segments stored in the adapter storage."""
+    def refresh(self, segment_ids=None):
+        """Refresh the segments stored in the adapter storage.
+
+        :param segment_ids: The ids of the segments to test, all enabled
+            segments when omitted
+        :type segment_ids: set of int
+
+        """
+
+    async def arefresh(self, segment_ids=None):
+        """Asynchronous version of :meth:`refresh`."""
+        await sync_to_async(self.refresh)(segment_ids)
+
+    def defer_refresh(self):
+        """Refresh the segments once they are read, instead of right away.
+
+        Adapters that do not support deferring refresh right away.
+
+        """
+        self.refresh()
+
+    def complete_refresh(self):
+        """Finish a refresh deferred by :meth:`defer_refresh`.
+
+        Called by ``wagtail_personalisation.middleware.SegmentMiddleware``
+        before the response is processed.
+
+        """
+
+    async def acomplete_refresh(self):
+        """Asynchronous version of :meth:`complete_refresh`."""
+        await sync_to_async(self.complete_refresh)()
 
     def _test_rules(self, rules, request, match_any=False):
         """Tests the provided rules to see if the request still belongs
@@ -48,9 +134,33 @@ class BaseSegmentsAdapter:
         """
         if not rules:
             return False
-        if match_any:
-            return any(rule.test_user(request) for rule in rules)
-        return all(rule.test_user(request) for rule in rules)
+
+        statistics = get_rule_statistics()
+        for rule in order_rules(rules, match_any, statistics):
+            result = bool(rule.test_user(request))
+            if statistics is not None:
+                statistics.observe(rule, result)
+            # Stop as soon as a rule decides the outcome.
+            if result == match_any:
+                return match_any
+        return not match_any
+
+    async def _atest_rules(self, rules, request, match_any=False):
+        """Asynchronous version of :meth:`_test_rules`, using the
+        ``atest_user`` method of the rules.
+        """
+        if not rules:
+            return False
+
+        statistics = get_rule_statistics()
+        for rule in order_rules(rules, match_any, statistics):
+            result = bool(await rule.atest_user(request))
+            if statistics is not None:
+                statistics.observe(rule, result)
+            # Stop as soon as a rule decides the outcome.
+            if result == match_any:
+                return match_any
+        return not match_any
 
     class Meta:
         abstract = True
@@ -61,39 +171,79 @@ class SessionSegmentsAdapter(BaseSegmentsAdapter):
 
     def __init__(self, request):
         super().__init__(request)
-        self.request.session.setdefault("segments", [])
         self._segment_cache = None
+        self._visit_counts = None
+        self._visit_counts_key = None
+        self._visited_page_id = None
+        self._loaded = False
+        self._deferred = False
+        self._tested_segment_ids = set()
+
+    @property
+    def storage(self):
+        """Return the mapping personalisation data is stored in."""
+        return self.request.session
+
+    async def aload(self):
+        if self._loaded:
+            return
+        if self._catalog is None:
+            self._catalog = await aget_catalog()
+        # Resolve the lazy user, so using it later does not query the database.
+        auser = getattr(self.request, "auser", None)
+        if auser is not None:
+            self.request.user = await auser()
+        await self._aload_storage()
+        self._loaded = True
+
+    async def _aload_storage(self):
+        # Later reads of the session use the data loaded here.
+        await self.request.session.akeys()
 
     def _segments(self, ids=None):
-        if not ids:
-            ids = []
-        segments = Segment.objects.enabled().filter(persistent=True).filter(pk__in=ids)
-        return segments
+        ids = set(ids or [])
+        return [
+            segment
+            for segment in self.catalog
+            if segment.persistent and segment.pk in ids
+        ]
 
     def get_segments(self, key="segments"):
         """Return the persistent segments stored in the request session.
 
+        A deferred refresh tests all segments before they are returned.
+
         :param key: The key under which the segments are stored
         :type key: String
         :returns: The segments in the request session
         :rtype: list of wagtail_personalisation.models.Segment or empty list
 
         """
+        if key == "segments":
+            self._refresh_deferred()
+        return self._get_segments(key)
+
+    def _get_segments(self, key="segments"):
         if key == "segments" and self._segment_cache is not None:
             return self._segment_cache
 
-        if key not in self.request.session:
+        if key not in self.storage:
             return []
-        raw_segments = self.request.session[key]
+        raw_segments = self.storage[key]
         segment_ids = [segment["id"] for segment in raw_segments]
 
-        segments = self._segments(ids=segment_ids)
-
-        result = list(segments)
+        result = self._segments(ids=segment_ids)
         if key == "segments":
             self._segment_cache = result
         return result
 
+    async def aget_segments(self, key="segments"):
+        """Asynchronous version of :meth:`get_segments`."""
+        await self.aload()
+        if key == "segments":
+            await self._arefresh_deferred()
+        return self._get_segments(key)
+
     def set_segments(self, segments, key="segments"):
         """Set the currently active segments
 
@@ -115,12 +265,56 @@ class SessionSegmentsAdapter(BaseSegmentsAdapter):
             serialized_segments.append(serialized)
             segment_ids.add(segment.pk)
 
-        self.request.session[key] = serialized_segments
         if key == "segments":
             self._segment_cache = cache_segments
 
+        # Only write to the session when the segments changed, or when their
+        # timestamps are outdated, to avoid saving the session on every request.
+        stored_segments = self.storage.get(key)
+        if stored_segments is not None and self._is_unchanged(
+            stored_segments, serialized_segments
+        ):
+            return
+        self.storage[key] = serialized_segments
+
+    def _is_unchanged(self, stored_segments, serialized_segments):
+        """Return whether stored segments still match the given segments.
+
+        :param stored_segments: The segments stored in the session
+        :type stored_segments: list of dict
+        :param serialized_segments: The segments to store
+        :type serialized_segments: list of dict
+        :rtype: bool
+
+        """
+
+        def membership(segments):
+            return {
+                (
+                    segment.get("id"),
+                    segment.get("encoded_name"),
+                    segment.get("persistent"),
+                )
+                for segment in segments
+            }
+
+        if membership(stored_segments) != membership(serialized_segments):
+            return False
+
+        interval = getattr(
+            settings, "WAGTAIL_PERSONALISATION_SEGMENT_TIMESTAMP_INTERVAL", 3600
+        )
+        now = int(time.time())
+        return all(
+            now - segment.get("timestamp", 0) < interval for segment in stored_segments
+        )
+
     def get_segment_by_id(self, segment_id):
-        """Find and return a single segment from the request session.
+        """Find and return a single segment the visitor is in.
+
+        Membership is answered from the segments stored for the visitor,
+        without querying the database. A deferred refresh only tests the
+        given segment.
 
         :param segment_id: The primary key of the segment
         :type segment_id: int
@@ -128,44 +322,207 @@ class SessionSegmentsAdapter(BaseSegmentsAdapter):
         :rtype: wagtail_personalisation.models.Segment or None
 
         """
-        segments = self._segments(ids=[segment_id])
-        if segments.exists():
-            return segments.get()
+        self._refresh_deferred({segment_id})
+        for segment in self._get_segments():
+            if segment.pk == segment_id:
+                return segment
+
+    def get_memberships(self):
+        """Return the static and excluded segment ids of the requesting user.
+
+        The ids are cached in the session until the static or excluded
+        segments of the user change.
+
+        :returns: A tuple of static segment ids and excluded segment ids
+        :rtype: tuple of set
+
+        """
+        user = self.request.user
+        if not user.is_authenticated:
+            return set(), set()
+
+        version = get_membership_version(user.pk)
+        cached = self._get_cached_memberships(user, version)
+        if cached is not None:
+            return cached
+
+        static_ids, excluded_ids = Segment.get_memberships(user)
+        self._set_cached_memberships(user, version, static_ids, excluded_ids)
+        return static_ids, excluded_ids
+
+    async def aget_memberships(self):
+        """Asynchronous version of :meth:`get_memberships`."""
+        user = self.request.user
+        if not user.is_authenticated:
+            return set(), set()
+
+        version = await aget_membership_version(user.pk)
+        cached = self._get_cached_memberships(user, version)
+        if cached is not None:
+            return cached
+
+        static_ids, excluded_ids = await Segment.aget_memberships(user)
+        self._set_cached_memberships(user, version, static_ids, excluded_ids)
+        return static_ids, excluded_ids
+
+    def _get_cached_memberships(self, user, version):
+        cached = self.storage.get("segment_memberships")
+        if cached and cached["version"] == version and cached["user"] == str(user.pk):
+            return set(cached["static"]), set(cached["excluded"])
+
+    def _set_cached_memberships(self, user, version, static_ids, excluded_ids):
+        self.storage["segment_memberships"] = {
+            "version": version,
+            "user": str(user.pk),
+            "static": sorted(static_ids),
+            "excluded": sorted(excluded_ids),
+        }
+
+    def get_visitor_key(self):
+        """Return the key identifying the visitor in the visit store.
+
+        :returns: The key of the user, or of the session for anonymous visitors
+        :rtype: str
+
+        """
+        user = getattr(self.request, "user", None)
+        if user is not None and user.is_authenticated:
+            return f"user:{user.pk}"
+
+        session = self.request.session
+        if session.session_key is None:
+            session.save()
+        return f"session:{session.session_key}"
+
+    async def aget_visitor_key(self):
+        """Asynchronous version of :meth:`get_visitor_key`."""
+        user = getattr(self.request, "user", None)
+        if user is not None and user.is_authenticated:
+            return f"user:{user.pk}"
+
+        session = self.request.session
+        if session.session_key is None:
+            await session.asave()
+        return f"session:{session.session_key}"
+
+    def get_visit_store(self):
+        """Return the store page visits are kept in.
+
+        :returns: The visit store, or None to keep visits in the adapter storage
+        :rtype: wagtail_personalisation.visits.DatabaseVisitStore or None
+
+        """
+        return get_visit_store()
+
+    def _get_visit_counts(self):
+        """Return the visits of the visitor from the visit store, loaded once.
+
+        The visits are loaded again when the visitor key changes, e.g. when
+        the user of the request changes.
+
+        """
+        visitor_key = self.get_visitor_key()
+        if self._visit_counts_key != visitor_key:
+            store = self.get_visit_store()
+            self._visit_counts = store.get_counts(visitor_key)
+            self._visit_counts_key = visitor_key
+        return self._visit_counts
+
+    async def _aload_visit_counts(self):
+        store = self.get_visit_store()
+        if store is None:
+            return
+        visitor_key = await self.aget_visitor_key()
+        if self._visit_counts_key != visitor_key:
+            self._visit_counts = await store.aget_counts(visitor_key)
+            self._visit_counts_key = visitor_key
 
     def add_page_visit(self, page):
         """Mark the page as visited by the user"""
-        visit_count = self.request.session.setdefault("visit_count", [])
-        page_visits = [visit for visit in visit_count if visit["id"] == page.pk]
-
-        if page_visits:
-            for page_visit in page_visits:
-                page_visit["count"] += 1
-                page_visit["path"] = page.url_path if page else self.request.path
-            self.request.session.modified = True
-        else:
-            visit_count.append(
-                {
-                    "slug": page.slug,
-                    "id": page.pk,
-                    "path": page.url_path if page else self.request.path,
-                    "count": 1,
-                }
-            )
+        self._visited_page_id = page.pk
+
+        store = self.get_visit_store()
+        if store is not None:
+            visitor_key = self.get_visitor_key()
+            store.add(visitor_key, page.pk)
+            if self._visit_counts_key == visitor_key:
+                self._visit_counts[page.pk] = self._visit_counts.get(page.pk, 0) + 1
+            return
+
+        page_visits = self._get_page_visits()
+
+        # Re-insert the page so the least recently visited pages come first.
+        key = str(page.pk)
+        page_visits[key] = page_visits.pop(key, 0) + 1
+
+        max_entries = getattr(settings, "WAGTAIL_PERSONALISATION_MAX_PAGE_VISITS", 500)
+        while len(page_visits) > max_entries:
+            del page_visits[next(iter(page_visits))]
+
+        self.storage["page_visits"] = page_visits
+
+    async def aadd_page_visit(self, page):
+        """Asynchronous version of :meth:`add_page_visit`."""
+        await self.aload()
+        if self.get_visit_store() is not None:
+            # Make sure the visitor has a key before visits are added.
+            await self.aget_visitor_key()
+        self.add_page_visit(page)
+
+    def _get_page_visits(self):
+        """Return the visit counts stored in the session, keyed by page id.
+
+        Visits stored as a list of dicts by previous versions are converted.
+
+        """
+        storage = self.storage
+        page_visits = storage.get("page_visits")
+        if page_visits is None:
+            legacy_visits = storage.pop("visit_count", None)
+            page_visits = {
+                str(visit["id"]): visit["count"]
+                for visit in legacy_visits or []
+                if "id" in visit
+            }
+            if legacy_visits is not None:
+                storage["page_visits"] = page_visits
+        return page_visits
 
     def get_visit_count(self, page=None):
         """Return the number of visits on the current request or given page"""
-        path = page.url_path if page else self.request.path
-        visit_count = self.request.session.setdefault("visit_count", [])
-        for visit in visit_count:
-            if visit["path"] == path:
-                return visit["count"]
-        return 0
+        page_id = page.pk if page else self._visited_page_id
+        if page_id is None:
+            return 0
+        if self.get_visit_store() is not None:
+            return self._get_visit_counts().get(page_id, 0)
+        return self._get_page_visits().get(str(page_id), 0)
+
+    async def aget_visit_count(self, page=None):
+        """Asynchronous version of :meth:`get_visit_count`."""
+        await self.aload()
+        await self._aload_visit_counts()
+        return self.get_visit_count(page)
+
+    def flush_page_visits(self):
+        store = self.get_visit_store()
+        if store is not None:
+            store.flush_if_due()
+
+    async def aflush_page_visits(self):
+        store = self.get_visit_store()
+        if store is not None:
+            await store.aflush_if_due()
 
     def update_visit_count(self):
         """Update the visit count for all segments in the request session."""
-        segments = self.request.session["segments"]
+        segments = self.storage.get("segments", [])
         segment_pks = [s["id"] for s in segments]
 
+        buffer = get_visit_count_buffer()
+        if buffer is not None:
+            buffer.add(segment_pks)
+            return
+
         # Update counts
         (
             Segment.objects.enabled()
@@ -173,56 +530,575 @@ class SessionSegmentsAdapter(BaseSegmentsAdapter):
             .update(visit_count=F("visit_count") + 1)
         )
 
-    def refresh(self):
+    async def aupdate_visit_count(self):
+        """Asynchronous version of :meth:`update_visit_count`."""
+        await self.aload()
+        segments = self.storage.get("segments", [])
+        segment_pks = [s["id"] for s in segments]
+
+        buffer = get_visit_count_buffer()
+        if buffer is not None:
+            await buffer.aadd(segment_pks)
+            return
+
+        await (
+            Segment.objects.enabled()
+            .filter(pk__in=segment_pks)
+            .aupdate(visit_count=F("visit_count") + 1)
+        )
+
+    def update_user_session(self):
+        """Store the session of an authenticated user when its key changed.
+
+        Sessions are stored when users log in, this catches sessions that
+        got a new key afterwards, e.g. through ``update_session_auth_hash``.
+
+        """
+        user = getattr(self.request, "user", None)
+        session = self.request.session
+        if user is None or not user.is_authenticated or not session.session_key:
+            return
+        if session.get("user_session_key") != session.session_key:
+            UserSession.update(user, session.session_key)
+            session["user_session_key"] = session.session_key
+
+    async def aupdate_user_session(self):
+        """Asynchronous version of :meth:`update_user_session`."""
+        user = getattr(self.request, "user", None)
+        session = self.request.session
+        if user is None or not user.is_authenticated or not session.session_key:
+            return
+        if session.get("user_session_key") != session.session_key:
+            await UserSession.aupdate(user, session.session_key)
+            session["user_session_key"] = session.session_key
+
+    def refresh(self, segment_ids=None):
         """Retrieve the request session segments and verify whether or not they
         still apply to the requesting visitor.
 
+        :param segment_ids: The ids of the segments to test, all enabled
+            segments when omitted. Stored segments are kept either way.
+        :type segment_ids: set of int
+
         """
-        enabled_segments = Segment.objects.enabled()
-        rule_models = AbstractBaseRule.get_descendant_models()
+        self._deferred = False
+        self.update_user_session()
+        self._refresh_segments(segment_ids)
+        self.update_visit_count()
+
+    def defer_refresh(self):
+        """Refresh the segments once they are read, instead of right away.
 
-        current_segments = self.get_segments()
-        excluded_segments = self.get_segments("excluded_segments")
-        current_segments = list(set(current_segments) - set(excluded_segments))
+        Only the segments that are asked for are tested, either one by one
+        through :meth:`get_segment_by_id` or all of them through
+        :meth:`get_segments`. The refresh is completed by
+        :meth:`complete_refresh` at the end of the response.
 
-        # Run tests on all remaining enabled segments to verify applicability.
-        additional_segments = []
-        for segment in enabled_segments:
+        """
+        self._deferred = True
+        self._tested_segment_ids = set()
+
+    def _take_deferred_segment_ids(self, segment_ids=None):
+        # Return the given segments, or all of them, that were not tested
+        # yet by a deferred refresh, and mark them as tested.
+        if not self._deferred:
+            return set()
+        if segment_ids is None:
+            segment_ids = {segment.pk for segment in self.catalog}
+        segment_ids = set(segment_ids) - self._tested_segment_ids
+        self._tested_segment_ids |= segment_ids
+        return segment_ids
+
+    def _refresh_deferred(self, segment_ids=None):
+        segment_ids = self._take_deferred_segment_ids(segment_ids)
+        if segment_ids:
+            self._refresh_segments(segment_ids)
+
+    async def _arefresh_deferred(self, segment_ids=None):
+        segment_ids = self._take_deferred_segment_ids(segment_ids)
+        if segment_ids:
+            await self._arefresh_segments(segment_ids)
+
+    def _take_remaining_segment_ids(self):
+        # Return the persistent segments not tested by a deferred refresh,
+        # and end the deferred refresh.
+        self._deferred = False
+        return {
+            segment.pk for segment in self.catalog if segment.persistent
+        } - self._tested_segment_ids
+
+    def complete_refresh(self):
+        """Finish a refresh deferred by :meth:`defer_refresh`.
+
+        Persistent segments that were not tested yet are tested, as visitors
+        stay in them on later requests, and the visit counts of the segments
+        are updated once.
+
+        """
+        if not self._deferred:
+            return
+        segment_ids = self._take_remaining_segment_ids()
+        self.update_user_session()
+        self._refresh_segments(segment_ids)
+        self.update_visit_count()
+
+    async def acomplete_refresh(self):
+        """Asynchronous version of :meth:`complete_refresh`."""
+        if not self._deferred:
+            return
+        await self.aload()
+        segment_ids = self._take_remaining_segment_ids()
+        await self.aupdate_user_session()
+        await self._arefresh_segments(segment_ids)
+        await self.aupdate_visit_count()
+
+    def _refresh_segments(self, segment_ids=None):
+        plan = _RefreshPlan(self, segment_ids, *self.get_memberships())
+        user = self.request.user
+        for segment in plan.candidates:
+            result = self._test_rules(
+                self.catalog.get_rules(segment),
+                self.request,
+                match_any=segment.match_any,
+            )
+            action = plan.decide(segment, result)
+            if action == plan.JOIN_STATIC and segment.reserve_slot():
+                segment.static_users.add(user)
+                plan.join(segment)
+            elif action == plan.EXCLUDE_USER:
+                segment.excluded_users.add(user)
+        plan.store()
+
+    async def _arefresh_segments(self, segment_ids=None):
+        plan = _RefreshPlan(self, segment_ids, *await self.aget_memberships())
+        user = self.request.user
+        for segment in plan.candidates:
+            result = await self._atest_rules(
+                self.catalog.get_rules(segment),
+                self.request,
+                match_any=segment.match_any,
+            )
+            action = plan.decide(segment, result)
             if (
-                segment.is_static
-                and segment.static_users.filter(id=self.request.user.id).exists()
-            ):
-                additional_segments.append(segment)
-            elif any(
-                (
-                    segment.excluded_users.filter(id=self.request.user.id).exists(),
-                    segment in excluded_segments,
-                )
+                action == plan.JOIN_STATIC
+                and await sync_to_async(segment.reserve_slot)()
             ):
+                await segment.static_users.aadd(user)
+                plan.join(segment)
+            elif action == plan.EXCLUDE_USER:
+                await segment.excluded_users.aadd(user)
+        plan.store()
+
+    async def arefresh(self, segment_ids=None):
+        """Asynchronous version of :meth:`refresh`.
+
+        Rules are tested with their ``atest_user`` method, so segments are
+        refreshed without blocking the event loop.
+
+        """
+        await self.aload()
+        self._deferred = False
+        await self.aupdate_user_session()
+        await self._arefresh_segments(segment_ids)
+        await self.aupdate_visit_count()
+
+
+class _RefreshPlan:
+    """The changes to the segments of a visitor made by a refresh.
+
+    Decides which segments to test and how their results apply, for both the
+    synchronous and asynchronous refresh. These only differ in how they test
+    rules and write the static or excluded users of segments.
+
+    """
+
+    #: Join a static segment, after reserving a place and adding the user.
+    JOIN_STATIC = "join_static"
+    #: Add the user to the excluded users of a static segment.
+    EXCLUDE_USER = "exclude_user"
+
+    def __init__(self, adapter, segment_ids, static_ids, excluded_ids):
+        """Collect the segments to test.
+
+        :param adapter: The segments adapter of the visitor
+        :type adapter: SessionSegmentsAdapter
+        :param segment_ids: The ids of the segments to test, all enabled
+            segments when None
+        :type segment_ids: set of int
+        :param static_ids: The ids of the static segments of the user
+        :type static_ids: set of int
+        :param excluded_ids: The ids of the segments excluding the user
+        :type excluded_ids: set of int
+
+        """
+        self.adapter = adapter
+        self.authenticated = adapter.request.user.is_authenticated
+
+        current_segments = adapter._get_segments()
+        self.excluded_segments = adapter._get_segments("excluded_segments")
+        self.current_segments = list(
+            set(current_segments) - set(self.excluded_segments)
+        )
+        self.additional_segments = []
+        self.candidates = []
+
+        for segment in adapter.catalog:
+            if segment_ids is not None and segment.pk not in segment_ids:
+                continue
+            if segment.is_static and segment.pk in static_ids:
+                self.additional_segments.append(segment)
+            elif segment.pk in excluded_ids or segment in self.excluded_segments:
                 continue
             elif not segment.is_static or not segment.is_full:
-                segment_rules = []
-                for rule_model in rule_models:
-                    segment_rules.extend(rule_model.objects.filter(segment=segment))
+                self.candidates.append(segment)
 
-                result = self._test_rules(
-                    segment_rules, self.request, match_any=segment.match_any
-                )
+    def decide(self, segment, result):
+        """Apply the result of testing the rules of a segment.
 
-                if result and segment.randomise_into_segment():
-                    if segment.is_static and not segment.is_full:  # noqa: SIM102
-                        if self.request.user.is_authenticated:
-                            segment.static_users.add(self.request.user)
-                    additional_segments.append(segment)
-                elif result:
-                    if segment.is_static and self.request.user.is_authenticated:
-                        segment.excluded_users.add(self.request.user)
-                    else:
-                        excluded_segments += [segment]
-
-        self.set_segments(current_segments + additional_segments)
-        self.set_segments(excluded_segments, "excluded_segments")
-        self.update_visit_count()
+        :param segment: The tested segment
+        :type segment: wagtail_personalisation.models.Segment
+        :param result: Whether the rules of the segment match
+        :type result: bool
+        :returns: :attr:`JOIN_STATIC` or :attr:`EXCLUDE_USER` when the
+            database needs to be written, otherwise None
+        :rtype: str or None
+
+        """
+        static_user = segment.is_static and self.authenticated
+        if result and segment.randomise_into_segment():
+            if static_user:
+                return self.JOIN_STATIC
+            self.join(segment)
+        elif result:
+            if static_user:
+                return self.EXCLUDE_USER
+            self.excluded_segments.append(segment)
+        return None
+
+    def join(self, segment):
+        """Add a segment to the segments of the visitor."""
+        self.additional_segments.append(segment)
+
+    def store(self):
+        """Store the refreshed segments in the adapter."""
+        self.adapter.set_segments(self.current_segments + self.additional_segments)
+        self.adapter.set_segments(self.excluded_segments, "excluded_segments")
+
+
+class CacheSegmentsStorage(dict):
+    """Personalisation data of a visitor, keeping track of changes."""
+
+    modified = False
+
+    def __setitem__(self, key, value):
+        self.modified = True
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self.modified = True
+        super().__delitem__(key)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self.modified = True
+        return super().setdefault(key, default)
+
+    def pop(self, key, *args):
+        if key in self:
+            self.modified = True
+        return super().pop(key, *args)
+
+
+class CacheSegmentsAdapter(SessionSegmentsAdapter):
+    """Segment adapter that stores personalisation data in the cache.
+
+    The data of each visitor is stored under its own cache key, identified by
+    a signed visitor id cookie, so the session is neither loaded nor created.
+    Requires ``wagtail_personalisation.middleware.SegmentMiddleware``.
+
+    """
+
+    cookie_salt = "wagtail_personalisation.visitor"
+
+    def __init__(self, request):
+        self._storage = None
+        self._new_visitor = False
+        super().__init__(request)
+
+    @property
+    def cache(self):
+        return caches[
+            getattr(
+                settings,
+                "WAGTAIL_PERSONALISATION_ADAPTER_CACHE",
+                getattr(settings, "WAGTAIL_PERSONALISATION_CACHE", "default"),
+            )
+        ]
+
+    @property
+    def cookie_name(self):
+        return getattr(
+            settings,
+            "WAGTAIL_PERSONALISATION_VISITOR_COOKIE",
+            "wagtail_personalisation_visitor",
+        )
+
+    @property
+    def timeout(self):
+        return getattr(
+            settings, "WAGTAIL_PERSONALISATION_ADAPTER_TIMEOUT", 60 * 60 * 24 * 30
+        )
+
+    @cached_property
+    def visitor_id(self):
+        """Return the id of the visitor, creating one for new visitors."""
+        visitor_id = self.request.get_signed_cookie(
+            self.cookie_name, default=None, salt=self.cookie_salt
+        )
+        if visitor_id is None:
+            visitor_id = uuid.uuid4().hex
+            self._new_visitor = True
+        return visitor_id
+
+    @property
+    def cache_key(self):
+        return f"wagtail_personalisation:visitor:{self.visitor_id}"
+
+    @property
+    def storage(self):
+        if self._storage is None:
+            cache_key = self.cache_key
+            data = None if self._new_visitor else self.cache.get(cache_key)
+            self._storage = CacheSegmentsStorage(data or {})
+        return self._storage
+
+    async def _aload_storage(self):
+        if self._storage is None:
+            cache_key = self.cache_key
+            data = None if self._new_visitor else await self.cache.aget(cache_key)
+            self._storage = CacheSegmentsStorage(data or {})
+
+    def get_visitor_key(self):
+        user = getattr(self.request, "user", None)
+        if user is not None and user.is_authenticated:
+            return f"user:{user.pk}"
+        return f"visitor:{self.visitor_id}"
+
+    async def aget_visitor_key(self):
+        return self.get_visitor_key()
+
+    def update_user_session(self):
+        # Personalisation data is not stored in the session.
+        pass
+
+    async def aupdate_user_session(self):
+        pass
+
+    def process_response(self, response):
+        if self._storage is None or not self._storage.modified:
+            return
+
+        self.cache.set(self.cache_key, dict(self._storage), self.timeout)
+        self._set_visitor_cookie(response)
+
+    async def aprocess_response(self, response):
+        if self._storage is None or not self._storage.modified:
+            return
+
+        await self.cache.aset(self.cache_key, dict(self._storage), self.timeout)
+        self._set_visitor_cookie(response)
+
+    def _set_visitor_cookie(self, response):
+        self._storage.modified = False
+        if self._new_visitor:
+            response.set_signed_cookie(
+                self.cookie_name,
+                self.visitor_id,
+                salt=self.cookie_salt,
+                max_age=self.timeout,
+                secure=settings.SESSION_COOKIE_SECURE,
+                httponly=True,
+                samesite=settings.SESSION_COOKIE_SAMESITE,
+            )
+            self._new_visitor = False
+
+
+class SignedCookieSegmentsAdapter(SessionSegmentsAdapter):
+    """Segment adapter that stores personalisation data in a signed cookie.
+
+    The segment ids, excluded segment ids and the most recent page visits of
+    a visitor are encoded as variable length integers, so refreshing the
+    segments needs no session, cache or database lookup. Stored segments
+    are bound to the catalog version and their timestamps are discarded when
+    the catalog changes. Requires
+    ``wagtail_personalisation.middleware.SegmentMiddleware``.
+
+    """
+
+    cookie_salt = "wagtail_personalisation.segments"
+
+    def __init__(self, request):
+        self._storage = None
+        super().__init__(request)
+
+    @property
+    def cookie_name(self):
+        return getattr(
+            settings,
+            "WAGTAIL_PERSONALISATION_SEGMENTS_COOKIE",
+            "wagtail_personalisation_segments",
+        )
+
+    @property
+    def timeout(self):
+        return getattr(
+            settings, "WAGTAIL_PERSONALISATION_ADAPTER_TIMEOUT", 60 * 60 * 24 * 30
+        )
+
+    @property
+    def max_page_visits(self):
+        return getattr(settings, "WAGTAIL_PERSONALISATION_COOKIE_MAX_PAGE_VISITS", 20)
+
+    @property
+    def storage(self):
+        if self._storage is None:
+            value = self.request.get_signed_cookie(
+                self.cookie_name,
+                default=None,
+                salt=self.cookie_salt,
+                max_age=self.timeout,
+            )
+            try:
+                data = self._load(cookies.decode(value)) if value else {}
+            except ValueError:
+                # Discard cookies written in another format.
+                data = {}
+            self._storage = CacheSegmentsStorage(data)
+        return self._storage
+
+    def _load(self, state):
+        """Convert a decoded cookie into the adapter storage.
+
+        :param state: The decoded cookie
+        :type state: dict
+        :returns: The personalisation data
+        :rtype: dict
+
+        """
+        catalog = self.catalog
+        timestamp = 0
+        if state["catalog"] == cookies.fingerprint(catalog.version):
+            timestamp = state["timestamp"]
+
+        def serialize(segment_ids):
+            segments = [catalog.get(segment_id) for segment_id in segment_ids]
+            return [
+                {
+                    "encoded_name": segment.encoded_name(),
+                    "id": segment.pk,
+                    "timestamp": timestamp,
+                    "persistent": segment.persistent,
+                }
+                for segment in segments
+                if segment is not None
+            ]
+
+        data = {
+            "segments": serialize(state["segments"]),
+            "excluded_segments": serialize(state["excluded_segments"]),
+            "page_visits": {
+                str(page_id): count for page_id, count in state["page_visits"]
+            },
+        }
+
+        if state["memberships"] is not None:
+            user_id, membership_fingerprint, static_ids, excluded_ids = state[
+                "memberships"
+            ]
+            version = get_membership_version(user_id)
+            if membership_fingerprint == cookies.fingerprint(version):
+                data["segment_memberships"] = {
+                    "version": version,
+                    "user": str(user_id),
+                    "static": static_ids,
+                    "excluded": excluded_ids,
+                }
+        return data
+
+    def _dump(self):
+        """Convert the adapter storage into the state encoded in the cookie.
+
+        :returns: The state to encode
+        :rtype: dict
+
+        """
+        storage = self.storage
+        segments = storage.get("segments", [])
+        excluded_segments = storage.get("excluded_segments", [])
+        timestamps = [
+            segment.get("timestamp", 0) for segment in segments + excluded_segments
+        ]
+
+        # Only the most recently visited pages fit in the cookie.
+        page_visits = list(storage.get("page_visits", {}).items())
+        page_visits = page_visits[len(page_visits) - self.max_page_visits :]
+
+        memberships = storage.get("segment_memberships")
+        if memberships is not None and memberships["user"].isdigit():
+            memberships = (
+                int(memberships["user"]),
+                cookies.fingerprint(memberships["version"]),
+                memberships["static"],
+                memberships["excluded"],
+            )
+        else:
+            memberships = None
+
+        return {
+            "timestamp": min(timestamps, default=int(time.time())),
+            "catalog": cookies.fingerprint(self.catalog.version),
+            "segments": [segment["id"] for segment in segments],
+            "excluded_segments": [segment["id"] for segment in excluded_segments],
+            "page_visits": [(int(page_id), count) for page_id, count in page_visits],
+            "memberships": memberships,
+        }
+
+    def get_visit_store(self):
+        # The visits of anonymous visitors are kept in the cookie, as storing
+        # them elsewhere would need a visitor id.
+        user = getattr(self.request, "user", None)
+        if user is None or not user.is_authenticated:
+            return None
+        return super().get_visit_store()
+
+    async def _aload_storage(self):
+        # Decoding the cookie does not block.
+        return self.storage
+
+    def update_user_session(self):
+        # Personalisation data is not stored in the session.
+        pass
+
+    async def aupdate_user_session(self):
+        pass
+
+    async def aprocess_response(self, response):
+        self.process_response(response)
+
+    def process_response(self, response):
+        if self._storage is None or not self._storage.modified:
+            return
+
+        response.set_signed_cookie(
+            self.cookie_name,
+            cookies.encode(self._dump()),
+            salt=self.cookie_salt,
+            max_age=self.timeout,
+            secure=settings.SESSION_COOKIE_SECURE,
+            httponly=True,
+            samesite=settings.SESSION_COOKIE_SAMESITE,
+        )
+        self._storage.modified = False
 
 
 SEGMENT_ADAPTER_CLASS = import_string(
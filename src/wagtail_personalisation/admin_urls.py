@@ -16,6 +16,11 @@ urlpatterns = [
         views.toggle_segment_view,
         name="toggle_segment_view",
     ),
+    path(
+        "segment/userbar/",
+        views.userbar_segments,
+        name="userbar_segments",
+    ),
     path(
         "segment/users/<int:segment_id>",
         views.segment_user_data,
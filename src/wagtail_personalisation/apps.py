@@ -0,0 +1,14 @@
+from django.apps import AppConfig
+from django.utils.translation import gettext_lazy as _
+
+
+class WagtailPersonalisationConfig(AppConfig):
+    label = "wagtail_personalisation"
+    name = "wagtail_personalisation"
+    verbose_name = _("Wagtail Personalisation")
+    default_auto_field = "django.db.models.AutoField"
+
+    def ready(self):
+        from wagtail_personalisation import checks, receivers  # noqa: F401
+
+        receivers.register()
@@ -2,6 +2,7 @@ from django.utils.translation import gettext_lazy as _
 from wagtail import blocks
 
 from wagtail_personalisation.adapters import get_segment_adapter
+from wagtail_personalisation.fragments import render_fragment
 from wagtail_personalisation.models import Segment
 
 
@@ -12,7 +13,12 @@ def list_segment_choices():
 
 
 class PersonalisedStructBlock(blocks.StructBlock):
-    """Struct block that allows personalisation per block."""
+    """Struct block that allows personalisation per block.
+
+    Set ``cache_timeout`` in the block ``Meta`` to cache the rendered block
+    per segment, for blocks that render the same for every visitor in it.
+
+    """
 
     segment = blocks.ChoiceBlock(
         choices=list_segment_choices,
@@ -34,19 +40,44 @@ class PersonalisedStructBlock(blocks.StructBlock):
         """
         request = context["request"]
         adapter = get_segment_adapter(request)
-        user_segments = adapter.get_segments()
 
         try:
             segment_id = int(value["segment"])
         except (ValueError, TypeError):
             return ""
 
-        if segment_id > 0:
-            for segment in user_segments:
-                if segment.id == segment_id:
-                    return super().render(value, context)
+        if segment_id > 0 and adapter.get_segment_by_id(segment_id) is not None:
+            return self.render_segment(segment_id, value, context)
 
         if segment_id == -1:
-            return super().render(value, context)
+            return self.render_segment(segment_id, value, context)
 
         return ""
+
+    def render_segment(self, segment_id, value, context):
+        """Render this content block for users in the given segment.
+
+        :param segment_id: The id of the segment, or -1 for everyone
+        :type segment_id: int
+        :param value: The value from the block
+        :type value: dict
+        :param context: The context containing the request
+        :type context: dict
+        :returns: The rendered block
+        :rtype: django.utils.safestring.SafeString
+
+        """
+        key_parts = (
+            f"{type(self).__module__}.{type(self).__qualname__}",
+            segment_id,
+            self.get_prep_value(value),
+        )
+        return render_fragment(
+            key_parts,
+            context,
+            self.meta.cache_timeout,
+            lambda: super(PersonalisedStructBlock, self).render(value, context),
+        )
+
+    class Meta:
+        cache_timeout = None
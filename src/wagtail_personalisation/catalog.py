@@ -0,0 +1,171 @@
+import threading
+
+from asgiref.sync import sync_to_async
+from django.utils.functional import cached_property
+
+from wagtail_personalisation.referrals import ReferralMatcher
+from wagtail_personalisation.utils import aget_version, bump_version, get_version
+
+CATALOG_VERSION_KEY = "wagtail_personalisation:catalog_version"
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+class SegmentCatalog:
+    """In-memory snapshot of the enabled segments and their rules.
+
+    The catalog is built once per process and shared between requests, so
+    segments and rules handed out by it must be treated as read-only.
+
+    """
+
+    def __init__(self, version, segments, rules):
+        """Create a catalog from already loaded segments and rules.
+
+        :param version: The catalog version the snapshot was built for
+        :type version: str
+        :param segments: The enabled segments
+        :type segments: list of wagtail_personalisation.models.Segment
+        :param rules: The rules of each segment, keyed by segment id
+        :type rules: dict
+
+        """
+        self.version = version
+        self.segments = segments
+        self._segments_by_id = {segment.pk: segment for segment in segments}
+        self._segments_by_name = {}
+        for segment in segments:
+            self._segments_by_name.setdefault(segment.name, segment)
+        self._rules = rules
+
+    def __iter__(self):
+        return iter(self.segments)
+
+    def __len__(self):
+        return len(self.segments)
+
+    def __contains__(self, segment_id):
+        return segment_id in self._segments_by_id
+
+    @classmethod
+    def build(cls, version):
+        """Load the enabled segments and all of their rules.
+
+        Rules are loaded with one query per rule model and have their
+        foreign keys (e.g. ``VisitCountRule.counted_page``) preloaded,
+        see ``SegmentQuerySet.with_rules``.
+
+        :param version: The catalog version the snapshot is built for
+        :type version: str
+        :returns: The new catalog
+        :rtype: SegmentCatalog
+
+        """
+        # Local import for cyclic import
+        from wagtail_personalisation.models import Segment
+
+        segments = list(Segment.objects.enabled().with_rules().order_by("pk"))
+        rules = {segment.pk: segment.get_rules() for segment in segments}
+
+        return cls(version, segments, rules)
+
+    def get(self, segment_id):
+        """Return the enabled segment with the given id.
+
+        :param segment_id: The primary key of the segment
+        :type segment_id: int
+        :returns: The matching segment
+        :rtype: wagtail_personalisation.models.Segment or None
+
+        """
+        return self._segments_by_id.get(segment_id)
+
+    def get_by_name(self, name):
+        """Return the enabled segment with the given name.
+
+        :param name: The name of the segment
+        :type name: str
+        :returns: The matching segment with the lowest id
+        :rtype: wagtail_personalisation.models.Segment or None
+
+        """
+        return self._segments_by_name.get(name)
+
+    @cached_property
+    def referral_matcher(self):
+        """Return a matcher for the referral rules of all enabled segments.
+
+        :returns: The referral matcher
+        :rtype: wagtail_personalisation.referrals.ReferralMatcher
+
+        """
+        # Local import for cyclic import
+        from wagtail_personalisation.rules import ReferralRule
+
+        return ReferralMatcher.for_rules(
+            rule
+            for rules in self._rules.values()
+            for rule in rules
+            if isinstance(rule, ReferralRule)
+        )
+
+    def get_rules(self, segment):
+        """Return the rules of an enabled segment.
+
+        :param segment: The segment to return the rules for
+        :type segment: wagtail_personalisation.models.Segment
+        :returns: The rules of the segment
+        :rtype: list of wagtail_personalisation.rules.AbstractBaseRule
+
+        """
+        return self._rules.get(segment.pk, [])
+
+
+def get_catalog():
+    """Return the segment catalog, rebuilding it if it has been invalidated.
+
+    :returns: The current segment catalog
+    :rtype: SegmentCatalog
+
+    """
+    global _catalog
+
+    version = get_version(CATALOG_VERSION_KEY)
+    catalog = _catalog
+    if catalog is None or catalog.version != version:
+        with _catalog_lock:
+            catalog = _catalog
+            if catalog is None or catalog.version != version:
+                catalog = _catalog = SegmentCatalog.build(version)
+    return catalog
+
+
+async def aget_catalog():
+    """Return the segment catalog, rebuilding it if it has been invalidated.
+
+    Asynchronous version of :func:`get_catalog`, only a rebuild of the
+    catalog runs in a thread.
+
+    :returns: The current segment catalog
+    :rtype: SegmentCatalog
+
+    """
+    version = await aget_version(CATALOG_VERSION_KEY)
+    catalog = _catalog
+    if catalog is None or catalog.version != version:
+        catalog = await sync_to_async(get_catalog)()
+    return catalog
+
+
+def invalidate_catalog(using=None):
+    """Invalidate the segment catalog in this and every other process.
+
+    :param using: The database alias of the current transaction
+    :type using: str
+
+    """
+    global _catalog
+
+    _catalog = None
+    bump_version(CATALOG_VERSION_KEY, using=using)
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+SEGMENT_MIDDLEWARE = "wagtail_personalisation.middleware.SegmentMiddleware"
+
+
+@register()
+def check_lazy_segmentation_middleware(app_configs, **kwargs):
+    """Check that deferred refreshes of lazy segmentation are completed.
+
+    Without ``SegmentMiddleware`` the refresh is never completed, so visit
+    counts and persistent segments would not be updated.
+
+    """
+    if not getattr(settings, "WAGTAIL_PERSONALISATION_LAZY_SEGMENTATION", False):
+        return []
+    if SEGMENT_MIDDLEWARE in settings.MIDDLEWARE:
+        return []
+    return [
+        Error(
+            "WAGTAIL_PERSONALISATION_LAZY_SEGMENTATION requires SegmentMiddleware.",
+            hint=f"Add '{SEGMENT_MIDDLEWARE}' to MIDDLEWARE.",
+            id="wagtail_personalisation.E001",
+        )
+    ]
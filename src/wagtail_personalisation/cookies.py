@@ -0,0 +1,158 @@
+import base64
+import hashlib
+
+# Increased whenever the layout of the encoded cookie changes, so cookies
+# written by older versions are discarded instead of misread.
+FORMAT_VERSION = 1
+
+FINGERPRINT_SIZE = 4
+
+
+def fingerprint(version):
+    """Return a short digest of a version token.
+
+    :param version: The version token
+    :type version: str
+    :returns: The digest
+    :rtype: bytes
+
+    """
+    return hashlib.blake2b(version.encode(), digest_size=FINGERPRINT_SIZE).digest()
+
+
+def _write_varint(buffer, value):
+    if value < 0:
+        raise ValueError("Negative values can not be encoded")
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            buffer.append(byte | 0x80)
+        else:
+            buffer.append(byte)
+            return
+
+
+def _write_ids(buffer, ids):
+    # Sorted ids are stored as the differences between them, which keeps
+    # most of them below 128 and thus within a single byte.
+    ids = sorted(set(ids))
+    _write_varint(buffer, len(ids))
+    previous = 0
+    for value in ids:
+        _write_varint(buffer, value - previous)
+        previous = value
+
+
+class _Reader:
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def read_bytes(self, size):
+        if self.offset + size > len(self.data):
+            raise ValueError("Unexpected end of data")
+        value = self.data[self.offset : self.offset + size]
+        self.offset += size
+        return value
+
+    def read_varint(self):
+        value = shift = 0
+        while True:
+            byte = self.read_bytes(1)[0]
+            value |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                return value
+            shift += 7
+            if shift > 63:
+                raise ValueError("Varint too long")
+
+    def read_ids(self):
+        ids = []
+        value = 0
+        for _ in range(self.read_varint()):
+            value += self.read_varint()
+            ids.append(value)
+        return ids
+
+
+def encode(state):
+    """Encode the personalisation state of a visitor for a cookie.
+
+    All numbers are stored as variable length integers, segment ids as sorted
+    differences and versions as short fingerprints.
+
+    :param state: A dict with the ``timestamp``, the ``catalog`` fingerprint,
+        the ``segments`` and ``excluded_segments`` ids, the ``page_visits``
+        as a list of page id and count pairs, and optional ``memberships``
+        as a tuple of user id, membership fingerprint, static and excluded
+        segment ids.
+    :type state: dict
+    :returns: The url safe encoded state
+    :rtype: str
+
+    """
+    buffer = bytearray()
+    _write_varint(buffer, FORMAT_VERSION)
+    _write_varint(buffer, state["timestamp"])
+    buffer += state["catalog"]
+    _write_ids(buffer, state["segments"])
+    _write_ids(buffer, state["excluded_segments"])
+
+    _write_varint(buffer, len(state["page_visits"]))
+    for page_id, count in state["page_visits"]:
+        _write_varint(buffer, page_id)
+        _write_varint(buffer, count)
+
+    memberships = state.get("memberships")
+    if memberships is None:
+        _write_varint(buffer, 0)
+    else:
+        user_id, membership_fingerprint, static_ids, excluded_ids = memberships
+        _write_varint(buffer, 1)
+        _write_varint(buffer, user_id)
+        buffer += membership_fingerprint
+        _write_ids(buffer, static_ids)
+        _write_ids(buffer, excluded_ids)
+
+    return base64.urlsafe_b64encode(bytes(buffer)).rstrip(b"=").decode()
+
+
+def decode(value):
+    """Decode the personalisation state of a visitor from a cookie.
+
+    :param value: The url safe encoded state
+    :type value: str
+    :returns: The state, as accepted by :func:`encode`
+    :rtype: dict
+    :raises ValueError: When the value is not a valid encoded state
+
+    """
+    try:
+        data = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+    except (TypeError, ValueError) as exc:
+        raise ValueError("Invalid cookie encoding") from exc
+
+    reader = _Reader(data)
+    if reader.read_varint() != FORMAT_VERSION:
+        raise ValueError("Unsupported cookie format")
+
+    state = {
+        "timestamp": reader.read_varint(),
+        "catalog": reader.read_bytes(FINGERPRINT_SIZE),
+        "segments": reader.read_ids(),
+        "excluded_segments": reader.read_ids(),
+        "page_visits": [
+            (reader.read_varint(), reader.read_varint())
+            for _ in range(reader.read_varint())
+        ],
+        "memberships": None,
+    }
+    if reader.read_varint():
+        state["memberships"] = (
+            reader.read_varint(),
+            reader.read_bytes(FINGERPRINT_SIZE),
+            reader.read_ids(),
+            reader.read_ids(),
+        )
+    return state
@@ -0,0 +1,228 @@
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import DatabaseError
+from django.utils.module_loading import import_string
+
+from wagtail_personalisation.utils import get_cache
+
+logger = logging.getLogger(__name__)
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+class BaseVisitCountBuffer:
+    """Collect segment visit count increments and write them in batches.
+
+    Increments are flushed with a single update query once ``interval``
+    seconds have passed since the last flush, once ``threshold`` increments
+    are pending and when the process exits.
+
+    """
+
+    def __init__(self, interval=60, threshold=1000):
+        """Create a visit count buffer.
+
+        :param interval: The maximum number of seconds between flushes
+        :type interval: int
+        :param threshold: The number of pending increments forcing a flush
+        :type threshold: int
+
+        """
+        self.interval = interval
+        self.threshold = threshold
+
+    def add(self, segment_ids):
+        """Count a visit for each of the given segments.
+
+        :param segment_ids: The ids of the segments the visitor is in
+        :type segment_ids: list of int
+
+        """
+
+    async def aadd(self, segment_ids):
+        """Count a visit for each of the given segments.
+
+        Asynchronous version of :meth:`add`.
+
+        :param segment_ids: The ids of the segments the visitor is in
+        :type segment_ids: list of int
+
+        """
+        await sync_to_async(self.add)(segment_ids)
+
+    def flush(self):
+        """Write all pending increments to the database."""
+
+    def write(self, counts):
+        """Add the counted visits to the enabled segments.
+
+        :param counts: The number of visits to add, keyed by segment id
+        :type counts: dict
+        :returns: Whether the counts have been written
+        :rtype: bool
+
+        """
+        # Local import for cyclic import
+        from wagtail_personalisation.models import Segment
+
+        try:
+            Segment.objects.enabled().increment_visit_counts(counts)
+        except DatabaseError:
+            logger.exception("Unable to write segment visit counts")
+            return False
+        return True
+
+
+class LocalVisitCountBuffer(BaseVisitCountBuffer):
+    """Collect visit count increments in the memory of the current process."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._counts = Counter()
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _count(self, segment_ids):
+        """Count the visits and return whether a flush is due."""
+        with self._lock:
+            self._counts.update(segment_ids)
+            self._pending += len(segment_ids)
+            return (
+                self._pending >= self.threshold
+                or time.monotonic() - self._last_flush >= self.interval
+            )
+
+    def add(self, segment_ids):
+        if self._count(segment_ids):
+            self.flush()
+
+    async def aadd(self, segment_ids):
+        # Counting only touches memory, only the flush runs in a thread.
+        if self._count(segment_ids):
+            await sync_to_async(self.flush)()
+
+    def flush(self):
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+            self._pending = 0
+            self._last_flush = time.monotonic()
+
+        if counts and not self.write(counts):
+            # Keep the visits so they are written by the next flush.
+            with self._lock:
+                self._counts.update(counts)
+                self._pending += sum(counts.values())
+
+
+class CacheVisitCountBuffer(BaseVisitCountBuffer):
+    """Collect visit count increments in the shared cache.
+
+    All processes share the same counters, so visits are written by
+    whichever process flushes first. The cache backend has to support
+    atomic ``incr`` and ``decr``, like the Redis and Memcached backends.
+
+    """
+
+    key_prefix = "wagtail_personalisation:visit_count"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache = get_cache()
+
+    def _incr(self, key, delta=1):
+        try:
+            return self.cache.incr(key, delta)
+        except ValueError:
+            if self.cache.add(key, delta, timeout=None):
+                return delta
+            return self.cache.incr(key, delta)
+
+    def add(self, segment_ids):
+        for segment_id in segment_ids:
+            self._incr(f"{self.key_prefix}:{segment_id}")
+        pending = self._incr(f"{self.key_prefix}:pending", len(segment_ids))
+
+        # The flush marker expires after the interval, so adding it only
+        # succeeds for the first visit of every interval.
+        if pending >= self.threshold or self.cache.add(
+            f"{self.key_prefix}:flushed", True, timeout=self.interval
+        ):
+            self.flush()
+
+    def flush(self):
+        # Local import for cyclic import
+        from wagtail_personalisation.catalog import get_catalog
+
+        lock_key = f"{self.key_prefix}:lock"
+        if not self.cache.add(lock_key, True, timeout=self.interval):
+            return
+
+        try:
+            self.cache.set(f"{self.key_prefix}:pending", 0, timeout=None)
+            keys = {
+                f"{self.key_prefix}:{segment.pk}": segment.pk
+                for segment in get_catalog()
+            }
+            counts = {}
+            for key, count in self.cache.get_many(keys).items():
+                if count > 0:
+                    # Decrement instead of deleting so that visits counted
+                    # while flushing are kept.
+                    self.cache.decr(key, count)
+                    counts[keys[key]] = count
+
+            if counts and not self.write(counts):
+                for segment_id, count in counts.items():
+                    self._incr(f"{self.key_prefix}:{segment_id}", count)
+        finally:
+            self.cache.delete(lock_key)
+
+
+def get_visit_count_buffer():
+    """Return the configured visit count buffer.
+
+    :returns: The visit count buffer, or None when visits are counted
+        exactly on every request
+    :rtype: BaseVisitCountBuffer or None
+
+    """
+    global _buffer
+
+    config = getattr(settings, "WAGTAIL_PERSONALISATION_VISIT_COUNT_BUFFER", None)
+    if not config:
+        return None
+
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                buffer_class = import_string(
+                    config.get(
+                        "BACKEND",
+                        "wagtail_personalisation.counters.LocalVisitCountBuffer",
+                    )
+                )
+                _buffer = buffer_class(**config.get("OPTIONS", {}))
+                atexit.register(_buffer.flush)
+    return _buffer
+
+
+def reset_visit_count_buffer(setting, **kwargs):
+    """Flush and discard the visit count buffer when its setting changes."""
+    global _buffer
+
+    if setting == "WAGTAIL_PERSONALISATION_VISIT_COUNT_BUFFER" and _buffer is not None:
+        atexit.unregister(_buffer.flush)
+        _buffer.flush()
+        _buffer = None
+
+
+setting_changed.connect(reset_visit_count_buffer)
@@ -0,0 +1,155 @@
+from django.conf import settings
+from django.utils import timezone
+from user_agents import parse
+
+from wagtail_personalisation.utils import LRUCache, get_client_ip
+
+_facts = {}
+
+# Device classes keyed by user agent string.
+device_class_cache = LRUCache(
+    getattr(settings, "WAGTAIL_PERSONALISATION_USER_AGENT_CACHE_SIZE", 1000)
+)
+
+
+def register_fact(name):
+    """Register a function deriving a fact from the request.
+
+    The function receives the request and is called at most once per
+    request, the first time the fact is used::
+
+        @register_fact("basket_size")
+        def get_basket_size(request):
+            return len(request.session.get("basket", []))
+
+        get_request_facts(request).basket_size
+
+    :param name: The name of the fact
+    :type name: str
+    :returns: A decorator registering the function
+    :rtype: callable
+
+    """
+
+    def decorator(func):
+        _facts[name] = func
+        return func
+
+    return decorator
+
+
+class RequestFacts:
+    """Lazily derived and memoized information about a request.
+
+    Facts are available as attributes and computed the first time they
+    are accessed, so rules of different segments share the result.
+
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self._values = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        try:
+            return self.get(name)
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def get(self, name):
+        """Return the value of a fact, computing it when needed.
+
+        :param name: The name of the fact
+        :type name: str
+        :returns: The value of the fact
+        :raises KeyError: When no fact with the given name is registered
+
+        """
+        try:
+            return self._values[name]
+        except KeyError:
+            value = self._values[name] = _facts[name](self.request)
+            return value
+
+
+def get_request_facts(request):
+    """Return the facts of the given request.
+
+    :param request: The http request, or None outside of a request
+    :type request: django.http.HttpRequest
+    :returns: The facts of the request
+    :rtype: RequestFacts
+
+    """
+    if request is None:
+        return RequestFacts(None)
+    if not hasattr(request, "segment_facts"):
+        request.segment_facts = RequestFacts(request)
+    return request.segment_facts
+
+
+@register_fact("user_agent")
+def get_user_agent(request):
+    return parse(request.headers.get("user-agent", ""))
+
+
+def classify_user_agent(user_agent_string):
+    """Return the class of device a user agent string belongs to.
+
+    Classifications are cached, as parsing user agents is expensive and
+    most visitors use one of a small number of user agents.
+
+    :param user_agent_string: The User-Agent header
+    :type user_agent_string: str
+    :returns: ``"mobile"``, ``"tablet"``, ``"desktop"`` or None
+    :rtype: str
+
+    """
+    device_class = device_class_cache.get(user_agent_string, False)
+    if device_class is False:
+        user_agent = parse(user_agent_string)
+        if user_agent.is_mobile:
+            device_class = "mobile"
+        elif user_agent.is_tablet:
+            device_class = "tablet"
+        elif user_agent.is_pc:
+            device_class = "desktop"
+        else:
+            device_class = None
+        device_class_cache.set(user_agent_string, device_class)
+    return device_class
+
+
+@register_fact("device_class")
+def get_device_class(request):
+    return classify_user_agent(request.headers.get("user-agent", ""))
+
+
+register_fact("client_ip")(get_client_ip)
+
+
+@register_fact("now")
+def get_now(request):
+    return timezone.now()
+
+
+@register_fact("time")
+def get_time(request):
+    return get_request_facts(request).now.time()
+
+
+@register_fact("weekday")
+def get_weekday(request):
+    return get_request_facts(request).now.date().weekday()
+
+
+@register_fact("referer")
+def get_referer(request):
+    return request.headers.get("referer")
+
+
+@register_fact("is_authenticated")
+def get_is_authenticated(request):
+    return request.user.is_authenticated
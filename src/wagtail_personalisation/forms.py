@@ -1,17 +1,12 @@
 import functools
 from datetime import datetime
-from importlib import import_module
 
-from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
 from django.templatetags.static import static
-from django.test.client import RequestFactory
 from django.utils.translation import gettext_lazy as _
 from wagtail.admin.forms import WagtailAdminModelForm
 
-SessionStore = import_module(settings.SESSION_ENGINE).SessionStore
-
 
 @functools.lru_cache(maxsize=1000)
 def user_from_data(user_id):
@@ -23,6 +18,23 @@ def user_from_data(user_id):
 
 
 class SegmentAdminForm(WagtailAdminModelForm):
+    def test_static_rules(self, rules, user, match_any):
+        """Test static rules against a user outside of their requests.
+
+        :param rules: The static rules to test
+        :type rules: list of wagtail_personalisation.rules.AbstractBaseRule
+        :param user: The user to test
+        :type user: django.contrib.auth.models.AbstractBaseUser
+        :param match_any: Whether any rule needs to match, or all
+        :type match_any: bool
+        :returns: A boolean indicating the user matches the rules
+        :rtype: bool
+
+        """
+        if match_any:
+            return any(rule.test_user(None, user) for rule in rules)
+        return all(rule.test_user(None, user) for rule in rules)
+
     def count_matching_users(self, rules, match_any):
         """Calculates how many users match the given static rules"""
         count = 0
@@ -36,10 +48,7 @@ class SegmentAdminForm(WagtailAdminModelForm):
         users = User.objects.filter(is_active=True, is_staff=False)
 
         for user in users.iterator():
-            if match_any:
-                if any(rule.test_user(None, user) for rule in static_rules):
-                    count += 1
-            elif all(rule.test_user(None, user) for rule in static_rules):
+            if self.test_static_rules(static_rules, user, match_any):
                 count += 1
 
         return count
@@ -104,33 +113,32 @@ class SegmentAdminForm(WagtailAdminModelForm):
             self.instance.matched_count_updated_at = datetime.now()
 
         instance = super().save(*args, **kwargs)
+        rules = instance.get_rules() if is_new and instance.is_static else []
 
-        if is_new and instance.is_static and instance.all_rules_static:
-            from .adapters import get_segment_adapter
-
-            request = RequestFactory().get("/")
-            request.session = SessionStore()
-            adapter = get_segment_adapter(request)
-
+        if rules and instance.all_static(rules):
             users_to_add = []
             users_to_exclude = []
 
             User = get_user_model()
             users = User.objects.filter(is_active=True, is_staff=False)
 
+            available = instance.count - instance.member_count
+
             matched_count = 0
             for user in users.iterator():
-                request.user = user
-                passes = adapter._test_rules(
-                    instance.get_rules(), request, instance.match_any
-                )
-                if passes:
+                # Rules look up the session of each user themselves.
+                if self.test_static_rules(rules, user, instance.match_any):
                     matched_count += 1
-                    if instance.count == 0 or len(users_to_add) < instance.count:
-                        if instance.randomise_into_segment():
-                            users_to_add.append(user)
-                        else:
-                            users_to_exclude.append(user)
+                    if instance.count and len(users_to_add) >= available:
+                        continue
+                    if not instance.randomise_into_segment():
+                        users_to_exclude.append(user)
+                    else:
+                        users_to_add.append(user)
+
+            # Places for all added users are reserved at once.
+            if instance.count:
+                users_to_add = users_to_add[: instance.reserve_slots(len(users_to_add))]
 
             instance.matched_users_count = matched_count
             instance.matched_count_updated_at = datetime.now()
@@ -0,0 +1,77 @@
+import hashlib
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.safestring import mark_safe
+
+from wagtail_personalisation.utils import bump_version, get_cache, get_version
+
+FRAGMENT_VERSION_KEY = "wagtail_personalisation:fragment_version"
+
+
+def get_fragment_key(key_parts, context):
+    """Return the cache key of a rendered fragment.
+
+    The key covers the page and revision being rendered, and the fragment
+    version, which changes whenever a page is published or unpublished.
+
+    :param key_parts: JSON serialisable values identifying the fragment
+    :type key_parts: tuple
+    :param context: The template context
+    :type context: dict or django.template.Context
+    :returns: The cache key
+    :rtype: str
+
+    """
+    page = context.get("page")
+    page_id = getattr(page, "pk", None)
+    revision_id = getattr(page, "live_revision_id", None)
+    digest = hashlib.md5(
+        json.dumps(key_parts, cls=DjangoJSONEncoder, sort_keys=True).encode(),
+        usedforsecurity=False,
+    ).hexdigest()
+    version = get_version(FRAGMENT_VERSION_KEY)
+    return (
+        f"wagtail_personalisation:fragment:{version}:{page_id}:{revision_id}:{digest}"
+    )
+
+
+def render_fragment(key_parts, context, timeout, render):
+    """Return the rendered fragment, from the cache when available.
+
+    Fragments are only cached with a timeout and never for previews, as
+    previews show unpublished content.
+
+    :param key_parts: JSON serialisable values identifying the fragment
+    :type key_parts: tuple
+    :param context: The template context
+    :type context: dict or django.template.Context
+    :param timeout: The number of seconds to cache the fragment for
+    :type timeout: int or None
+    :param render: Callable rendering the fragment
+    :type render: callable
+    :returns: The rendered fragment
+    :rtype: django.utils.safestring.SafeString
+
+    """
+    request = context.get("request")
+    if not timeout or getattr(request, "is_preview", False):
+        return render()
+
+    cache = get_cache()
+    key = get_fragment_key(key_parts, context)
+    content = cache.get(key)
+    if content is None:
+        content = render()
+        cache.set(key, str(content), timeout)
+    return mark_safe(content)
+
+
+def invalidate_fragments(using=None):
+    """Discard all cached fragments.
+
+    :param using: The database alias of the current transaction
+    :type using: str
+
+    """
+    bump_version(FRAGMENT_VERSION_KEY, using=using)
@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from wagtail_personalisation.models import PageVisit
+
+
+class Command(BaseCommand):
+    help = "Delete the stored page visits of anonymous visitors that expired."
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        # Sessions expire at most SESSION_COOKIE_AGE after their last visit,
+        # visitors of the cache adapters after the adapter timeout.
+        session_expiry = now - timedelta(seconds=settings.SESSION_COOKIE_AGE)
+        visitor_expiry = now - timedelta(
+            seconds=getattr(
+                settings, "WAGTAIL_PERSONALISATION_ADAPTER_TIMEOUT", 60 * 60 * 24 * 30
+            )
+        )
+
+        deleted, _ = PageVisit.objects.filter(
+            Q(visitor_key__startswith="session:", last_visit__lt=session_expiry)
+            | Q(visitor_key__startswith="visitor:", last_visit__lt=visitor_expiry)
+        ).delete()
+
+        self.stdout.write(f"Deleted {deleted} page visits.")
@@ -0,0 +1,57 @@
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from wagtail.models import Page, get_page_models
+
+from wagtail_personalisation.models import (
+    PersonalisablePageMetadata,
+    PersonalisablePageMixin,
+)
+
+
+class Command(BaseCommand):
+    help = "Create the missing metadata of personalisable pages."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="The number of metadata rows created per query.",
+        )
+
+    def handle(self, *args, batch_size, **options):
+        models = [
+            model
+            for model in get_page_models()
+            if issubclass(model, PersonalisablePageMixin)
+        ]
+        content_types = ContentType.objects.get_for_models(
+            *models, for_concrete_models=False
+        ).values()
+
+        page_ids = (
+            Page.objects.filter(content_type__in=content_types)
+            .exclude(
+                pk__in=PersonalisablePageMetadata.objects.values("variant_id"),
+            )
+            .values_list("pk", flat=True)
+            .order_by("pk")
+        )
+
+        created = 0
+        last_page_id = 0
+        while batch := list(page_ids.filter(pk__gt=last_page_id)[:batch_size]):
+            # Rows created concurrently, e.g. for a new variant, are skipped.
+            PersonalisablePageMetadata.objects.bulk_create(
+                [
+                    PersonalisablePageMetadata(
+                        canonical_page_id=page_id, variant_id=page_id
+                    )
+                    for page_id in batch
+                ],
+                ignore_conflicts=True,
+            )
+            created += len(batch)
+            last_page_id = batch[-1]
+
+        self.stdout.write(f"Created metadata for {created} pages.")
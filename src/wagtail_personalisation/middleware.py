@@ -0,0 +1,41 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+
+class SegmentMiddleware:
+    """Let the segments adapter of a request persist its data.
+
+    Required by adapters that do not store their data in the session, like
+    ``wagtail_personalisation.adapters.CacheSegmentsAdapter``, and to complete
+    deferred refreshes of ``WAGTAIL_PERSONALISATION_LAZY_SEGMENTATION``.
+
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        response = self.get_response(request)
+
+        adapter = getattr(request, "segment_adapter", None)
+        if adapter is not None:
+            adapter.complete_refresh()
+            adapter.process_response(response)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+
+        adapter = getattr(request, "segment_adapter", None)
+        if adapter is not None:
+            await adapter.acomplete_refresh()
+            await adapter.aprocess_response(response)
+        return response
@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+def populate_member_count(apps, schema_editor):
+    Segment = apps.get_model("wagtail_personalisation", "Segment")
+    for segment in Segment.objects.all().iterator():
+        Segment.objects.filter(pk=segment.pk).update(
+            member_count=segment.static_users.count()
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("wagtail_personalisation", "0025_auto_20190822_0627"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="segment",
+            name="member_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_member_count, migrations.RunPython.noop),
+    ]
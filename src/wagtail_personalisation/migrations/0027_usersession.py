@@ -0,0 +1,61 @@
+from importlib import import_module
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def populate_user_sessions(apps, schema_editor):
+    Session = apps.get_model("sessions", "Session")
+    UserSession = apps.get_model("wagtail_personalisation", "UserSession")
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    SessionStore = import_module(settings.SESSION_ENGINE).SessionStore
+
+    session_keys = {}
+    sessions = Session.objects.filter(expire_date__gt=timezone.now())
+    for session in sessions.order_by("expire_date").iterator():
+        user_id = SessionStore().decode(session.session_data).get("_auth_user_id")
+        if user_id is not None:
+            session_keys[str(user_id)] = session.session_key
+
+    user_ids = User.objects.values_list("pk", flat=True)
+    UserSession.objects.bulk_create(
+        [
+            UserSession(user_id=user_id, session_key=session_keys[str(user_id)])
+            for user_id in user_ids.iterator()
+            if str(user_id) in session_keys
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sessions", "0001_initial"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("wagtail_personalisation", "0026_segment_member_count"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserSession",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="+",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("session_key", models.CharField(max_length=40)),
+            ],
+            options={
+                "verbose_name": "user session",
+            },
+        ),
+        migrations.RunPython(populate_user_sessions, migrations.RunPython.noop),
+    ]
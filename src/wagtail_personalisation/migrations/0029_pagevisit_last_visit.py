@@ -0,0 +1,18 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("wagtail_personalisation", "0028_pagevisit"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="pagevisit",
+            name="last_visit",
+            field=models.DateTimeField(
+                db_index=True, default=django.utils.timezone.now
+            ),
+        ),
+    ]
@@ -4,7 +4,9 @@ from django import forms
 from django.conf import settings
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models, transaction
+from django.db.models.functions import Coalesce, Greatest
 from django.template.defaultfilters import slugify
+from django.utils import timezone
 from django.utils.functional import cached_property
 from django.utils.safestring import mark_safe
 from django.utils.translation import gettext_lazy as _
@@ -13,10 +15,48 @@ from wagtail.admin.panels import FieldPanel, FieldRowPanel, InlinePanel, MultiFi
 from wagtail.models import Page
 
 from wagtail_personalisation.rules import AbstractBaseRule
-from wagtail_personalisation.utils import count_active_days
+from wagtail_personalisation.utils import aget_version, count_active_days, get_version
 
 from .forms import SegmentAdminForm
 
+MEMBERSHIP_VERSION_KEY = "wagtail_personalisation:membership_version"
+
+
+def get_membership_version_key(user_id):
+    """Return the cache key of the membership version of a user.
+
+    :param user_id: The primary key of the user
+    :type user_id: int or str
+    :returns: The cache key
+    :rtype: str
+
+    """
+    return f"{MEMBERSHIP_VERSION_KEY}:{user_id}"
+
+
+def get_membership_version(user_id):
+    """Return the version of the static and excluded memberships of a user.
+
+    The version changes when the memberships of the user change, or when
+    the memberships of an unknown set of users change.
+
+    :param user_id: The primary key of the user
+    :type user_id: int or str
+    :returns: The version token
+    :rtype: str
+
+    """
+    shared_version = get_version(MEMBERSHIP_VERSION_KEY)
+    user_version = get_version(get_membership_version_key(user_id))
+    return f"{shared_version}:{user_version}"
+
+
+async def aget_membership_version(user_id):
+    """Asynchronous version of :func:`get_membership_version`."""
+    shared_version = await aget_version(MEMBERSHIP_VERSION_KEY)
+    user_version = await aget_version(get_membership_version_key(user_id))
+    return f"{shared_version}:{user_version}"
+
 
 class RulePanel(InlinePanel):
     def on_model_bound(self):
@@ -30,6 +70,69 @@ class SegmentQuerySet(models.QuerySet):
     def enabled(self):
         return self.filter(status=self.model.STATUS_ENABLED)
 
+    def sync_member_counts(self, keep_reserved=False):
+        """Recalculate the stored number of static members of the segments.
+
+        :param keep_reserved: Never lower the stored count, so places that
+                              have been reserved but not filled yet are kept
+        :type keep_reserved: bool
+        :returns: The number of updated segments
+        :rtype: int
+
+        """
+        through = self.model.static_users.through
+        member_count = Coalesce(
+            models.Subquery(
+                through.objects.filter(segment=models.OuterRef("pk"))
+                .values("segment")
+                .annotate(count=models.Count("pk"))
+                .values("count")
+            ),
+            0,
+        )
+        if keep_reserved:
+            member_count = Greatest("member_count", member_count)
+        return self.update(member_count=member_count)
+
+    def increment_visit_counts(self, counts):
+        """Add visits to the segments using a single update query.
+
+        :param counts: The number of visits to add, keyed by segment id
+        :type counts: dict
+        :returns: The number of updated segments
+        :rtype: int
+
+        """
+        if not counts:
+            return 0
+        increment = models.Case(
+            *[
+                models.When(pk=segment_id, then=models.Value(count))
+                for segment_id, count in counts.items()
+            ],
+            default=models.Value(0),
+            output_field=models.PositiveIntegerField(),
+        )
+        return self.filter(pk__in=counts).update(
+            visit_count=models.F("visit_count") + increment
+        )
+
+    def with_rules(self):
+        """Prefetch the rules of the segments, using one query per rule model.
+
+        The prefetched rules are returned by ``Segment.get_rules``.
+
+        """
+        return self.prefetch_related(
+            *[
+                models.Prefetch(
+                    rule_model.get_segment_accessor_name(),
+                    queryset=rule_model.get_rule_queryset(),
+                )
+                for rule_model in AbstractBaseRule.get_descendant_models()
+            ]
+        )
+
 
 class Segment(ClusterableModel):
     """The segment model."""
@@ -92,6 +195,7 @@ class Segment(ClusterableModel):
     static_users = models.ManyToManyField(
         settings.AUTH_USER_MODEL,
     )
+    member_count = models.PositiveIntegerField(default=0, editable=False)
     excluded_users = models.ManyToManyField(
         settings.AUTH_USER_MODEL,
         help_text=_(
@@ -174,9 +278,100 @@ class Segment(ClusterableModel):
         rules = self.get_rules()
         return rules and self.all_static(rules)
 
+    @classmethod
+    def get_memberships(cls, user):
+        """Return the ids of the segments the user is a static member of and
+        of the segments the user is excluded from, using a single query.
+
+        :param user: The user to look up
+        :type user: django.contrib.auth.models.AbstractBaseUser
+        :returns: A tuple of static segment ids and excluded segment ids
+        :rtype: tuple of set
+
+        """
+        static_ids, excluded_ids = set(), set()
+        for segment_id, excluded in cls._get_memberships_queryset(user):
+            (excluded_ids if excluded else static_ids).add(segment_id)
+        return static_ids, excluded_ids
+
+    @classmethod
+    async def aget_memberships(cls, user):
+        """Return the ids of the segments the user is a static member of and
+        of the segments the user is excluded from.
+
+        Asynchronous version of :meth:`get_memberships`.
+
+        :param user: The user to look up
+        :type user: django.contrib.auth.models.AbstractBaseUser
+        :returns: A tuple of static segment ids and excluded segment ids
+        :rtype: tuple of set
+
+        """
+        static_ids, excluded_ids = set(), set()
+        async for segment_id, excluded in cls._get_memberships_queryset(user):
+            (excluded_ids if excluded else static_ids).add(segment_id)
+        return static_ids, excluded_ids
+
+    @classmethod
+    def _get_memberships_queryset(cls, user):
+        querysets = []
+        for field_name in ("static_users", "excluded_users"):
+            field = cls._meta.get_field(field_name)
+            querysets.append(
+                field.remote_field.through.objects.filter(
+                    **{field.m2m_reverse_field_name(): user.pk}
+                )
+                .annotate(excluded=models.Value(field_name == "excluded_users"))
+                .values_list(field.m2m_field_name(), "excluded")
+            )
+        return querysets[0].union(querysets[1], all=True)
+
     @property
     def is_full(self):
-        return self.static_users.count() >= self.count
+        return self.member_count >= self.count
+
+    def reserve_slot(self):
+        """Atomically reserve a place for a new member of a static segment.
+
+        The stored member count is only incremented while it is below the
+        segment's count, so concurrent requests cannot overfill the segment.
+
+        :returns: A boolean indicating whether a place was reserved
+        :rtype: bool
+
+        """
+        reserved = Segment.objects.filter(
+            pk=self.pk, member_count__lt=models.F("count")
+        ).update(member_count=models.F("member_count") + 1)
+        if reserved:
+            self.member_count += 1
+        else:
+            self.member_count = max(self.member_count, self.count)
+        return bool(reserved)
+
+    def reserve_slots(self, number):
+        """Atomically reserve places for new members of a static segment.
+
+        Places are reserved with a single conditional update, unless other
+        places were reserved concurrently, in which case the remaining
+        places are reserved instead.
+
+        :param number: The number of places to reserve
+        :type number: int
+        :returns: The number of places reserved
+        :rtype: int
+
+        """
+        while number > 0:
+            reserved = Segment.objects.filter(
+                pk=self.pk, member_count__lte=models.F("count") - number
+            ).update(member_count=models.F("member_count") + number)
+            if reserved:
+                self.member_count += number
+                return number
+            self.refresh_from_db(fields=["count", "member_count"])
+            number = min(number, self.count - self.member_count)
+        return 0
 
     def encoded_name(self):
         """Return a string with a slug for the segment."""
@@ -195,12 +390,22 @@ class Segment(ClusterableModel):
         return Page.objects.filter(_personalisable_page_metadata__segment=self)
 
     def get_rules(self):
-        """Retrieve all rules in the segment."""
+        """Retrieve all rules in the segment.
+
+        Rules prefetched with ``SegmentQuerySet.with_rules`` are returned
+        without querying the database.
+
+        """
         if self.pk is None:
             return []
+        prefetched = getattr(self, "_prefetched_objects_cache", {})
         segment_rules = []
         for rule_model in AbstractBaseRule.get_descendant_models():
-            segment_rules.extend(rule_model._default_manager.filter(segment=self))
+            accessor_name = rule_model.get_segment_accessor_name()
+            if accessor_name in prefetched:
+                segment_rules.extend(prefetched[accessor_name])
+            else:
+                segment_rules.extend(rule_model._default_manager.filter(segment=self))
 
         return segment_rules
 
@@ -227,6 +432,99 @@ class Segment(ClusterableModel):
         return False
 
 
+class UserSession(models.Model):
+    """The current session of a user.
+
+    Allows loading the session data of a user outside of their requests,
+    e.g. when testing static rules, without scanning all sessions.
+
+    """
+
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="+",
+    )
+    session_key = models.CharField(max_length=40)
+
+    class Meta:
+        verbose_name = _("user session")
+
+    def __str__(self):
+        return str(self.user_id)
+
+    @classmethod
+    def get_session_key(cls, user):
+        """Return the key of the current session of a user.
+
+        :param user: The user to return the session key for
+        :type user: django.contrib.auth.models.User
+        :returns: The session key, or None when the user has no session
+        :rtype: str
+
+        """
+        return (
+            cls.objects.filter(user_id=user.pk)
+            .values_list("session_key", flat=True)
+            .first()
+        )
+
+    @classmethod
+    def update(cls, user, session_key):
+        """Store the current session of a user.
+
+        :param user: The user the session belongs to
+        :type user: django.contrib.auth.models.User
+        :param session_key: The key of the session
+        :type session_key: str
+
+        """
+        cls.objects.update_or_create(
+            user_id=user.pk, defaults={"session_key": session_key}
+        )
+
+    @classmethod
+    async def aupdate(cls, user, session_key):
+        """Store the current session of a user.
+
+        Asynchronous version of :meth:`update`.
+
+        :param user: The user the session belongs to
+        :type user: django.contrib.auth.models.User
+        :param session_key: The key of the session
+        :type session_key: str
+
+        """
+        await cls.objects.aupdate_or_create(
+            user_id=user.pk, defaults={"session_key": session_key}
+        )
+
+
+class PageVisit(models.Model):
+    """The number of times a visitor visited a page.
+
+    Only used when ``WAGTAIL_PERSONALISATION_VISIT_STORE`` is configured,
+    otherwise page visits are stored in the session. The visits of anonymous
+    visitors are deleted by the ``clear_page_visits`` management command.
+
+    """
+
+    visitor_key = models.CharField(max_length=64)
+    page = models.ForeignKey(
+        "wagtailcore.Page", on_delete=models.CASCADE, related_name="+"
+    )
+    count = models.PositiveIntegerField(default=0)
+    last_visit = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        verbose_name = _("page visit")
+        unique_together = [("visitor_key", "page")]
+
+    def __str__(self):
+        return f"{self.visitor_key} - {self.page_id}"
+
+
 class PersonalisablePageMetadata(ClusterableModel):
     """The personalisable page model. Allows creation of variants with linked
     segments.
@@ -298,6 +596,10 @@ class PersonalisablePageMetadata(ClusterableModel):
         }
 
         with transaction.atomic():
+            if self._state.adding:
+                # The canonical metadata is only stored once it has variants.
+                self.save()
+
             new_page = self.canonical_page.copy(
                 update_attrs=update_attrs, copy_revisions=False
             )
@@ -328,12 +630,21 @@ class PersonalisablePageMixin:
 
     @cached_property
     def personalisation_metadata(self):
+        """Return the personalisation metadata of the page.
+
+        Pages without stored metadata get an unsaved canonical metadata
+        object, so reading it never writes to the database. It is saved once
+        the first variant of the page is created, or by the
+        ``create_personalisation_metadata`` management command.
+
+        :returns: The metadata of the page
+        :rtype: PersonalisablePageMetadata
+
+        """
         try:
             metadata = self._personalisable_page_metadata
         except AttributeError:
-            metadata = PersonalisablePageMetadata.objects.create(
-                canonical_page=self, variant=self
-            )
+            metadata = PersonalisablePageMetadata(canonical_page=self, variant=self)
         return metadata
 
     def get_sitemap_urls(self, request=None):
@@ -0,0 +1,95 @@
+import threading
+
+from django.conf import settings
+
+
+class RuleStatistics:
+    """Keep track of how often rules match within the current process."""
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def _key(self, rule):
+        return (rule._meta.label, rule.pk)
+
+    def observe(self, rule, result):
+        """Record the outcome of testing a rule.
+
+        :param rule: The tested rule
+        :type rule: wagtail_personalisation.rules.AbstractBaseRule
+        :param result: Whether the rule matched
+        :type result: bool
+
+        """
+        if rule.pk is None:
+            return
+
+        key = self._key(rule)
+        with self._lock:
+            tested, matched = self._counts.get(key, (0, 0))
+            self._counts[key] = (tested + 1, matched + bool(result))
+
+    def get_match_rate(self, rule):
+        """Return the estimated chance that the rule matches.
+
+        Rules that have not been tested yet are expected to match half of
+        the time.
+
+        :param rule: The rule to return the match rate for
+        :type rule: wagtail_personalisation.rules.AbstractBaseRule
+        :returns: The match rate, between 0 and 1 exclusive
+        :rtype: float
+
+        """
+        tested, matched = self._counts.get(self._key(rule), (0, 0))
+        return (matched + 1) / (tested + 2)
+
+    def reset(self):
+        """Forget all recorded outcomes."""
+        with self._lock:
+            self._counts.clear()
+
+
+_statistics = RuleStatistics()
+
+
+def get_rule_statistics():
+    """Return the rule statistics when ordering by selectivity is enabled.
+
+    :returns: The rule statistics of this process, or None
+    :rtype: RuleStatistics or None
+
+    """
+    if getattr(settings, "WAGTAIL_PERSONALISATION_RULE_SELECTIVITY", False):
+        return _statistics
+    return None
+
+
+def order_rules(rules, match_any=False, statistics=None):
+    """Order rules so that testing them can stop as early as possible.
+
+    Without statistics, rules are ordered by their estimated cost. With
+    statistics, rules are ordered by their cost per chance of deciding the
+    outcome: not matching when all rules must match, or matching when any
+    rule may match.
+
+    :param rules: The rules to order
+    :type rules: list of wagtail_personalisation.rules.AbstractBaseRule
+    :param match_any: Whether all rules need to match, or any
+    :type match_any: bool
+    :param statistics: The observed match rates of the rules
+    :type statistics: RuleStatistics
+    :returns: The ordered rules
+    :rtype: list of wagtail_personalisation.rules.AbstractBaseRule
+
+    """
+    if statistics is None:
+        return sorted(rules, key=lambda rule: rule.cost)
+
+    def rank(rule):
+        match_rate = statistics.get_match_rate(rule)
+        decisive_rate = match_rate if match_any else 1 - match_rate
+        return rule.cost / decisive_rate
+
+    return sorted(rules, key=rank)
@@ -1,7 +1,32 @@
-from django.db.models.signals import pre_save
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
 from django.utils import timezone
+from wagtail.signals import page_published, page_unpublished
 
-from wagtail_personalisation.models import Segment
+from wagtail_personalisation.catalog import invalidate_catalog
+from wagtail_personalisation.fragments import invalidate_fragments
+from wagtail_personalisation.models import (
+    MEMBERSHIP_VERSION_KEY,
+    PersonalisablePageMetadata,
+    PersonalisablePageMixin,
+    Segment,
+    UserSession,
+    get_membership_version_key,
+)
+from wagtail_personalisation.references import (
+    invalidate_segment_references,
+    store_segment_references,
+)
+from wagtail_personalisation.rules import AbstractBaseRule
+from wagtail_personalisation.utils import bump_version, bump_versions
+from wagtail_personalisation.variants import invalidate_page_variants
 
 
 def check_status_change(sender, instance, *args, **kwargs):
@@ -20,5 +45,144 @@ def check_status_change(sender, instance, *args, **kwargs):
             instance.disable_date = timezone.now()
 
 
+def segment_catalog_changed(sender, using=None, **kwargs):
+    """Invalidate the segment catalog when a segment or rule changes."""
+    invalidate_catalog(using=using)
+
+
+def segment_membership_changed(
+    sender, instance, action, reverse, pk_set, using=None, **kwargs
+):
+    """Invalidate the cached static and excluded segments of changed users."""
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+
+    if reverse:
+        user_ids = [instance.pk]
+    elif pk_set is not None:
+        user_ids = pk_set
+    else:
+        # The users removed by clearing a segment are not known anymore.
+        bump_version(MEMBERSHIP_VERSION_KEY, using=using)
+        return
+
+    bump_versions(
+        [get_membership_version_key(user_id) for user_id in user_ids], using=using
+    )
+
+
+def static_members_changed(
+    sender, instance, action, reverse, pk_set, using=None, **kwargs
+):
+    """Keep the stored member count of static segments in sync."""
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+
+    if not reverse:
+        segments = Segment.objects.filter(pk=instance.pk)
+    elif pk_set is not None:
+        segments = Segment.objects.filter(pk__in=pk_set)
+    else:
+        segments = Segment.objects.filter(type=Segment.TYPE_STATIC)
+
+    # Places reserved by Segment.reserve_slot are filled by adding users, so
+    # additions must not undo reservations that are still being filled.
+    segments.sync_member_counts(keep_reserved=action == "post_add")
+
+    # The catalog decides whether static segments are full, so it must see
+    # the places that have been freed.
+    if action != "post_add":
+        invalidate_catalog(using=using)
+
+
+def static_member_deleting(sender, instance, **kwargs):
+    """Remember the static segments of a user that is being deleted.
+
+    The memberships of deleted users are removed without ``m2m_changed``.
+
+    """
+    instance._static_segment_ids = list(
+        Segment.objects.filter(static_users=instance).values_list("pk", flat=True)
+    )
+
+
+def static_member_deleted(sender, instance, using=None, **kwargs):
+    """Free the places a deleted user held in static segments."""
+    segment_ids = getattr(instance, "_static_segment_ids", None)
+    if segment_ids:
+        Segment.objects.filter(pk__in=segment_ids).sync_member_counts()
+        invalidate_catalog(using=using)
+
+
+def page_metadata_changed(sender, instance, using=None, **kwargs):
+    """Discard the cached variants of the pages the metadata belongs to."""
+    invalidate_page_variants(
+        [instance.canonical_page_id, instance.variant_id], using=using
+    )
+
+
+def page_publication_changed(sender, instance, **kwargs):
+    """Discard the cached variants of a published or unpublished page."""
+    if not isinstance(instance, PersonalisablePageMixin):
+        return
+
+    canonical_page_ids = PersonalisablePageMetadata.objects.filter(
+        variant_id=instance.pk
+    ).values_list("canonical_page_id", flat=True)
+    invalidate_page_variants([instance.pk, *canonical_page_ids])
+
+
+def page_fragments_changed(sender, instance, **kwargs):
+    """Discard the cached fragments when any page is published or unpublished."""
+    invalidate_fragments()
+
+
+def page_references_published(sender, instance, **kwargs):
+    """Collect the segments referenced by a published page revision."""
+    store_segment_references(instance.specific, instance.live_revision_id)
+
+
+def page_references_unpublished(sender, instance, **kwargs):
+    """Discard the segments referenced by an unpublished page."""
+    invalidate_segment_references(instance.pk)
+
+
+def user_session_started(sender, request, user, **kwargs):
+    """Store the session of a user that logged in."""
+    session_key = getattr(getattr(request, "session", None), "session_key", None)
+    if session_key:
+        UserSession.update(user, session_key)
+        request.session["user_session_key"] = session_key
+
+
+def user_session_ended(sender, request, user, **kwargs):
+    """Forget the session of a user that logged out."""
+    session_key = getattr(getattr(request, "session", None), "session_key", None)
+    if user is not None and session_key:
+        UserSession.objects.filter(user_id=user.pk, session_key=session_key).delete()
+
+
 def register():
     pre_save.connect(check_status_change, sender=Segment)
+
+    for model in [Segment, *AbstractBaseRule.get_descendant_models()]:
+        post_save.connect(segment_catalog_changed, sender=model)
+        post_delete.connect(segment_catalog_changed, sender=model)
+
+    for through in (Segment.static_users.through, Segment.excluded_users.through):
+        m2m_changed.connect(segment_membership_changed, sender=through)
+    m2m_changed.connect(static_members_changed, sender=Segment.static_users.through)
+    pre_delete.connect(static_member_deleting, sender=get_user_model())
+    post_delete.connect(static_member_deleted, sender=get_user_model())
+
+    post_save.connect(page_metadata_changed, sender=PersonalisablePageMetadata)
+    post_delete.connect(page_metadata_changed, sender=PersonalisablePageMetadata)
+    page_published.connect(page_publication_changed)
+    page_unpublished.connect(page_publication_changed)
+    page_published.connect(page_fragments_changed)
+    page_unpublished.connect(page_fragments_changed)
+    page_published.connect(page_references_published)
+    page_unpublished.connect(page_references_unpublished)
+
+    user_logged_in.connect(user_session_started)
+    user_logged_out.connect(user_session_ended)
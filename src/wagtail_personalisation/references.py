@@ -0,0 +1,112 @@
+from wagtail import blocks
+from wagtail.fields import StreamField
+
+from wagtail_personalisation.blocks import PersonalisedStructBlock
+from wagtail_personalisation.utils import get_cache
+
+KEY_PREFIX = "wagtail_personalisation:references"
+
+
+def _get_key(page_id):
+    return f"{KEY_PREFIX}:{page_id}"
+
+
+def _collect_block(block, value, segment_ids):
+    # Values are walked in their stored form, so no chooser or snippet
+    # values are loaded from the database.
+    if isinstance(block, PersonalisedStructBlock) and isinstance(value, dict):
+        try:
+            segment_id = int(value.get("segment"))
+        except (ValueError, TypeError):
+            segment_id = None
+        if segment_id is not None and segment_id > 0:
+            segment_ids.add(segment_id)
+
+    if isinstance(block, blocks.StreamBlock) and isinstance(value, list):
+        for item in value:
+            if not isinstance(item, dict):
+                continue
+            child_block = block.child_blocks.get(item.get("type"))
+            if child_block is not None:
+                _collect_block(child_block, item.get("value"), segment_ids)
+    elif isinstance(block, blocks.StructBlock) and isinstance(value, dict):
+        for name, child_block in block.child_blocks.items():
+            _collect_block(child_block, value.get(name), segment_ids)
+    elif isinstance(block, blocks.ListBlock) and isinstance(value, list):
+        for item in value:
+            # List items are stored with an id, except in older revisions.
+            if isinstance(item, dict) and item.get("type") == "item":
+                item = item.get("value")
+            _collect_block(block.child_block, item, segment_ids)
+
+
+def collect_segment_references(page):
+    """Return the ids of the segments referenced by the content of a page.
+
+    All ``PersonalisedStructBlock`` values in the stream fields of the page
+    are collected, including nested ones.
+
+    :param page: The specific page
+    :type page: wagtail.models.Page
+    :returns: The referenced segment ids
+    :rtype: set of int
+
+    """
+    segment_ids = set()
+    for field in page._meta.concrete_fields:
+        if not isinstance(field, StreamField):
+            continue
+        stream_value = getattr(page, field.attname)
+        if stream_value is None:
+            continue
+        _collect_block(field.stream_block, list(stream_value.raw_data), segment_ids)
+    return segment_ids
+
+
+def store_segment_references(page, revision_id):
+    """Collect and cache the segments referenced by a page revision.
+
+    :param page: The specific page, with the content of the revision
+    :type page: wagtail.models.Page
+    :param revision_id: The id of the revision
+    :type revision_id: int
+    :returns: The referenced segment ids
+    :rtype: set of int
+
+    """
+    segment_ids = collect_segment_references(page)
+    get_cache().set(
+        _get_key(page.pk),
+        {"revision": revision_id, "segments": sorted(segment_ids)},
+        timeout=None,
+    )
+    return segment_ids
+
+
+def get_segment_references(page):
+    """Return the ids of the segments referenced by the live page.
+
+    The references are collected when a page is published. Pages published
+    before, or whose references were evicted from the cache, are collected
+    when they are served.
+
+    :param page: The specific live page
+    :type page: wagtail.models.Page
+    :returns: The referenced segment ids
+    :rtype: set of int
+
+    """
+    entry = get_cache().get(_get_key(page.pk))
+    if entry is None or entry["revision"] != page.live_revision_id:
+        return store_segment_references(page, page.live_revision_id)
+    return set(entry["segments"])
+
+
+def invalidate_segment_references(page_id):
+    """Discard the cached segment references of a page.
+
+    :param page_id: The id of the page
+    :type page_id: int
+
+    """
+    get_cache().delete(_get_key(page_id))
@@ -0,0 +1,279 @@
+import functools
+import re
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+# Referers are cut off at this length before matching, which bounds the time
+# spent on a single match.
+MAX_REFERER_LENGTH = 2048
+
+_REPEATS = {
+    sre_parse.MAX_REPEAT,
+    sre_parse.MIN_REPEAT,
+    getattr(sre_parse, "POSSESSIVE_REPEAT", None),
+}
+
+
+@functools.lru_cache(maxsize=1000)
+def compile_pattern(regex_string):
+    """Return the compiled regular expression of a referral rule."""
+    return re.compile(regex_string)
+
+
+_CATEGORIES = {
+    sre_parse.CATEGORY_DIGIT: r"\d",
+    sre_parse.CATEGORY_NOT_DIGIT: r"\D",
+    sre_parse.CATEGORY_SPACE: r"\s",
+    sre_parse.CATEGORY_NOT_SPACE: r"\S",
+    sre_parse.CATEGORY_WORD: r"\w",
+    sre_parse.CATEGORY_NOT_WORD: r"\W",
+}
+
+
+def _children(op, av):
+    """Return the subpatterns contained in an opcode."""
+    if op in _REPEATS:
+        return [av[2]]
+    if op is sre_parse.SUBPATTERN:
+        return [av[-1]]
+    if op is sre_parse.BRANCH:
+        return list(av[1])
+    if op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+        return [av[1]]
+    if op is sre_parse.GROUPREF_EXISTS:
+        return [item for item in av[1:] if item is not None]
+    if op is getattr(sre_parse, "ATOMIC_GROUP", None):
+        return [av]
+    return []
+
+
+def _walk(subpattern):
+    """Yield the opcodes and arguments of a parsed pattern, recursively."""
+    for op, av in subpattern:
+        yield op, av
+        for child in _children(op, av):
+            yield from _walk(child)
+
+
+def _matches_char(op, av, char):
+    """Return whether a single character opcode can match the character.
+
+    Opcodes that are not understood are assumed to match.
+
+    """
+    if op is sre_parse.LITERAL:
+        return char == chr(av)
+    if op is sre_parse.NOT_LITERAL:
+        return char != chr(av)
+    if op is not sre_parse.IN:
+        return True
+
+    negate = False
+    matched = False
+    for item_op, item_av in av:
+        if item_op is sre_parse.NEGATE:
+            negate = True
+        elif item_op is sre_parse.LITERAL:
+            matched = matched or char == chr(item_av)
+        elif item_op is sre_parse.RANGE:
+            matched = matched or item_av[0] <= ord(char) <= item_av[1]
+        elif item_op is sre_parse.CATEGORY and item_av in _CATEGORIES:
+            matched = matched or bool(re.match(_CATEGORIES[item_av], char))
+        else:
+            return True
+    return matched != negate
+
+
+def _can_consume(subpattern, chars):
+    """Return whether a parsed pattern can consume any of the characters."""
+    for op, av in subpattern:
+        if op in (sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            continue
+        children = _children(op, av)
+        if children:
+            if any(_can_consume(child, chars) for child in children):
+                return True
+        elif any(_matches_char(op, av, char) for char in chars):
+            return True
+    return False
+
+
+def _separators(subpattern):
+    """Yield the sets of characters of which the pattern requires one.
+
+    Only literals and classes of literals outside of repeats, branches and
+    conditionals are considered.
+
+    """
+    for op, av in subpattern:
+        if op is sre_parse.LITERAL:
+            yield {chr(av)}
+        elif op is sre_parse.IN and all(
+            item_op is sre_parse.LITERAL for item_op, _ in av
+        ):
+            yield {chr(item_av) for _, item_av in av}
+        elif op is sre_parse.SUBPATTERN:
+            yield from _separators(av[-1])
+
+
+def _is_unsafe_repeat(av):
+    r"""Return whether a repeat can backtrack catastrophically.
+
+    An unbounded repeat of a pattern containing unbounded repeats is only
+    safe when each repetition requires a separator character which none of
+    the inner repeats can consume, like the dot in ``(\w+\.)+``. The number
+    of repetitions is then fixed by the number of separators.
+
+    """
+    low, high, item = av
+    if high != sre_parse.MAXREPEAT:
+        return False
+
+    inner_repeats = [
+        inner_av[2]
+        for op, inner_av in _walk(item)
+        if op in _REPEATS and inner_av[1] == sre_parse.MAXREPEAT
+    ]
+    if not inner_repeats:
+        return False
+
+    for chars in _separators(item):
+        # Both cases are checked, as parts of the pattern may ignore case.
+        chars = (
+            chars | {char.lower() for char in chars} | {char.upper() for char in chars}
+        )
+        if not any(_can_consume(inner, chars) for inner in inner_repeats):
+            return False
+    return True
+
+
+def check_pattern(regex_string):
+    r"""Check that a referral pattern is valid and cannot backtrack
+    catastrophically.
+
+    Patterns repeating an unbounded repeat without a separator, like
+    ``(a+)+`` or ``(.*)*``, can take exponential time on referers that almost
+    match, so they are rejected. Repeats with a separator, like
+    ``([a-z]+\.)*``, are accepted.
+
+    :param regex_string: The regular expression to check
+    :type regex_string: str
+    :raises ValueError: When the pattern is invalid or unsafe
+
+    """
+    try:
+        parsed = sre_parse.parse(regex_string)
+    except re.error as error:
+        raise ValueError(str(error)) from error
+
+    if any(op in _REPEATS and _is_unsafe_repeat(av) for op, av in _walk(parsed)):
+        raise ValueError("nested repeats like (a+)+ are not supported")
+
+
+def _is_combinable(regex_string):
+    """Return whether a pattern can be embedded in a combined pattern."""
+    try:
+        parsed = sre_parse.parse(regex_string)
+    except re.error:
+        return False
+
+    state = getattr(parsed, "state", None) or parsed.pattern
+    if state.groupdict or state.flags & ~re.UNICODE:
+        return False
+    references = (sre_parse.GROUPREF, sre_parse.GROUPREF_EXISTS)
+    return not any(op in references for op, av in _walk(parsed))
+
+
+class ReferralMatcher:
+    """Match a referer against the patterns of many referral rules at once.
+
+    Patterns are merged into a single regular expression of optional
+    lookaheads, each setting an empty group when its pattern is found. One
+    match therefore reports every matching rule. Patterns that cannot be
+    merged, because they use group references, named groups or global
+    flags, are matched separately.
+
+    """
+
+    def __init__(self, patterns):
+        """Create a matcher for the given patterns.
+
+        :param patterns: The regular expressions, keyed by rule id
+        :type patterns: dict
+
+        """
+        self.patterns = patterns
+        self._groups = {}
+        self._separate = {}
+
+        parts = []
+        for index, (rule_id, regex_string) in enumerate(patterns.items()):
+            if _is_combinable(regex_string):
+                group = f"_referral_{index}"
+                self._groups[group] = rule_id
+                parts.append(f"(?:(?=(?s:.*?)(?:{regex_string}))(?P<{group}>))?")
+            else:
+                try:
+                    self._separate[rule_id] = compile_pattern(regex_string)
+                except re.error:
+                    continue
+
+        self._combined = None
+        if parts:
+            try:
+                self._combined = re.compile("".join(parts))
+            except re.error:
+                self._separate.update(
+                    (rule_id, compile_pattern(patterns[rule_id]))
+                    for rule_id in self._groups.values()
+                )
+                self._groups = {}
+
+    @classmethod
+    def for_rules(cls, rules):
+        """Create a matcher for the given referral rules.
+
+        :param rules: The referral rules to match
+        :type rules: list of wagtail_personalisation.rules.ReferralRule
+        :returns: The matcher
+        :rtype: ReferralMatcher
+
+        """
+        return cls({rule.pk: rule.regex_string for rule in rules})
+
+    def covers(self, rule):
+        """Return whether the matcher matches the current pattern of a rule.
+
+        :param rule: The referral rule
+        :type rule: wagtail_personalisation.rules.ReferralRule
+        :rtype: bool
+
+        """
+        return self.patterns.get(rule.pk) == rule.regex_string
+
+    def match(self, referer):
+        """Return the ids of the rules matching the referer.
+
+        :param referer: The referer of the request
+        :type referer: str
+        :returns: The ids of the matching rules
+        :rtype: set
+
+        """
+        referer = referer[:MAX_REFERER_LENGTH]
+        matches = {
+            rule_id
+            for rule_id, pattern in self._separate.items()
+            if pattern.search(referer)
+        }
+        if self._combined is not None:
+            groups = self._combined.match(referer).groupdict()
+            matches.update(
+                self._groups[group]
+                for group, value in groups.items()
+                if value is not None
+            )
+        return matches
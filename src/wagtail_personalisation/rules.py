@@ -1,31 +1,46 @@
 import logging
-import re
+import threading
 from importlib import import_module
 from importlib.util import find_spec
 
 import pycountry
+from asgiref.sync import sync_to_async
 from django.apps import apps
 from django.conf import settings
-from django.contrib.sessions.models import Session
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from django.db import models
 from django.template.defaultfilters import slugify
 from django.test.client import RequestFactory
-from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from modelcluster.fields import ParentalKey
-from user_agents import parse
 from wagtail.admin.panels import FieldPanel, FieldRowPanel
 
-from wagtail_personalisation.utils import get_client_ip
+from wagtail_personalisation.facts import get_request_facts, register_fact
+from wagtail_personalisation.referrals import (
+    MAX_REFERER_LENGTH,
+    check_pattern,
+    compile_pattern,
+)
+from wagtail_personalisation.utils import LRUCache
+from wagtail_personalisation.visits import get_visit_store
 
 SessionStore = import_module(settings.SESSION_ENGINE).SessionStore
 
 logger = logging.getLogger(__name__)
 
+GEOIP2_AVAILABLE = find_spec("geoip2") is not None
+
+# Country codes looked up with GeoIP2, keyed by client IP.
+geoip_country_cache = LRUCache(
+    getattr(settings, "WAGTAIL_PERSONALISATION_GEOIP_CACHE_SIZE", 10000)
+)
+
+_geoip = None
+_geoip_lock = threading.Lock()
+
 
 def get_geoip_module():
-    if not find_spec("geoip2"):
+    if not GEOIP2_AVAILABLE:
         return None
     try:
         from django.contrib.gis.geoip2 import GeoIP2
@@ -44,11 +59,45 @@ def get_geoip_module():
         )
 
 
+def get_geoip_reader():
+    """Return the GeoIP2 reader shared by all requests of this process.
+
+    The database is opened once, using the mode configured by
+    ``WAGTAIL_PERSONALISATION_GEOIP_MODE`` (e.g. ``GeoIP2.MODE_MMAP``).
+
+    :returns: The GeoIP2 reader, or None when GeoIP2 is not available
+    :rtype: django.contrib.gis.geoip2.GeoIP2
+
+    """
+    global _geoip
+
+    GeoIP2 = get_geoip_module()
+    if GeoIP2 is None:
+        return None
+
+    geoip = _geoip
+    if geoip is None or geoip[0] is not GeoIP2:
+        with _geoip_lock:
+            geoip = _geoip
+            if geoip is None or geoip[0] is not GeoIP2:
+                mode = getattr(settings, "WAGTAIL_PERSONALISATION_GEOIP_MODE", None)
+                reader = GeoIP2() if mode is None else GeoIP2(cache=mode)
+                geoip = _geoip = (GeoIP2, reader)
+                geoip_country_cache.clear()
+    return geoip[1]
+
+
 class AbstractBaseRule(models.Model):
     """Base for creating rules to segment users with."""
 
     icon = "radio-empty"
     static = False
+    # Estimated relative cost of testing the rule, cheaper rules are tested
+    # first so that expensive ones can be skipped.
+    cost = 10
+    # Whether testing the rule may block, e.g. on database queries. The
+    # asynchronous test of blocking rules runs in a thread.
+    blocking = True
 
     segment = ParentalKey(
         "wagtail_personalisation.Segment",
@@ -66,6 +115,22 @@ class AbstractBaseRule(models.Model):
         """Test if the user matches this rule."""
         return True
 
+    async def atest_user(self, request=None):
+        """Asynchronously test if the user matches this rule.
+
+        Calls :meth:`test_user`, in a thread for blocking rules. Override to
+        test rules without blocking the event loop.
+
+        :param request: The http request
+        :type request: django.http.HttpRequest
+        :returns: A boolean indicating the rule matches the request
+        :rtype: bool
+
+        """
+        if not self.blocking:
+            return self.test_user(request)
+        return await sync_to_async(self.test_user)(request)
+
     def encoded_name(self):
         """Return a string with a slug for the rule."""
         return slugify(str(self).lower())
@@ -91,6 +156,21 @@ class AbstractBaseRule(models.Model):
             model for model in apps.get_models() if issubclass(model, AbstractBaseRule)
         ]
 
+    @classmethod
+    def get_segment_accessor_name(cls):
+        """Return the name of the relation from a segment to these rules."""
+        return cls._meta.get_field("segment").related_query_name()
+
+    @classmethod
+    def get_rule_queryset(cls):
+        """Return the rules of this type with their foreign keys preloaded."""
+        related_fields = [
+            field.name
+            for field in cls._meta.concrete_fields
+            if field.many_to_one and field.name != "segment"
+        ]
+        return cls._default_manager.select_related(*related_fields)
+
 
 class TimeRule(AbstractBaseRule):
     """Time rule to segment users based on a start and end time.
@@ -101,6 +181,8 @@ class TimeRule(AbstractBaseRule):
     """
 
     icon = "clock"
+    cost = 2
+    blocking = False
 
     start_time = models.TimeField(_("Starting time"))
     end_time = models.TimeField(_("Ending time"))
@@ -118,7 +200,7 @@ class TimeRule(AbstractBaseRule):
         verbose_name = _("Time Rule")
 
     def test_user(self, request=None):
-        return self.start_time <= timezone.now().time() <= self.end_time
+        return self.start_time <= get_request_facts(request).time <= self.end_time
 
     def description(self):
         return {
@@ -138,6 +220,8 @@ class DayRule(AbstractBaseRule):
     """
 
     icon = "calendar-check"
+    cost = 2
+    blocking = False
 
     mon = models.BooleanField(_("Monday"), default=False)
     tue = models.BooleanField(_("Tuesday"), default=False)
@@ -162,7 +246,7 @@ class DayRule(AbstractBaseRule):
 
     def test_user(self, request=None):
         return [self.mon, self.tue, self.wed, self.thu, self.fri, self.sat, self.sun][
-            timezone.now().date().weekday()
+            get_request_facts(request).weekday
         ]
 
     def description(self):
@@ -193,6 +277,8 @@ class ReferralRule(AbstractBaseRule):
     """
 
     icon = "globe"
+    cost = 5
+    blocking = False
 
     regex_string = models.TextField(_("Regular expression to match the referrer"))
 
@@ -203,14 +289,27 @@ class ReferralRule(AbstractBaseRule):
     class Meta:
         verbose_name = _("Referral Rule")
 
+    def clean(self):
+        super().clean()
+        try:
+            check_pattern(self.regex_string)
+        except ValueError as error:
+            raise ValidationError(
+                {"regex_string": _("Invalid regular expression: %s") % error}
+            ) from error
+
     def test_user(self, request):
-        pattern = re.compile(self.regex_string)
+        facts = get_request_facts(request)
+        if facts.referer is None:
+            return False
 
-        if "referer" in request.headers:
-            referer = request.headers["referer"]
-            if pattern.search(referer):
-                return True
-        return False
+        # Use the result of matching the patterns of all rules in the segment
+        # catalog at once, unless this rule is not part of it.
+        if facts.referral_matcher.covers(self):
+            return self.pk in facts.referral_matches
+
+        pattern = compile_pattern(self.regex_string)
+        return pattern.search(facts.referer[:MAX_REFERER_LENGTH]) is not None
 
     def description(self):
         return {
@@ -231,6 +330,7 @@ class VisitCountRule(AbstractBaseRule):
 
     icon = "calculator"
     static = True
+    cost = 5
 
     OPERATOR_CHOICES = (
         ("more_than", _("More than")),
@@ -263,11 +363,12 @@ class VisitCountRule(AbstractBaseRule):
         verbose_name = _("Visit count Rule")
 
     def _get_user_session(self, user):
-        sessions = Session.objects.iterator()
-        for session in sessions:
-            session_data = session.get_decoded()
-            if session_data.get("_auth_user_id") == str(user.id):
-                return SessionStore(session_key=session.session_key)
+        # Local import for cyclic import
+        from wagtail_personalisation.models import UserSession
+
+        session_key = UserSession.get_session_key(user)
+        if session_key is not None:
+            return SessionStore(session_key=session_key)
         return SessionStore()
 
     def test_user(self, request, user=None):
@@ -290,7 +391,10 @@ class VisitCountRule(AbstractBaseRule):
             request.user = user
 
             # If we're using the session adapter check for an active session
-            if SEGMENT_ADAPTER_CLASS == SessionSegmentsAdapter:  # noqa: SIM300
+            if (
+                SEGMENT_ADAPTER_CLASS == SessionSegmentsAdapter  # noqa: SIM300
+                and get_visit_store() is None
+            ):
                 request.session = self._get_user_session(user)
             else:
                 request.session = SessionStore()
@@ -299,12 +403,32 @@ class VisitCountRule(AbstractBaseRule):
             # Return false if we don't have a user or a request
             return False
 
-        operator = self.operator
-        segment_count = self.count
+        adapter = get_segment_adapter(request)
+        return self._match_visit_count(adapter.get_visit_count(self.counted_page))
+
+    async def atest_user(self, request=None, user=None):
+        # Local import for cyclic import
+        from wagtail_personalisation.adapters import get_segment_adapter
+
+        # Rules of the catalog have their counted page loaded, other rules
+        # and users outside of their requests are tested in a thread.
+        if (
+            request is None
+            or user is not None
+            or not VisitCountRule.counted_page.is_cached(self)
+        ):
+            return await sync_to_async(self.test_user)(request, user)
 
         adapter = get_segment_adapter(request)
+        return self._match_visit_count(
+            await adapter.aget_visit_count(self.counted_page)
+        )
+
+    def _match_visit_count(self, visit_count):
+        """Return whether a number of visits matches the rule."""
+        operator = self.operator
+        segment_count = self.count
 
-        visit_count = adapter.get_visit_count(self.counted_page)
         if visit_count and operator == "more_than":
             if visit_count > segment_count:
                 return True
@@ -338,7 +462,10 @@ class VisitCountRule(AbstractBaseRule):
         request.user = user
 
         # If we're using the session adapter check for an active session
-        if SEGMENT_ADAPTER_CLASS == SessionSegmentsAdapter:  # noqa: SIM300
+        if (
+            SEGMENT_ADAPTER_CLASS == SessionSegmentsAdapter  # noqa: SIM300
+            and get_visit_store() is None
+        ):
             request.session = self._get_user_session(user)
         else:
             request.session = SessionStore()
@@ -357,6 +484,8 @@ class QueryRule(AbstractBaseRule):
     """
 
     icon = "link"
+    cost = 1
+    blocking = False
 
     parameter = models.SlugField(_("The query parameter to search for"), max_length=20)
     value = models.SlugField(_("The value of the parameter to match"), max_length=20)
@@ -389,6 +518,8 @@ class DeviceRule(AbstractBaseRule):
     """
 
     icon = "tablet-alt"
+    cost = 20
+    blocking = False
 
     mobile = models.BooleanField(_("Mobile phone"), default=False)
     tablet = models.BooleanField(_("Tablet"), default=False)
@@ -404,16 +535,10 @@ class DeviceRule(AbstractBaseRule):
         verbose_name = _("Device Rule")
 
     def test_user(self, request=None):
-        ua_header = request.headers["user-agent"]
-        user_agent = parse(ua_header)
-
-        if user_agent.is_mobile:
-            return self.mobile
-        if user_agent.is_tablet:
-            return self.tablet
-        if user_agent.is_pc:
-            return self.desktop
-        return False
+        device_class = get_request_facts(request).device_class
+        if device_class is None:
+            return False
+        return getattr(self, device_class)
 
 
 class UserIsLoggedInRule(AbstractBaseRule):
@@ -425,6 +550,8 @@ class UserIsLoggedInRule(AbstractBaseRule):
     """
 
     icon = "user"
+    cost = 1
+    blocking = False
 
     is_logged_in = models.BooleanField(default=False)
 
@@ -436,7 +563,15 @@ class UserIsLoggedInRule(AbstractBaseRule):
         verbose_name = _("Logged in Rule")
 
     def test_user(self, request=None):
-        return request.user.is_authenticated == self.is_logged_in
+        return get_request_facts(request).is_authenticated == self.is_logged_in
+
+    async def atest_user(self, request=None):
+        # Loading the user may query the database, use the async accessor.
+        auser = getattr(request, "auser", None)
+        if auser is None:
+            return self.test_user(request)
+        user = await auser()
+        return user.is_authenticated == self.is_logged_in
 
     def description(self):
         return {
@@ -445,6 +580,70 @@ class UserIsLoggedInRule(AbstractBaseRule):
         }
 
 
+@register_fact("referral_matcher")
+def get_referral_matcher(request):
+    # Local import for cyclic import
+    from wagtail_personalisation.catalog import get_catalog
+
+    # Use the catalog already fetched by the segments adapter.
+    adapter = getattr(request, "segment_adapter", None)
+    catalog = adapter.catalog if adapter is not None else get_catalog()
+    return catalog.referral_matcher
+
+
+@register_fact("referral_matches")
+def get_referral_matches(request):
+    facts = get_request_facts(request)
+    return facts.referral_matcher.match(facts.referer)
+
+
+def get_cloudflare_country(request):
+    """
+    Get country code that has been detected by Cloudflare.
+
+    Guide to the functionality:
+    https://support.cloudflare.com/hc/en-us/articles/200168236-What-does-Cloudflare-IP-Geolocation-do-
+    """
+    try:
+        return request.headers["cf-ipcountry"].lower()
+    except KeyError:
+        pass
+
+
+def get_cloudfront_country(request):
+    try:
+        return request.headers["cloudfront-viewer-country"].lower()
+    except KeyError:
+        pass
+
+
+def get_geoip_country(request):
+    reader = get_geoip_reader()
+    if reader is None:
+        return False
+
+    client_ip = get_request_facts(request).client_ip
+    country = geoip_country_cache.get(client_ip)
+    if country is None:
+        country = (reader.country_code(client_ip) or "").lower()
+        geoip_country_cache.set(client_ip, country)
+    return country
+
+
+@register_fact("country")
+def get_country(request):
+    # Prioritise CloudFlare and CloudFront country detection over GeoIP.
+    functions = (
+        get_cloudflare_country,
+        get_cloudfront_country,
+        get_geoip_country,
+    )
+    for function in functions:
+        result = function(request)
+        if result:
+            return result
+
+
 COUNTRY_CHOICES = [
     (country.alpha_2.lower(), country.name) for country in pycountry.countries
 ]
@@ -458,6 +657,8 @@ class OriginCountryRule(AbstractBaseRule):
     CloudFlare or CloudFront geolocation detection.
     """
 
+    cost = 50
+
     country = models.CharField(
         max_length=2,
         choices=COUNTRY_CHOICES,
@@ -473,38 +674,32 @@ class OriginCountryRule(AbstractBaseRule):
         verbose_name = _("origin country rule")
 
     def get_cloudflare_country(self, request):
-        """
-        Get country code that has been detected by Cloudflare.
-
-        Guide to the functionality:
-        https://support.cloudflare.com/hc/en-us/articles/200168236-What-does-Cloudflare-IP-Geolocation-do-
-        """
-        try:
-            return request.headers["cf-ipcountry"].lower()
-        except KeyError:
-            pass
+        return get_cloudflare_country(request)
 
     def get_cloudfront_country(self, request):
-        try:
-            return request.headers["cloudfront-viewer-country"].lower()
-        except KeyError:
-            pass
+        return get_cloudfront_country(request)
 
     def get_geoip_country(self, request):
-        GeoIP2 = get_geoip_module()
-        if GeoIP2 is None:
-            return False
-        return GeoIP2().country_code(get_client_ip(request)).lower()
+        return get_geoip_country(request)
 
     def get_country(self, request):
-        # Prioritise CloudFlare and CloudFront country detection over GeoIP.
-        functions = (
-            self.get_cloudflare_country,
-            self.get_cloudfront_country,
-            self.get_geoip_country,
+        # The country fact is shared by all rules of a request, unless the
+        # detection methods are overridden.
+        names = (
+            "get_cloudflare_country",
+            "get_cloudfront_country",
+            "get_geoip_country",
         )
-        for function in functions:
-            result = function(request)
+        if all(
+            getattr(getattr(self, name), "__func__", None)
+            is getattr(OriginCountryRule, name)
+            for name in names
+        ):
+            return get_request_facts(request).country
+
+        # Prioritise CloudFlare and CloudFront country detection over GeoIP.
+        for name in names:
+            result = getattr(self, name)(request)
             if result:
                 return result
 
@@ -0,0 +1,28 @@
+// Load the segments of the userbar segment picker when it is first used.
+// The userbar is rendered in a shadow root, so focus events are read from
+// the document and the focused input is found through the composed path.
+(function() {
+    var loadSegments = function(input) {
+        input.dataset.loaded = 'true';
+        var list = input.list;
+
+        fetch(input.dataset.segmentsUrl, { credentials: 'same-origin' })
+            .then(function(response) {
+                return response.json();
+            })
+            .then(function(data) {
+                data.segments.forEach(function(segment) {
+                    var option = document.createElement('option');
+                    option.value = segment.name;
+                    list.appendChild(option);
+                });
+            });
+    };
+
+    document.addEventListener('focusin', function(event) {
+        var input = event.composedPath()[0];
+        if (input.dataset && input.dataset.segmentsUrl && !input.dataset.loaded) {
+            loadSegments(input);
+        }
+    });
+})();
@@ -1,9 +1,9 @@
 from django import template
-from django.template import TemplateSyntaxError
+from django.template import NodeList, TemplateSyntaxError
 from django.utils.safestring import mark_safe
 
 from wagtail_personalisation.adapters import get_segment_adapter
-from wagtail_personalisation.models import Segment
+from wagtail_personalisation.fragments import render_fragment
 from wagtail_personalisation.utils import parse_tag
 
 register = template.Library()
@@ -15,14 +15,19 @@ def do_segment(parser, token):
     tag_name, _, kwargs = parse_tag(token, parser)
 
     # If no segment is provided this block will raise an error
-    if set(kwargs.keys()) != {"name"}:
-        usage = '{% segment name="segmentname" %} ... {% endsegment %}'
+    if set(kwargs.keys()) - {"cache_timeout"} != {"name"}:
+        usage = (
+            '{% segment name="segmentname" [cache_timeout=seconds] %} ... '
+            "{% endsegment %}"
+        )
         raise TemplateSyntaxError("Usage: %s" % usage)  # noqa: UP031
 
     nodelist = parser.parse(("endsegment",))
     parser.delete_first_token()
 
-    return SegmentNode(nodelist, name=kwargs["name"])
+    return SegmentNode(
+        nodelist, name=kwargs["name"], cache_timeout=kwargs.get("cache_timeout")
+    )
 
 
 register.tag("segment", do_segment)
@@ -35,25 +40,129 @@ class SegmentNode(template.Node):
     user has been segmented in the chosen segment.
     If not it will return nothing
 
+    With a ``cache_timeout`` the contents are cached per segment and page
+    revision, so they must not depend on anything else in the context.
+
     """
 
-    def __init__(self, nodelist, name):
+    def __init__(self, nodelist, name, cache_timeout=None):
         self.nodelist = nodelist
         self.name = name
+        self.cache_timeout = cache_timeout
 
     def render(self, context):
+        adapter = get_segment_adapter(context["request"])
+
         # Check if segment exists
         name = self.name.resolve(context)
-        segment = Segment.objects.enabled().filter(name=name).first()
+        segment = adapter.catalog.get_by_name(name)
         if not segment:
             return ""
 
         # Check if user has segment
-        adapter = get_segment_adapter(context["request"])
         user_segment = adapter.get_segment_by_id(segment_id=segment.pk)
         if not user_segment:
             return ""
 
-        content = self.nodelist.render(context)
-        content = mark_safe(content)
-        return content
+        if self.cache_timeout is None:
+            return mark_safe(self.nodelist.render(context))
+
+        origin = getattr(self, "origin", None)
+        key_parts = (
+            "segment",
+            segment.pk,
+            getattr(origin, "name", None),
+            getattr(getattr(self, "token", None), "position", None),
+        )
+        return render_fragment(
+            key_parts,
+            context,
+            self.cache_timeout.resolve(context),
+            lambda: mark_safe(self.nodelist.render(context)),
+        )
+
+
+def do_segment_switch(parser, token):
+    """Block that only shows the content of the first case the user is in."""
+    usage = (
+        '{% segment_switch %}{% case "segmentname" %} ... '
+        "{% default %} ... {% endsegment_switch %}"
+    )
+    if len(token.split_contents()) != 1:
+        raise TemplateSyntaxError("Usage: %s" % usage)  # noqa: UP031
+
+    # Content before the first case is never shown.
+    end_tags = ("case", "default", "endsegment_switch")
+    parser.parse(end_tags)
+    token = parser.next_token()
+
+    cases = []
+    while token.split_contents()[0] == "case":
+        bits = token.split_contents()[1:]
+        if not bits:
+            raise TemplateSyntaxError("Usage: %s" % usage)  # noqa: UP031
+
+        names = []
+        for bit in bits:
+            name = parser.compile_filter(bit)
+            # Resolve literal names once, when the template is compiled.
+            if isinstance(name.var, str) and not name.filters:
+                name = str(name.var)
+            names.append(name)
+
+        cases.append((names, parser.parse(end_tags)))
+        token = parser.next_token()
+
+    default = None
+    if token.contents == "default":
+        default = parser.parse(("endsegment_switch",))
+        token = parser.next_token()
+
+    if token.contents != "endsegment_switch":
+        raise TemplateSyntaxError("Usage: %s" % usage)  # noqa: UP031
+
+    return SegmentSwitchNode(cases, default)
+
+
+register.tag("segment_switch", do_segment_switch)
+
+
+class SegmentSwitchNode(template.Node):
+    """Node that returns the contents of the first case the user is in.
+
+    Each case lists one or more segment names and matches when the user is
+    in any of them. Cases are checked in order, so only the segments up to
+    the first match are looked up. When no case matches, the contents of the
+    optional default are returned.
+
+    """
+
+    def __init__(self, cases, default=None):
+        self.cases = cases
+        self.default = default
+
+    def __iter__(self):
+        for _, nodelist in self.cases:
+            yield from nodelist
+        if self.default is not None:
+            yield from self.default
+
+    @property
+    def nodelist(self):
+        return NodeList(self)
+
+    def render(self, context):
+        adapter = get_segment_adapter(context["request"])
+        catalog = adapter.catalog
+
+        for names, nodelist in self.cases:
+            for name in names:
+                if not isinstance(name, str):
+                    name = name.resolve(context)
+                segment = catalog.get_by_name(name)
+                if segment is not None and adapter.get_segment_by_id(segment.pk):
+                    return nodelist.render(context)
+
+        if self.default is not None:
+            return self.default.render(context)
+        return ""
@@ -1,6 +1,11 @@
+import threading
 import time
+import uuid
+from collections import OrderedDict
 
 from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
 from django.db.models import F
 from django.template.base import FilterExpression, kwarg_re
 from django.utils import timezone
@@ -133,3 +138,167 @@ def get_client_ip(request):
         return x_forwarded_for.split(",")[-1].strip()
     except KeyError:
         return request.META["REMOTE_ADDR"]
+
+
+def get_cache():
+    """Return the cache used to share personalisation state between processes.
+
+    :returns: The cache configured by ``WAGTAIL_PERSONALISATION_CACHE``
+    :rtype: django.core.cache.backends.base.BaseCache
+
+    """
+    return caches[getattr(settings, "WAGTAIL_PERSONALISATION_CACHE", "default")]
+
+
+def get_version(key):
+    """Return the current version token stored under the given cache key.
+
+    A new token is generated when the key is missing, so an evicted version
+    invalidates whatever was built against it.
+
+    :param key: The cache key of the version token
+    :type key: str
+    :returns: The version token
+    :rtype: str
+
+    """
+    cache = get_cache()
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key, version)
+    return version
+
+
+async def aget_version(key):
+    """Return the current version token stored under the given cache key.
+
+    Asynchronous version of :func:`get_version`.
+
+    :param key: The cache key of the version token
+    :type key: str
+    :returns: The version token
+    :rtype: str
+
+    """
+    cache = get_cache()
+    version = await cache.aget(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not await cache.aadd(key, version, timeout=None):
+            version = await cache.aget(key, version)
+    return version
+
+
+def bump_version(key, using=None):
+    """Replace the version token stored under the given cache key.
+
+    The token is replaced right away, so this process sees its own changes,
+    and again once the current transaction commits, so other processes do
+    not keep state built from uncommitted data.
+
+    :param key: The cache key of the version token
+    :type key: str
+    :param using: The database alias of the current transaction
+    :type using: str
+
+    """
+    bump_versions([key], using=using)
+
+
+def bump_versions(keys, using=None):
+    """Replace the version tokens stored under the given cache keys.
+
+    See :func:`bump_version`.
+
+    :param keys: The cache keys of the version tokens
+    :type keys: iterable of str
+    :param using: The database alias of the current transaction
+    :type using: str
+
+    """
+    keys = list(keys)
+    if not keys:
+        return
+
+    def bump():
+        get_cache().set_many({key: uuid.uuid4().hex for key in keys}, timeout=None)
+
+    bump()
+    transaction.on_commit(bump, using=using)
+
+
+class LRUCache:
+    """Thread-safe mapping of bounded size, discarding the least recently
+    used keys first.
+
+    """
+
+    def __init__(self, maxsize=1024):
+        """Create an empty cache.
+
+        :param maxsize: The maximum number of keys to keep
+        :type maxsize: int
+
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """Return the value stored under the given key.
+
+        :param key: The key to look up
+        :param default: The value to return when the key is missing
+        :returns: The cached value or the default
+
+        """
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Store a value, discarding the least recently used key when full.
+
+        :param key: The key to store the value under
+        :param value: The value to store
+
+        """
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """Remove all keys and reset the statistics."""
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    @property
+    def stats(self):
+        """Return the cache statistics.
+
+        :returns: The number of hits and misses, the size and maximum size
+        :rtype: dict
+
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+        }
@@ -0,0 +1,99 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from wagtail.models import Page
+
+from wagtail_personalisation.utils import get_cache
+
+KEY_PREFIX = "wagtail_personalisation:variants"
+
+
+def _get_key(page_id):
+    return f"{KEY_PREFIX}:{page_id}"
+
+
+def get_page_variants(page):
+    """Return the variants of a personalisable page, keyed by segment id.
+
+    The variants of every page are cached, including pages without any
+    variants, until the personalisation metadata of the page changes or the
+    page is published or unpublished.
+
+    :param page: The personalisable page
+    :type page: wagtail_personalisation.models.PersonalisablePageMixin
+    :returns: A dict mapping segment ids to tuples of the variant page id and
+        its content type id, or None when the page is a variant itself
+    :rtype: dict or None
+
+    """
+    cache = get_cache()
+    key = _get_key(page.pk)
+    entry = cache.get(key)
+    if entry is None:
+        metadata = page.personalisation_metadata
+        entry = {"canonical": metadata.is_canonical, "variants": {}}
+        if metadata.is_canonical:
+            entry["variants"] = {
+                segment_id: (variant_id, content_type_id)
+                for segment_id, variant_id, content_type_id in (
+                    metadata.variants_metadata.order_by("pk").values_list(
+                        "segment_id", "variant_id", "variant__content_type_id"
+                    )
+                )
+            }
+        cache.set(key, entry, timeout=None)
+
+    if not entry["canonical"]:
+        return None
+    return entry["variants"]
+
+
+def get_variant(page, segments):
+    """Return the variant of a page to serve to a visitor in the segments.
+
+    :param page: The personalisable page
+    :type page: wagtail_personalisation.models.PersonalisablePageMixin
+    :param segments: The segments of the visitor
+    :type segments: list of wagtail_personalisation.models.Segment
+    :returns: The specific variant page, or None to serve the page itself
+    :rtype: wagtail.models.Page or None
+
+    """
+    variants = get_page_variants(page) or {}
+    segment_ids = {segment.pk for segment in segments}
+    matches = [
+        variant for segment_id, variant in variants.items() if segment_id in segment_ids
+    ]
+    if not matches:
+        return None
+
+    variant_id, content_type_id = matches[0]
+
+    # Content types are cached, so loading the variant takes a single query.
+    model = ContentType.objects.get_for_id(content_type_id).model_class()
+    if model is None:
+        variant = Page.objects.filter(pk=variant_id).first()
+        return variant.specific if variant is not None else None
+    return model._default_manager.filter(pk=variant_id).first()
+
+
+def invalidate_page_variants(page_ids, using=None):
+    """Discard the cached variants of the given pages.
+
+    The variants are discarded right away and again once the current
+    transaction commits, so other processes do not cache uncommitted data.
+
+    :param page_ids: The ids of the pages
+    :type page_ids: iterable of int
+    :param using: The database alias of the current transaction
+    :type using: str
+
+    """
+    keys = [_get_key(page_id) for page_id in set(page_ids) if page_id is not None]
+    if not keys:
+        return
+
+    def delete():
+        get_cache().delete_many(keys)
+
+    delete()
+    transaction.on_commit(delete, using=using)
@@ -3,7 +3,12 @@ import csv
 from django import forms
 from django.core.exceptions import PermissionDenied
 from django.db import transaction
-from django.http import HttpResponse, HttpResponseForbidden, HttpResponseRedirect
+from django.http import (
+    HttpResponse,
+    HttpResponseForbidden,
+    HttpResponseRedirect,
+    JsonResponse,
+)
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
@@ -11,6 +16,7 @@ from wagtail.models import Page
 from wagtail_modeladmin.options import ModelAdmin, modeladmin_register
 from wagtail_modeladmin.views import DeleteView, IndexView
 
+from wagtail_personalisation.catalog import get_catalog
 from wagtail_personalisation.models import Segment
 from wagtail_personalisation.utils import can_delete_pages
 
@@ -29,6 +35,10 @@ class SegmentModelDashboardView(IndexView):
             css={"all": ["css/dashboard.css"]}, js=["js/commons.js", "js/dashboard.js"]
         )
 
+    def get_queryset(self, request=None):
+        # The dashboard lists the rules of every segment.
+        return super().get_queryset(request).with_rules()
+
     def get_template_names(self):
         return [
             "modeladmin/wagtail_personalisation/segment/dashboard.html",
@@ -165,6 +175,28 @@ def toggle(request, segment_id):
     return HttpResponseForbidden()
 
 
+def userbar_segments(request):
+    """List the enabled segments for the segment picker of the userbar.
+
+    :param request: The http request
+    :type request: django.http.HttpRequest
+    :returns: The ids and names of the segments
+    :rtype: django.http.JsonResponse
+
+    """
+    if request.user.has_perm("wagtailadmin.access_admin"):
+        return JsonResponse(
+            {
+                "segments": [
+                    {"id": segment.pk, "name": segment.name}
+                    for segment in get_catalog()
+                ]
+            }
+        )
+
+    return HttpResponseForbidden()
+
+
 def copy_page_view(request, page_id, segment_id):
     """Copy page with selected segment. If the page for the selected segment
     already exists the user will be redirected to that particular page.
@@ -199,7 +231,8 @@ def copy_page_view(request, page_id, segment_id):
 # CSV download views
 def segment_user_data(request, segment_id):
     if request.user.has_perm("wagtailadmin.access_admin"):
-        segment = get_object_or_404(Segment, pk=segment_id)
+        segment = get_object_or_404(Segment.objects.with_rules(), pk=segment_id)
+        static_rules = [rule for rule in segment.get_rules() if rule.static]
 
         response = HttpResponse(content_type="text/csv; charset=utf-8")
         response["Content-Disposition"] = (
@@ -207,18 +240,16 @@ def segment_user_data(request, segment_id):
         )
 
         headers = ["Username"]
-        for rule in segment.get_rules():
-            if rule.static:
-                headers.append(rule.get_column_header())
+        for rule in static_rules:
+            headers.append(rule.get_column_header())
 
         writer = csv.writer(response)
         writer.writerow(headers)
 
         for user in segment.static_users.all():
             row = [user.username]
-            for rule in segment.get_rules():
-                if rule.static:
-                    row.append(rule.get_user_info_string(user))
+            for rule in static_rules:
+                row.append(rule.get_user_info_string(user))
             writer.writerow(row)
 
         return response
@@ -0,0 +1,224 @@
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import DatabaseError, models
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+_store = None
+_store_lock = threading.Lock()
+
+
+class DatabaseVisitStore:
+    """Store the page visits of visitors in the database.
+
+    Visits are collected in memory and written with a few bulk queries once
+    ``interval`` seconds have passed since the last write, once
+    ``threshold`` visits are pending and when the process exits. With the
+    default interval of 0, visits are written at the end of every request.
+
+    """
+
+    def __init__(self, interval=0, threshold=1000):
+        """Create a visit store.
+
+        :param interval: The maximum number of seconds between writes
+        :type interval: int
+        :param threshold: The number of pending visits forcing a write
+        :type threshold: int
+
+        """
+        self.interval = interval
+        self.threshold = threshold
+        self._pending = Counter()
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, visitor_key, page_id):
+        """Count a visit of a visitor to a page.
+
+        :param visitor_key: The key identifying the visitor
+        :type visitor_key: str
+        :param page_id: The id of the visited page
+        :type page_id: int
+
+        """
+        with self._lock:
+            self._pending[(visitor_key, page_id)] += 1
+
+    def get_counts(self, visitor_key):
+        """Return the number of visits of a visitor to each page.
+
+        :param visitor_key: The key identifying the visitor
+        :type visitor_key: str
+        :returns: The number of visits, keyed by page id
+        :rtype: dict
+
+        """
+        # Local import for cyclic import
+        from wagtail_personalisation.models import PageVisit
+
+        counts = dict(
+            PageVisit.objects.filter(visitor_key=visitor_key).values_list(
+                "page_id", "count"
+            )
+        )
+        return self._add_pending(visitor_key, counts)
+
+    async def aget_counts(self, visitor_key):
+        """Return the number of visits of a visitor to each page.
+
+        Asynchronous version of :meth:`get_counts`.
+
+        :param visitor_key: The key identifying the visitor
+        :type visitor_key: str
+        :returns: The number of visits, keyed by page id
+        :rtype: dict
+
+        """
+        # Local import for cyclic import
+        from wagtail_personalisation.models import PageVisit
+
+        counts = {
+            page_id: count
+            async for page_id, count in PageVisit.objects.filter(
+                visitor_key=visitor_key
+            ).values_list("page_id", "count")
+        }
+        return self._add_pending(visitor_key, counts)
+
+    def _add_pending(self, visitor_key, counts):
+        """Add the pending visits of a visitor to the stored counts."""
+        with self._lock:
+            for (key, page_id), count in self._pending.items():
+                if key == visitor_key:
+                    counts[page_id] = counts.get(page_id, 0) + count
+        return counts
+
+    def _is_due(self):
+        with self._lock:
+            return (
+                sum(self._pending.values()) >= self.threshold
+                or time.monotonic() - self._last_flush >= self.interval
+            )
+
+    def flush_if_due(self):
+        """Write the pending visits when the interval or threshold is reached."""
+        if self._is_due():
+            self.flush()
+
+    async def aflush_if_due(self):
+        """Write the pending visits when the interval or threshold is reached.
+
+        Asynchronous version of :meth:`flush_if_due`.
+
+        """
+        if self._is_due():
+            await sync_to_async(self.flush)()
+
+    def flush(self):
+        """Write all pending visits to the database."""
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            self._last_flush = time.monotonic()
+
+        if pending and not self.write(pending):
+            # Keep the visits so they are written by the next flush.
+            with self._lock:
+                self._pending.update(pending)
+
+    def write(self, pending):
+        """Add visits to the stored counts.
+
+        Missing counts are first inserted as zero in bulk, ignoring counts
+        inserted concurrently, after which all counts are incremented with a
+        single update query. Increments are therefore never lost when other
+        processes write the same counts.
+
+        :param pending: The number of visits, keyed by visitor key and page id
+        :type pending: dict
+        :returns: Whether the visits have been written
+        :rtype: bool
+
+        """
+        # Local import for cyclic import
+        from wagtail_personalisation.models import PageVisit
+
+        lookup = models.Q()
+        for visitor_key, page_id in pending:
+            lookup |= models.Q(visitor_key=visitor_key, page_id=page_id)
+
+        increment = models.Case(
+            *[
+                models.When(
+                    visitor_key=visitor_key, page_id=page_id, then=models.Value(count)
+                )
+                for (visitor_key, page_id), count in pending.items()
+            ],
+            default=models.Value(0),
+            output_field=models.PositiveIntegerField(),
+        )
+
+        try:
+            PageVisit.objects.bulk_create(
+                [
+                    PageVisit(visitor_key=visitor_key, page_id=page_id, count=0)
+                    for visitor_key, page_id in pending
+                ],
+                ignore_conflicts=True,
+            )
+            PageVisit.objects.filter(lookup).update(
+                count=models.F("count") + increment, last_visit=timezone.now()
+            )
+        except DatabaseError:
+            logger.exception("Unable to write page visits")
+            return False
+        return True
+
+
+def get_visit_store():
+    """Return the configured visit store.
+
+    :returns: The visit store, or None when visits are stored in the session
+    :rtype: DatabaseVisitStore or None
+
+    """
+    global _store
+
+    config = getattr(settings, "WAGTAIL_PERSONALISATION_VISIT_STORE", None)
+    if not config:
+        return None
+
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store_class = import_string(
+                    config.get(
+                        "BACKEND",
+                        "wagtail_personalisation.visits.DatabaseVisitStore",
+                    )
+                )
+                _store = store_class(**config.get("OPTIONS", {}))
+                atexit.register(_store.flush)
+    return _store
+
+
+def reset_visit_store(setting, **kwargs):
+    """Flush and discard the visit store when its setting changes."""
+    global _store
+
+    if setting == "WAGTAIL_PERSONALISATION_VISIT_STORE" and _store is not None:
+        atexit.unregister(_store.flush)
+        _store.flush()
+        _store = None
+
+
+setting_changed.connect(reset_visit_store)
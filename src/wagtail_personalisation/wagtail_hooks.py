@@ -1,5 +1,7 @@
 import logging
 
+from django import forms
+from django.conf import settings
 from django.db import transaction
 from django.db.models import F
 from django.http import Http404
@@ -11,13 +13,17 @@ from django.utils.translation import gettext_lazy as _
 from wagtail import hooks
 from wagtail.admin import messages
 from wagtail.admin.site_summary import PagesSummaryItem, SummaryItem
+from wagtail.admin.userbar import BaseItem
 from wagtail.admin.views.pages.utils import get_valid_next_url_from_request
 from wagtail.admin.widgets import Button, ButtonWithDropdownFromHook
 from wagtail.models import Page
 
 from wagtail_personalisation import admin_urls, models, utils
 from wagtail_personalisation.adapters import get_segment_adapter
+from wagtail_personalisation.catalog import get_catalog
 from wagtail_personalisation.models import PersonalisablePageMetadata
+from wagtail_personalisation.references import get_segment_references
+from wagtail_personalisation.variants import get_page_variants, get_variant
 
 logger = logging.getLogger(__name__)
 
@@ -48,6 +54,43 @@ def set_visit_count(page, request, serve_args, serve_kwargs):
     adapter.add_page_visit(page)
 
 
+def get_referenced_segment_ids(page):
+    """Return the ids of the segments that can change the served page.
+
+    :param page: The page being served
+    :type page: wagtail.models.Page
+    :returns: The ids of the segments of the variants of the page and of the
+        segments referenced by its content
+    :rtype: set of int
+
+    """
+    segment_ids = set(get_segment_references(page))
+    if isinstance(page, models.PersonalisablePageMixin):
+        segment_ids |= set(get_page_variants(page) or ())
+    return segment_ids
+
+
+def get_forced_segment(request):
+    """Return the segment a superuser asked to show the page as.
+
+    The segment is given by id, or by the name of an enabled segment when
+    picked in the userbar.
+
+    :param request: The http request
+    :type request: django.http.HttpRequest
+    :returns: The segment, or None when no existing segment was given
+    :rtype: wagtail_personalisation.models.Segment or None
+
+    """
+    value = request.GET.get("segment", None)
+    if value is None or not request.user.is_superuser:
+        return None
+
+    if value.isdigit():
+        return models.Segment.objects.filter(pk=value).first()
+    return get_catalog().get_by_name(value)
+
+
 @hooks.register("before_serve_page")
 def segment_user(page, request, serve_args, serve_kwargs):
     """Apply a segment to a visitor before serving the page.
@@ -59,30 +102,65 @@ def segment_user(page, request, serve_args, serve_kwargs):
 
     """
     adapter = get_segment_adapter(request)
-    adapter.refresh()
+    forced_segment = get_forced_segment(request)
 
-    forced_segment = request.GET.get("segment", None)
-    if request.user.is_superuser and forced_segment is not None:
-        segment = models.Segment.objects.filter(pk=forced_segment).first()
-        if segment:
-            adapter.set_segments([segment])
+    # Segments shown by a superuser replace the tested ones right away.
+    if (
+        getattr(settings, "WAGTAIL_PERSONALISATION_LAZY_SEGMENTATION", False)
+        and forced_segment is None
+    ):
+        adapter.defer_refresh()
+    elif getattr(settings, "WAGTAIL_PERSONALISATION_SKIP_UNREFERENCED_SEGMENTS", False):
+        # Without referenced segments, the user session and the visit counts
+        # of the current segments are still updated.
+        adapter.refresh(segment_ids=get_referenced_segment_ids(page))
+    else:
+        adapter.refresh()
+    adapter.flush_page_visits()
+
+    if forced_segment is not None:
+        adapter.set_segments([forced_segment])
 
 
-class UserbarSegmentedLinkItem:
+class UserbarSegmentedLinkItem(BaseItem):
+    template_name = "wagtailadmin/userbar/wagtail_personalisation/item_segment.html"
+
     def __init__(self, segment):
         self.segment = segment
 
-    def render(self, request):
-        return f"""<div class="wagtail-userbar__item">
-            <a href="{request.path}?segment={self.segment.pk}"
-                class="wagtail-action">
-                    Show as segment: {self.segment.name}</a></div>"""
+
+class UserbarSegmentPickerItem(BaseItem):
+    """Userbar item to pick a segment from a list loaded on demand."""
+
+    template_name = (
+        "wagtailadmin/userbar/wagtail_personalisation/item_segment_picker.html"
+    )
+
+    @property
+    def media(self):
+        return forms.Media(js=["js/userbar_segment_picker.js"])
 
 
 @hooks.register("construct_wagtail_userbar")
-def add_segment_link_items(request, items):
-    for item in models.Segment.objects.enabled():
-        items.append(UserbarSegmentedLinkItem(item))
+def add_segment_link_items(request, items, page=None):
+    """Add links to show the page as each of the enabled segments.
+
+    Segments are read from the segment catalog. Above
+    ``WAGTAIL_PERSONALISATION_USERBAR_SEGMENTS`` segments, a picker loading
+    the segments on demand is shown instead of the links.
+
+    """
+    # Only superusers can show pages as a segment, see segment_user.
+    if not request.user.is_superuser:
+        return items
+
+    segments = list(get_catalog())
+    if len(segments) > getattr(
+        settings, "WAGTAIL_PERSONALISATION_USERBAR_SEGMENTS", 10
+    ):
+        items.append(UserbarSegmentPickerItem())
+    else:
+        items.extend(UserbarSegmentedLinkItem(segment) for segment in segments)
     return items
 
 
@@ -99,24 +177,22 @@ def serve_variant(page, request, serve_args, serve_kwargs):
     :rtype: wagtail.models.Page
 
     """
-    user_segments = []
     if not isinstance(page, models.PersonalisablePageMixin):
         return
 
-    adapter = get_segment_adapter(request)
-    user_segments = adapter.get_segments()
-
-    metadata = page.personalisation_metadata
+    variants = get_page_variants(page)
 
     # If page is not canonical, don't serve it.
-    if not metadata.is_canonical:
+    if variants is None:
         raise Http404
 
-    if user_segments:
-        # TODO: This is never more then one page? (fix query count)
-        metadata = metadata.metadata_for_segments(user_segments)
-        if metadata:
-            variant = metadata.first().variant.specific
+    if variants:
+        adapter = get_segment_adapter(request)
+        # Only the segments with a variant are looked up, so deferred
+        # refreshes do not test the other segments.
+        segments = [adapter.get_segment_by_id(segment_id) for segment_id in variants]
+        variant = get_variant(page, [segment for segment in segments if segment])
+        if variant is not None:
             return variant.serve(request, *serve_args, **serve_kwargs)
 
 
@@ -296,6 +372,10 @@ def delete_related_variants(request, page):
     if request.method == "POST":
         parent_id = page.get_parent().id
         with transaction.atomic():
+            # Pages without variants may not have stored metadata yet.
+            if page.personalisation_metadata._state.adding:
+                page.personalisation_metadata.save()
+
             # To ensure variants are deleted for all descendants, start with
             # the deepest ones, and explicitly delete variants and metadata
             # for all of them, including the page itself. Otherwise protected
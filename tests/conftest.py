@@ -1,4 +1,8 @@
 import pytest
+from django.core.cache import cache
+
+from wagtail_personalisation.facts import device_class_cache
+from wagtail_personalisation.rules import geoip_country_cache
 
 pytest_plugins = ["tests.fixtures"]
 
@@ -8,6 +12,15 @@ def enable_db_access(db):
     pass
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # Version tokens live in the cache, so clearing it also resets the
+    # process-local segment catalog between tests.
+    cache.clear()
+    device_class_cache.clear()
+    geoip_country_cache.clear()
+
+
 @pytest.fixture(scope="session")
 def django_db_setup(django_db_setup, django_db_blocker):
     from wagtail.models import Page, Site
@@ -31,6 +31,14 @@ class RegularPageFactory(PageFactory):
         model = models.RegularPage
 
 
+class BlockPageFactory(PageFactory):
+    title = "Block page"
+    slug = factory.LazyAttribute(lambda obj: slugify(obj.title))
+
+    class Meta:
+        model = models.BlockPage
+
+
 class PersonalisablePageMetadataFactory(factory.django.DjangoModelFactory):
     class Meta:
         model = PersonalisablePageMetadata
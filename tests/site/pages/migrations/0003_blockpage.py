@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:43
+
+import django.db.models.deletion
+import wagtail.fields
+from django.db import migrations, models
+
+import wagtail_personalisation.blocks
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("pages", "0002_regularpage"),
+        ("wagtailcore", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BlockPage",
+            fields=[
+                (
+                    "page_ptr",
+                    models.OneToOneField(
+                        auto_created=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        parent_link=True,
+                        primary_key=True,
+                        serialize=False,
+                        to="wagtailcore.page",
+                    ),
+                ),
+                (
+                    "body",
+                    wagtail.fields.StreamField(
+                        [("text", 0), ("personalised", 2), ("section", 4)],
+                        blank=True,
+                        block_lookup={
+                            0: ("wagtail.blocks.CharBlock", (), {}),
+                            1: (
+                                "wagtail.blocks.ChoiceBlock",
+                                [],
+                                {
+                                    "choices": wagtail_personalisation.blocks.list_segment_choices,
+                                    "help_text": "Only show this content block for users in this segment",
+                                    "label": "Personalisation segment",
+                                    "required": False,
+                                },
+                            ),
+                            2: (
+                                "wagtail.blocks.StructBlock",
+                                [[("segment", 1), ("text", 0)]],
+                                {},
+                            ),
+                            3: ("wagtail.blocks.ListBlock", (2,), {}),
+                            4: ("wagtail.blocks.StructBlock", [[("items", 3)]], {}),
+                        },
+                    ),
+                ),
+            ],
+            options={
+                "abstract": False,
+            },
+            bases=("wagtailcore.page",),
+        ),
+    ]
@@ -1,8 +1,10 @@
 from django.db import models
+from wagtail import blocks
 from wagtail.admin.panels import FieldPanel
-from wagtail.fields import RichTextField
+from wagtail.fields import RichTextField, StreamField
 from wagtail.models import Page
 
+from wagtail_personalisation.blocks import PersonalisedStructBlock
 from wagtail_personalisation.models import PersonalisablePageMixin
 
 
@@ -24,3 +26,27 @@ class ContentPage(PersonalisablePageMixin, Page):
         FieldPanel("subtitle"),
         FieldPanel("body"),
     ]
+
+
+class PersonalisedTextBlock(PersonalisedStructBlock):
+    text = blocks.CharBlock()
+
+
+class BlockPage(Page):
+    body = StreamField(
+        [
+            ("text", blocks.CharBlock()),
+            ("personalised", PersonalisedTextBlock()),
+            (
+                "section",
+                blocks.StructBlock(
+                    [("items", blocks.ListBlock(PersonalisedTextBlock()))]
+                ),
+            ),
+        ],
+        blank=True,
+    )
+
+    content_panels = Page.content_panels + [
+        FieldPanel("body"),
+    ]
@@ -0,0 +1,96 @@
+import pytest
+from asgiref.sync import async_to_sync
+from django.test import override_settings
+
+from tests.factories.rule import QueryRuleFactory, VisitCountRuleFactory
+from tests.factories.segment import SegmentFactory
+from wagtail_personalisation import adapters, rules
+from wagtail_personalisation.catalog import get_catalog
+from wagtail_personalisation.models import Segment
+
+# The coroutines run in an event loop, where blocking database queries raise
+# SynchronousOnlyOperation.
+
+
+@pytest.mark.parametrize(
+    "adapter_class",
+    [
+        adapters.SessionSegmentsAdapter,
+        adapters.CacheSegmentsAdapter,
+        adapters.SignedCookieSegmentsAdapter,
+    ],
+)
+@pytest.mark.django_db
+def test_arefresh(rf, site, adapter_class, mocker):
+    segment = SegmentFactory(name="query", persistent=True)
+    QueryRuleFactory(segment=segment, parameter="foo", value="bar")
+    SegmentFactory(name="other")
+
+    request = rf.get("/?foo=bar")
+    adapter = adapter_class(request)
+
+    async def refresh():
+        await adapter.aadd_page_visit(site.root_page)
+        await adapter.arefresh()
+        await adapter.aprocess_response(mocker.Mock())
+        return await adapter.aget_segments(), await adapter.aget_visit_count()
+
+    segments, visit_count = async_to_sync(refresh)()
+    assert segments == [segment]
+    assert visit_count == 1
+    assert Segment.objects.get(pk=segment.pk).visit_count == 1
+
+
+@pytest.mark.django_db
+def test_arefresh_static_segment(rf, site, user):
+    segment = SegmentFactory(type=Segment.TYPE_STATIC, count=1)
+    QueryRuleFactory(segment=segment, parameter="foo", value="bar")
+
+    request = rf.get("/?foo=bar")
+    request.user = user
+    adapter = adapters.SessionSegmentsAdapter(request)
+    async_to_sync(adapter.arefresh)()
+
+    assert user in segment.static_users.all()
+    assert adapter.get_memberships() == ({segment.pk}, set())
+
+
+@override_settings(
+    WAGTAIL_PERSONALISATION_VISIT_STORE={
+        "BACKEND": "wagtail_personalisation.visits.DatabaseVisitStore"
+    }
+)
+@pytest.mark.django_db
+def test_visit_count_rule_atest_user(rf, site, user):
+    segment = SegmentFactory(name="visits")
+    VisitCountRuleFactory(
+        counted_page=site.root_page, segment=segment, count=1, operator="more_than"
+    )
+    rule = get_catalog().get_rules(get_catalog().get(segment.pk))[0]
+
+    request = rf.get("/")
+    request.user = user
+    adapter = adapters.get_segment_adapter(request)
+
+    async def visit():
+        await adapter.aadd_page_visit(site.root_page)
+        await adapter.aadd_page_visit(site.root_page)
+        await adapter.aflush_page_visits()
+        return await rule.atest_user(request)
+
+    assert async_to_sync(visit)()
+    assert async_to_sync(rule.atest_user)(None, user)
+
+
+@pytest.mark.django_db
+def test_atest_user_runs_blocking_rules_in_thread(rf, mocker):
+    sync_to_async = mocker.spy(rules, "sync_to_async")
+    request = rf.get("/?foo=bar")
+
+    query_rule = rules.QueryRule(parameter="foo", value="bar")
+    assert async_to_sync(query_rule.atest_user)(request)
+    sync_to_async.assert_not_called()
+
+    country_rule = rules.OriginCountryRule(country="nl")
+    assert not async_to_sync(country_rule.atest_user)(request)
+    sync_to_async.assert_called_once()
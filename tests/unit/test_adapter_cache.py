@@ -0,0 +1,57 @@
+import pytest
+from django.core.cache import cache
+
+from tests.factories.rule import QueryRuleFactory
+from tests.factories.segment import SegmentFactory
+from wagtail_personalisation import adapters
+
+
+@pytest.fixture
+def cache_adapter(mocker):
+    mocker.patch(
+        "wagtail_personalisation.adapters.SEGMENT_ADAPTER_CLASS",
+        adapters.CacheSegmentsAdapter,
+    )
+
+
+@pytest.mark.django_db
+def test_cache_adapter_does_not_use_session(site, client, cache_adapter):
+    segment = SegmentFactory(name="segment", persistent=True)
+    QueryRuleFactory(segment=segment, parameter="foo", value="bar")
+
+    response = client.get("/?foo=bar")
+    assert response.status_code == 200
+    assert "sessionid" not in response.cookies
+    assert "wagtail_personalisation_visitor" in response.cookies
+
+    visitor_id = response.wsgi_request.segment_adapter.visitor_id
+    data = cache.get(f"wagtail_personalisation:visitor:{visitor_id}")
+    assert [s["id"] for s in data["segments"]] == [segment.pk]
+    assert data["page_visits"] == {str(site.root_page.pk): 1}
+
+    # The segments are remembered for returning visitors.
+    response = client.get("/")
+    assert "wagtail_personalisation_visitor" not in response.cookies
+    assert response.wsgi_request.segment_adapter.visitor_id == visitor_id
+    assert response.wsgi_request.segment_adapter.get_segments() == [segment]
+
+
+@pytest.mark.django_db
+def test_cache_adapter_only_writes_changes(rf, site, mocker):
+    segment = SegmentFactory(name="segment", persistent=True)
+    request = rf.get("/")
+    adapter = adapters.CacheSegmentsAdapter(request)
+    adapter.set_segments([segment])
+    adapter.process_response(mocker.Mock())
+
+    request = rf.get("/")
+    mocker.patch.object(request, "get_signed_cookie", return_value=adapter.visitor_id)
+    adapter = adapters.CacheSegmentsAdapter(request)
+    adapter.set_segments([segment])
+    assert adapter.get_segments() == [segment]
+
+    response = mocker.Mock()
+    set_cache = mocker.patch.object(cache, "set")
+    adapter.process_response(response)
+    set_cache.assert_not_called()
+    response.set_signed_cookie.assert_not_called()
@@ -0,0 +1,82 @@
+import pytest
+from django.test import override_settings
+
+from tests.factories.rule import QueryRuleFactory
+from tests.factories.segment import SegmentFactory
+from wagtail_personalisation import adapters
+from wagtail_personalisation.catalog import invalidate_catalog
+
+
+@pytest.fixture
+def cookie_adapter(mocker):
+    mocker.patch(
+        "wagtail_personalisation.adapters.SEGMENT_ADAPTER_CLASS",
+        adapters.SignedCookieSegmentsAdapter,
+    )
+
+
+@pytest.mark.django_db
+def test_cookie_adapter_does_not_use_session(site, client, cookie_adapter):
+    segment = SegmentFactory(name="segment", persistent=True)
+    QueryRuleFactory(segment=segment, parameter="foo", value="bar")
+
+    response = client.get("/?foo=bar")
+    assert response.status_code == 200
+    assert "sessionid" not in response.cookies
+    assert "wagtail_personalisation_segments" in response.cookies
+
+    response = client.get("/")
+    adapter = response.wsgi_request.segment_adapter
+    assert adapter.get_segments() == [segment]
+    assert adapter.get_visit_count(site.root_page) == 2
+    assert "sessionid" not in response.cookies
+
+
+@pytest.mark.django_db
+def test_cookie_adapter_round_trip(rf, site, mocker):
+    segment = SegmentFactory(name="segment", persistent=True)
+    excluded_segment = SegmentFactory(name="excluded", persistent=True)
+
+    adapter = adapters.SignedCookieSegmentsAdapter(rf.get("/"))
+    adapter.set_segments([segment])
+    adapter.set_segments([excluded_segment], "excluded_segments")
+    adapter.add_page_visit(site.root_page)
+    response = mocker.Mock()
+    adapter.process_response(response)
+    value = response.set_signed_cookie.call_args.args[1]
+
+    request = rf.get("/")
+    mocker.patch.object(request, "get_signed_cookie", return_value=value)
+    adapter = adapters.SignedCookieSegmentsAdapter(request)
+    assert adapter.get_segments() == [segment]
+    assert adapter.get_segments("excluded_segments") == [excluded_segment]
+    assert adapter.get_visit_count(site.root_page) == 1
+
+    # Unchanged segments do not rewrite the cookie.
+    adapter.set_segments([segment])
+    response = mocker.Mock()
+    adapter.process_response(response)
+    response.set_signed_cookie.assert_not_called()
+
+    # Timestamps are discarded when the catalog changes.
+    invalidate_catalog()
+    adapter = adapters.SignedCookieSegmentsAdapter(request)
+    assert adapter.storage["segments"][0]["timestamp"] == 0
+
+
+@override_settings(WAGTAIL_PERSONALISATION_COOKIE_MAX_PAGE_VISITS=1)
+@pytest.mark.django_db
+def test_cookie_adapter_caps_page_visits(rf, site):
+    adapter = adapters.SignedCookieSegmentsAdapter(rf.get("/"))
+    adapter.storage["page_visits"] = {"1": 3, str(site.root_page.pk): 1}
+
+    state = adapter._dump()
+    assert state["page_visits"] == [(site.root_page.pk, 1)]
+
+
+@pytest.mark.django_db
+def test_cookie_adapter_ignores_invalid_cookie(rf, mocker):
+    request = rf.get("/")
+    mocker.patch.object(request, "get_signed_cookie", return_value="invalid")
+    adapter = adapters.SignedCookieSegmentsAdapter(request)
+    assert adapter.get_segments() == []
@@ -1,4 +1,5 @@
 import pytest
+from django.test import override_settings
 
 from tests.factories.segment import SegmentFactory
 from wagtail_personalisation import adapters
@@ -71,6 +72,52 @@ def test_refresh_removes_disabled(rf):
     assert adapter.get_segments() == [segment_2]
 
 
+@pytest.mark.django_db
+def test_refresh_does_not_modify_session_if_segments_are_unchanged(rf):
+    segment = SegmentFactory(name="segment", persistent=True)
+    request = rf.get("/")
+    adapter = adapters.SessionSegmentsAdapter(request)
+    adapter.set_segments([segment])
+    adapter.set_segments([], "excluded_segments")
+    request.session.save()
+    request.session.modified = False
+
+    adapter = adapters.SessionSegmentsAdapter(request)
+    adapter.refresh()
+    assert adapter.get_segments() == [segment]
+    assert not request.session.modified
+
+    with override_settings(WAGTAIL_PERSONALISATION_SEGMENT_TIMESTAMP_INTERVAL=0):
+        adapter.refresh()
+    assert request.session.modified
+
+
+@pytest.mark.django_db
+def test_page_visits_modify_session_without_visit_store(rf, site, user):
+    segment = SegmentFactory(name="segment", persistent=True)
+    request = rf.get("/")
+    request.user = user
+    adapter = adapters.SessionSegmentsAdapter(request)
+    adapter.set_segments([segment])
+    adapter.refresh()
+    request.session.save()
+
+    # Visits are counted in the session, unless a visit store is configured.
+    request.session.modified = False
+    adapter = adapters.SessionSegmentsAdapter(request)
+    adapter.add_page_visit(site.root_page)
+    adapter.refresh()
+    assert request.session.modified
+
+    visit_store = {"BACKEND": "wagtail_personalisation.visits.DatabaseVisitStore"}
+    with override_settings(WAGTAIL_PERSONALISATION_VISIT_STORE=visit_store):
+        request.session.modified = False
+        adapter = adapters.SessionSegmentsAdapter(request)
+        adapter.add_page_visit(site.root_page)
+        adapter.refresh()
+        assert not request.session.modified
+
+
 @pytest.mark.django_db
 def test_add_page_visit(rf, site):
     request = rf.get("/")
@@ -78,14 +125,46 @@ def test_add_page_visit(rf, site):
     adapter = adapters.SessionSegmentsAdapter(request)
     adapter.add_page_visit(site.root_page)
 
-    assert request.session["visit_count"][0]["count"] == 1
+    assert request.session["page_visits"] == {str(site.root_page.pk): 1}
 
     adapter.add_page_visit(site.root_page)
-    assert request.session["visit_count"][0]["count"] == 2
+    assert request.session["page_visits"] == {str(site.root_page.pk): 2}
 
     assert adapter.get_visit_count() == 2
 
 
+@pytest.mark.django_db
+@override_settings(WAGTAIL_PERSONALISATION_MAX_PAGE_VISITS=2)
+def test_add_page_visit_evicts_least_recently_visited_page(rf, site):
+    pages = site.root_page.get_children()[:3]
+    request = rf.get("/")
+    adapter = adapters.SessionSegmentsAdapter(request)
+
+    adapter.add_page_visit(pages[0])
+    adapter.add_page_visit(pages[1])
+    adapter.add_page_visit(pages[0])
+    adapter.add_page_visit(pages[2])
+
+    assert request.session["page_visits"] == {
+        str(pages[0].pk): 2,
+        str(pages[2].pk): 1,
+    }
+    assert adapter.get_visit_count(pages[1]) == 0
+
+
+@pytest.mark.django_db
+def test_get_visit_count_converts_legacy_visits(rf, site):
+    request = rf.get("/")
+    request.session["visit_count"] = [
+        {"slug": "", "id": site.root_page.pk, "path": "/", "count": 3},
+    ]
+    adapter = adapters.SessionSegmentsAdapter(request)
+
+    assert adapter.get_visit_count(site.root_page) == 3
+    assert "visit_count" not in request.session
+    assert request.session["page_visits"] == {str(site.root_page.pk): 3}
+
+
 @pytest.mark.django_db
 def test_update_visit_count(rf, site):
     request = rf.get("/")
@@ -117,3 +196,73 @@ def test_update_visit_count_deleted_segment(rf, site):
     adapter.set_segments([segment_1, segment_2])
     segment_2.delete()
     adapter.update_visit_count()
+
+
+@pytest.mark.django_db
+def test_get_memberships_anonymous_user(rf, django_assert_num_queries):
+    request = rf.get("/")
+
+    adapter = adapters.SessionSegmentsAdapter(request)
+    with django_assert_num_queries(0):
+        assert adapter.get_memberships() == (set(), set())
+
+
+@pytest.mark.django_db
+def test_get_memberships_is_cached_in_session(rf, user, django_assert_num_queries):
+    request = rf.get("/")
+    request.user = user
+
+    static_segment = SegmentFactory(name="static", type="static")
+    excluded_segment = SegmentFactory(name="excluded")
+    static_segment.static_users.add(user)
+    excluded_segment.excluded_users.add(user)
+
+    adapter = adapters.SessionSegmentsAdapter(request)
+    with django_assert_num_queries(1):
+        memberships = adapter.get_memberships()
+    assert memberships == ({static_segment.pk}, {excluded_segment.pk})
+
+    adapter = adapters.SessionSegmentsAdapter(request)
+    with django_assert_num_queries(0):
+        assert adapter.get_memberships() == memberships
+
+
+@pytest.mark.django_db
+def test_get_memberships_invalidated_by_membership_change(rf, user):
+    request = rf.get("/")
+    request.user = user
+
+    segment = SegmentFactory(name="static", type="static")
+
+    adapter = adapters.SessionSegmentsAdapter(request)
+    assert adapter.get_memberships() == (set(), set())
+
+    segment.static_users.add(user)
+    assert adapter.get_memberships() == ({segment.pk}, set())
+
+    segment.static_users.remove(user)
+    user.excluded_segments.add(segment)
+    assert adapter.get_memberships() == (set(), {segment.pk})
+
+
+@pytest.mark.django_db
+def test_get_memberships_not_invalidated_by_other_users(
+    rf, user, django_user_model, django_assert_num_queries
+):
+    other_user = django_user_model.objects.create(username="other")
+    segment = SegmentFactory(name="static", type="static")
+    request = rf.get("/")
+    request.user = user
+
+    adapter = adapters.SessionSegmentsAdapter(request)
+    assert adapter.get_memberships() == (set(), set())
+
+    segment.static_users.add(other_user)
+    with django_assert_num_queries(0):
+        assert adapter.get_memberships() == (set(), set())
+
+    # Clearing a segment invalidates the memberships of all users.
+    segment.static_users.add(user)
+    assert adapter.get_memberships() == ({segment.pk}, set())
+    segment.static_users.clear()
+    assert adapter.get_memberships() == (set(), set())
@@ -0,0 +1,78 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from tests.factories.rule import QueryRuleFactory, VisitCountRuleFactory
+from tests.factories.segment import SegmentFactory
+from wagtail_personalisation import adapters
+from wagtail_personalisation.catalog import get_catalog
+
+
+@pytest.mark.django_db
+def test_catalog_contains_enabled_segments_and_rules():
+    segment = SegmentFactory(name="enabled")
+    disabled = SegmentFactory(name="disabled", status="disabled")
+    rule = QueryRuleFactory(segment=segment, parameter="foo", value="bar")
+
+    catalog = get_catalog()
+
+    assert segment.pk in catalog
+    assert disabled.pk not in catalog
+    assert catalog.get(segment.pk) == segment
+    assert catalog.get_rules(segment) == [rule]
+    assert catalog.get_by_name("enabled") == segment
+    assert catalog.get_by_name("disabled") is None
+
+
+@pytest.mark.django_db
+def test_catalog_is_reused_until_invalidated():
+    segment = SegmentFactory(name="segment")
+    catalog = get_catalog()
+
+    assert get_catalog() is catalog
+
+    segment.name = "renamed"
+    segment.save()
+    assert get_catalog() is not catalog
+    assert get_catalog().get(segment.pk).name == "renamed"
+    assert get_catalog().get_by_name("segment") is None
+
+
+@pytest.mark.django_db
+def test_catalog_is_invalidated_by_rule_changes():
+    segment = SegmentFactory(name="segment")
+    assert get_catalog().get_rules(segment) == []
+
+    rule = QueryRuleFactory(segment=segment, parameter="foo", value="bar")
+    assert get_catalog().get_rules(segment) == [rule]
+
+    rule.delete()
+    assert get_catalog().get_rules(segment) == []
+
+
+@pytest.mark.django_db
+def test_catalog_preloads_rule_foreign_keys(site, django_assert_num_queries):
+    segment = SegmentFactory(name="segment")
+    VisitCountRuleFactory(segment=segment, counted_page=site.root_page)
+
+    rule = get_catalog().get_rules(segment)[0]
+    with django_assert_num_queries(0):
+        assert rule.counted_page.url_path == site.root_page.url_path
+        assert rule.segment == segment
+
+
+@pytest.mark.django_db
+def test_refresh_does_not_query_segments_or_rules(rf):
+    segment = SegmentFactory(name="segment", persistent=True)
+    QueryRuleFactory(segment=segment, parameter="foo", value="bar")
+    get_catalog()
+
+    request = rf.get("/", {"foo": "bar"})
+    adapter = adapters.SessionSegmentsAdapter(request)
+    with CaptureQueriesContext(connection) as context:
+        adapter.refresh()
+
+    for query in context.captured_queries:
+        assert not query["sql"].startswith('SELECT "wagtail_personalisation_')
+
+    assert adapter.get_segments() == [segment]
@@ -0,0 +1,20 @@
+from wagtail_personalisation.checks import check_lazy_segmentation_middleware
+
+
+def test_lazy_segmentation_requires_segment_middleware(settings):
+    assert check_lazy_segmentation_middleware(None) == []
+
+    settings.WAGTAIL_PERSONALISATION_LAZY_SEGMENTATION = True
+    settings.MIDDLEWARE = [
+        m
+        for m in settings.MIDDLEWARE
+        if m != "wagtail_personalisation.middleware.SegmentMiddleware"
+    ]
+    errors = check_lazy_segmentation_middleware(None)
+    assert [error.id for error in errors] == ["wagtail_personalisation.E001"]
+
+    settings.MIDDLEWARE = [
+        *settings.MIDDLEWARE,
+        "wagtail_personalisation.middleware.SegmentMiddleware",
+    ]
+    assert check_lazy_segmentation_middleware(None) == []
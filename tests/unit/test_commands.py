@@ -0,0 +1,46 @@
+import datetime
+
+import pytest
+from django.core.management import call_command
+from django.utils import timezone
+
+from tests.factories.page import RegularPageFactory
+from tests.site.pages import models
+from wagtail_personalisation.models import PageVisit, PersonalisablePageMetadata
+
+
+@pytest.mark.django_db
+def test_create_personalisation_metadata(site, segmented_page):
+    regular_page = RegularPageFactory(parent=site.root_page, slug="other")
+    content_pages = models.ContentPage.objects.exclude(pk=segmented_page.pk)
+    assert PersonalisablePageMetadata.objects.count() == 2
+
+    call_command("create_personalisation_metadata", batch_size=2)
+
+    for page in content_pages:
+        metadata = PersonalisablePageMetadata.objects.get(variant=page)
+        assert metadata.canonical_page_id == page.pk
+    assert not PersonalisablePageMetadata.objects.filter(variant=regular_page).exists()
+    assert PersonalisablePageMetadata.objects.count() == content_pages.count() + 1
+
+    call_command("create_personalisation_metadata")
+    assert PersonalisablePageMetadata.objects.count() == content_pages.count() + 1
+
+
+@pytest.mark.django_db
+def test_clear_page_visits(site, settings):
+    settings.SESSION_COOKIE_AGE = 60
+    settings.WAGTAIL_PERSONALISATION_ADAPTER_TIMEOUT = 120
+    expired = timezone.now() - datetime.timedelta(seconds=90)
+    page = site.root_page
+    for visitor_key in ("user:1", "session:old", "visitor:recent"):
+        PageVisit.objects.create(visitor_key=visitor_key, page=page, last_visit=expired)
+    PageVisit.objects.create(visitor_key="session:recent", page=page)
+
+    call_command("clear_page_visits")
+
+    assert set(PageVisit.objects.values_list("visitor_key", flat=True)) == {
+        "user:1",
+        "visitor:recent",
+        "session:recent",
+    }
@@ -0,0 +1,26 @@
+import pytest
+
+from wagtail_personalisation import cookies
+
+
+def test_encode_decode_round_trip():
+    state = {
+        "timestamp": 1700000000,
+        "catalog": cookies.fingerprint("catalog"),
+        "segments": [3, 1, 300],
+        "excluded_segments": [],
+        "page_visits": [(10, 1), (2, 200)],
+        "memberships": (5, cookies.fingerprint("memberships"), [1], [2, 3]),
+    }
+
+    value = cookies.encode(state)
+    assert len(value) < 50
+
+    decoded = cookies.decode(value)
+    assert decoded == dict(state, segments=[1, 3, 300])
+
+
+@pytest.mark.parametrize("value", ["", "!!!", "AgA", "_w"])
+def test_decode_invalid_value(value):
+    with pytest.raises(ValueError):
+        cookies.decode(value)
@@ -0,0 +1,95 @@
+import pytest
+from django.test import override_settings
+
+from tests.factories.segment import SegmentFactory
+from wagtail_personalisation import adapters
+from wagtail_personalisation.counters import (
+    CacheVisitCountBuffer,
+    LocalVisitCountBuffer,
+    get_visit_count_buffer,
+)
+from wagtail_personalisation.models import Segment
+
+
+@pytest.mark.django_db
+def test_increment_visit_counts():
+    segment_1 = SegmentFactory(name="segment-1", visit_count=0)
+    segment_2 = SegmentFactory(name="segment-2", visit_count=0)
+
+    Segment.objects.increment_visit_counts({segment_1.pk: 3, segment_2.pk: 1})
+
+    segment_1.refresh_from_db()
+    segment_2.refresh_from_db()
+    assert segment_1.visit_count == 3
+    assert segment_2.visit_count == 1
+
+
+@pytest.mark.django_db
+def test_local_buffer_flushes_at_threshold(django_assert_num_queries):
+    segment_1 = SegmentFactory(name="segment-1", visit_count=0)
+    segment_2 = SegmentFactory(name="segment-2", visit_count=0)
+    buffer = LocalVisitCountBuffer(interval=3600, threshold=5)
+
+    with django_assert_num_queries(0):
+        buffer.add([segment_1.pk, segment_2.pk])
+        buffer.add([segment_1.pk])
+
+    with django_assert_num_queries(1):
+        buffer.add([segment_1.pk, segment_2.pk])
+
+    segment_1.refresh_from_db()
+    segment_2.refresh_from_db()
+    assert segment_1.visit_count == 3
+    assert segment_2.visit_count == 2
+
+
+@pytest.mark.django_db
+def test_local_buffer_flushes_after_interval():
+    segment = SegmentFactory(name="segment", visit_count=0)
+    buffer = LocalVisitCountBuffer(interval=0, threshold=1000)
+
+    buffer.add([segment.pk])
+
+    segment.refresh_from_db()
+    assert segment.visit_count == 1
+
+
+@pytest.mark.django_db
+def test_cache_buffer_is_shared_between_buffers():
+    segment = SegmentFactory(name="segment", visit_count=0)
+    buffer_1 = CacheVisitCountBuffer(interval=3600, threshold=1000)
+    buffer_2 = CacheVisitCountBuffer(interval=3600, threshold=1000)
+
+    # The first visit of the interval is flushed right away.
+    buffer_1.add([segment.pk])
+    buffer_1.add([segment.pk])
+    buffer_2.add([segment.pk])
+
+    segment.refresh_from_db()
+    assert segment.visit_count == 1
+
+    buffer_2.flush()
+
+    segment.refresh_from_db()
+    assert segment.visit_count == 3
+
+
+@pytest.mark.django_db
+def test_adapter_uses_visit_count_buffer(rf, django_assert_num_queries):
+    segment = SegmentFactory(name="segment", persistent=True, visit_count=0)
+    request = rf.get("/")
+    adapter = adapters.SessionSegmentsAdapter(request)
+    adapter.set_segments([segment])
+
+    config = {"OPTIONS": {"interval": 3600, "threshold": 1000}}
+    with override_settings(WAGTAIL_PERSONALISATION_VISIT_COUNT_BUFFER=config):
+        assert isinstance(get_visit_count_buffer(), LocalVisitCountBuffer)
+
+        with django_assert_num_queries(0):
+            adapter.update_visit_count()
+            adapter.update_visit_count()
+
+    # Changing the setting flushes the pending visits.
+    segment.refresh_from_db()
+    assert segment.visit_count == 2
+    assert get_visit_count_buffer() is None
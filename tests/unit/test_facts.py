@@ -0,0 +1,95 @@
+from unittest.mock import patch
+
+import pytest
+
+from tests.factories.rule import DeviceRuleFactory, OriginCountryRuleFactory
+from tests.factories.segment import SegmentFactory
+from wagtail_personalisation.facts import (
+    classify_user_agent,
+    device_class_cache,
+    get_request_facts,
+    register_fact,
+)
+
+IPHONE_UA = (
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 9_1 like Mac OS X) "
+    "AppleWebKit/601.1.46 (KHTML, like Gecko) Version/9.0 "
+    "Mobile/13B143 Safari/601.1"
+)
+
+
+def test_facts_are_memoized_per_request(rf):
+    request = rf.get("/", HTTP_USER_AGENT=IPHONE_UA)
+
+    with patch("wagtail_personalisation.facts.parse") as parse_mock:
+        facts = get_request_facts(request)
+        assert facts.user_agent is facts.user_agent
+        assert get_request_facts(request).user_agent is facts.user_agent
+
+    parse_mock.assert_called_once_with(IPHONE_UA)
+    assert get_request_facts(rf.get("/")) is not facts
+
+
+def test_request_facts(rf, django_user_model):
+    request = rf.get("/", HTTP_USER_AGENT=IPHONE_UA, HTTP_REFERER="test.test")
+    request.user = django_user_model()
+
+    facts = get_request_facts(request)
+
+    assert facts.device_class == "mobile"
+    assert facts.referer == "test.test"
+    assert facts.client_ip == "127.0.0.1"
+    assert facts.is_authenticated
+    assert facts.weekday == facts.now.weekday()
+
+
+def test_device_class_is_cached_between_requests(rf):
+    for _ in range(3):
+        request = rf.get("/", HTTP_USER_AGENT=IPHONE_UA)
+        assert get_request_facts(request).device_class == "mobile"
+
+    assert classify_user_agent("") is None
+    assert device_class_cache.stats == {
+        "hits": 2,
+        "misses": 2,
+        "size": 2,
+        "maxsize": 1000,
+    }
+
+
+def test_register_fact(rf):
+    @register_fact("query_size")
+    def get_query_size(request):
+        return len(request.GET)
+
+    assert get_request_facts(rf.get("/?foo=bar&bar=baz")).query_size == 2
+
+
+def test_unknown_fact(rf):
+    with pytest.raises(AttributeError):
+        getattr(get_request_facts(rf.get("/")), "unknown")  # noqa: B009
+
+
+@pytest.mark.django_db
+def test_rules_share_facts(rf):
+    segment = SegmentFactory(name="segment")
+    rules = [
+        OriginCountryRuleFactory(segment=segment, country="nl"),
+        OriginCountryRuleFactory(segment=segment, country="gb"),
+        DeviceRuleFactory(segment=segment, mobile=True),
+        DeviceRuleFactory(segment=segment, desktop=True),
+    ]
+    request = rf.get("/", HTTP_USER_AGENT=IPHONE_UA, HTTP_CF_IPCOUNTRY="NL")
+
+    with (
+        patch(
+            "wagtail_personalisation.rules.get_cloudflare_country", return_value="nl"
+        ) as country_mock,
+        patch("wagtail_personalisation.facts.parse") as parse_mock,
+    ):
+        parse_mock.return_value.is_mobile = True
+        results = [rule.test_user(request) for rule in rules]
+
+    assert results == [True, False, True, False]
+    country_mock.assert_called_once_with(request)
+    parse_mock.assert_called_once_with(IPHONE_UA)
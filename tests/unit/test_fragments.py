@@ -0,0 +1,134 @@
+import time
+
+import pytest
+from wagtail import blocks
+
+from tests.factories.segment import SegmentFactory
+from tests.utils import render_template
+from wagtail_personalisation.blocks import PersonalisedStructBlock
+
+
+class CachedBlock(PersonalisedStructBlock):
+    body = blocks.CharBlock()
+
+    class Meta:
+        cache_timeout = 60
+
+
+def segment_request(rf, segment):
+    request = rf.get("/")
+    request.session["segments"] = [
+        {
+            "encoded_name": segment.encoded_name(),
+            "id": segment.pk,
+            "timestamp": int(time.time()),
+            "persistent": True,
+        }
+    ]
+    return request
+
+
+@pytest.mark.django_db
+def test_block_is_cached_per_segment(rf, site, mocker):
+    segment = SegmentFactory(name="test", persistent=True)
+    other = SegmentFactory(name="other", persistent=True)
+    block = CachedBlock()
+    render_basic = mocker.spy(block, "render_basic")
+    context = {"request": segment_request(rf, segment), "page": site.root_page}
+
+    value = block.to_python({"segment": str(segment.pk), "body": "Hello"})
+    assert "Hello" in block.render(value, context)
+    assert "Hello" in block.render(value, context)
+    assert render_basic.call_count == 1
+
+    # Other values and segments are cached separately.
+    value = block.to_python({"segment": str(segment.pk), "body": "Bye"})
+    assert "Bye" in block.render(value, context)
+    assert render_basic.call_count == 2
+
+    value = block.to_python({"segment": str(other.pk), "body": "Bye"})
+    assert block.render(value, context) == ""
+    assert render_basic.call_count == 2
+
+
+@pytest.mark.django_db
+def test_block_is_not_cached_by_default(rf, site, mocker):
+    segment = SegmentFactory(name="test", persistent=True)
+    block = PersonalisedStructBlock([("body", blocks.CharBlock())])
+    render_basic = mocker.spy(block, "render_basic")
+    context = {"request": segment_request(rf, segment), "page": site.root_page}
+
+    value = block.to_python({"segment": str(segment.pk), "body": "Hello"})
+    block.render(value, context)
+    block.render(value, context)
+    assert render_basic.call_count == 2
+
+
+@pytest.mark.django_db
+def test_block_is_not_cached_in_previews(rf, site, mocker):
+    segment = SegmentFactory(name="test", persistent=True)
+    block = CachedBlock()
+    render_basic = mocker.spy(block, "render_basic")
+    request = segment_request(rf, segment)
+    request.is_preview = True
+    context = {"request": request, "page": site.root_page}
+
+    value = block.to_python({"segment": "-1", "body": "Hello"})
+    block.render(value, context)
+    block.render(value, context)
+    assert render_basic.call_count == 2
+
+
+@pytest.mark.django_db
+def test_block_cache_is_invalidated_on_publish(rf, site, mocker):
+    segment = SegmentFactory(name="test", persistent=True)
+    block = CachedBlock()
+    render_basic = mocker.spy(block, "render_basic")
+    page = site.root_page
+    context = {"request": segment_request(rf, segment), "page": page}
+
+    value = block.to_python({"segment": str(segment.pk), "body": "Hello"})
+    block.render(value, context)
+    page.save_revision().publish()
+    block.render(value, context)
+    assert render_basic.call_count == 2
+
+
+SEGMENT_TEMPLATE = """
+{% load wagtail_personalisation_tags %}
+{% segment name='test' cache_timeout=60 %}{{ greeting }}{% endsegment %}
+"""
+
+
+@pytest.mark.django_db
+def test_segment_template_block_is_cached(rf, site):
+    segment = SegmentFactory(name="test", persistent=True)
+    request = segment_request(rf, segment)
+
+    content = render_template(
+        SEGMENT_TEMPLATE, request=request, page=site.root_page, greeting="Hello"
+    )
+    assert content.strip() == "Hello"
+
+    content = render_template(
+        SEGMENT_TEMPLATE, request=request, page=site.root_page, greeting="Bye"
+    )
+    assert content.strip() == "Hello"
+
+    site.root_page.save_revision().publish()
+    content = render_template(
+        SEGMENT_TEMPLATE, request=request, page=site.root_page, greeting="Bye"
+    )
+    assert content.strip() == "Bye"
+
+
+@pytest.mark.django_db
+def test_segment_template_block_is_not_cached_for_other_segments(rf, site):
+    SegmentFactory(name="test", persistent=True)
+    other = SegmentFactory(name="other", persistent=True)
+    request = segment_request(rf, other)
+
+    content = render_template(
+        SEGMENT_TEMPLATE, request=request, page=site.root_page, greeting="Hello"
+    )
+    assert content.strip() == ""
@@ -0,0 +1,112 @@
+import pytest
+from asgiref.sync import async_to_sync
+
+from tests.factories.rule import QueryRuleFactory
+from tests.factories.segment import SegmentFactory
+from wagtail_personalisation import adapters
+from wagtail_personalisation.models import Segment
+
+
+@pytest.fixture
+def segments():
+    persistent = SegmentFactory(name="persistent", persistent=True)
+    other = SegmentFactory(name="other", persistent=False)
+    for segment in (persistent, other):
+        QueryRuleFactory(segment=segment, parameter="foo", value="bar")
+    return persistent, other
+
+
+@pytest.fixture
+def lazy_segmentation(settings):
+    settings.WAGTAIL_PERSONALISATION_LAZY_SEGMENTATION = True
+
+
+@pytest.mark.django_db
+def test_deferred_refresh_only_tests_requested_segment(rf, site, segments, mocker):
+    persistent, other = segments
+    request = rf.get("/?foo=bar")
+    adapter = adapters.SessionSegmentsAdapter(request)
+    test_rules = mocker.spy(adapter, "_test_rules")
+
+    adapter.defer_refresh()
+    test_rules.assert_not_called()
+
+    assert adapter.get_segment_by_id(other.pk) == other
+    assert adapter.get_segment_by_id(other.pk) == other
+    assert test_rules.call_count == 1
+    assert [s["id"] for s in request.session["segments"]] == [other.pk]
+
+    # Persistent segments are tested when the refresh completes.
+    adapter.complete_refresh()
+    assert test_rules.call_count == 2
+    assert set(adapter.get_segments()) == {persistent, other}
+
+    adapter.complete_refresh()
+    assert test_rules.call_count == 2
+
+
+@pytest.mark.django_db
+def test_deferred_refresh_tests_all_segments_when_read(rf, site, segments, mocker):
+    request = rf.get("/?foo=bar")
+    adapter = adapters.SessionSegmentsAdapter(request)
+    test_rules = mocker.spy(adapter, "_test_rules")
+
+    adapter.defer_refresh()
+    assert set(adapter.get_segments()) == set(segments)
+    assert test_rules.call_count == 2
+
+    adapter.complete_refresh()
+    assert test_rules.call_count == 2
+
+
+@pytest.mark.django_db
+def test_deferred_refresh_async(rf, site, segments, mocker):
+    persistent, other = segments
+    request = rf.get("/?foo=bar")
+    adapter = adapters.SessionSegmentsAdapter(request)
+    test_rules = mocker.spy(adapter, "_atest_rules")
+
+    adapter.defer_refresh()
+
+    async def read_segments():
+        segments = await adapter.aget_segments()
+        await adapter.acomplete_refresh()
+        return segments
+
+    assert set(async_to_sync(read_segments)()) == {persistent, other}
+    assert test_rules.call_count == 2
+    assert Segment.objects.get(pk=persistent.pk).visit_count == 1
+
+
+@pytest.mark.django_db
+def test_deferred_refresh_counts_visits_once(rf, site, segments):
+    persistent, other = segments
+    request = rf.get("/?foo=bar")
+    adapter = adapters.SessionSegmentsAdapter(request)
+
+    adapter.defer_refresh()
+    adapter.get_segment_by_id(other.pk)
+    adapter.get_segment_by_id(persistent.pk)
+    adapter.complete_refresh()
+
+    assert Segment.objects.get(pk=persistent.pk).visit_count == 1
+    assert Segment.objects.get(pk=other.pk).visit_count == 1
+
+
+@pytest.mark.django_db
+def test_lazy_segmentation_completes_at_end_of_response(
+    client, site, segments, lazy_segmentation, mocker
+):
+    persistent, other = segments
+    test_rules = mocker.spy(adapters.SessionSegmentsAdapter, "_test_rules")
+
+    response = client.get("/?foo=bar")
+    assert response.status_code == 200
+
+    # Only the persistent segment was tested, as nothing read the segments.
+    assert test_rules.call_count == 1
+    assert [s["id"] for s in client.session["segments"]] == [persistent.pk]
+    assert Segment.objects.get(pk=persistent.pk).visit_count == 1
+
+    response = client.get("/")
+    assert response.wsgi_request.segment_adapter.get_segments() == [persistent]
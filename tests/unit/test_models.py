@@ -7,7 +7,7 @@ from tests.factories.page import ContentPageFactory
 from tests.factories.segment import SegmentFactory
 from tests.site.pages import models
 from wagtail_personalisation.models import PersonalisablePageMetadata, Segment
-from wagtail_personalisation.rules import TimeRule
+from wagtail_personalisation.rules import AbstractBaseRule, TimeRule
 
 
 @pytest.mark.django_db
@@ -30,6 +30,23 @@ def test_metadata_page_has_variants(segmented_page):
     assert canonical.personalisation_metadata.has_variants
 
 
+@pytest.mark.django_db
+def test_metadata_is_not_created_when_read(site, django_assert_num_queries):
+    page = models.ContentPage.objects.get(slug="page-1")
+    with django_assert_num_queries(1):
+        metadata = page.personalisation_metadata
+    assert metadata.pk is None
+    assert metadata.is_canonical
+    assert not PersonalisablePageMetadata.objects.filter(variant=page).exists()
+
+    segment = SegmentFactory()
+    metadata.copy_for_segment(segment)
+    assert (
+        PersonalisablePageMetadata.objects.get(variant=page).canonical_page_id
+        == page.pk
+    )
+
+
 @pytest.mark.django_db
 def test_content_page_model():
     page = ContentPageFactory()
@@ -79,3 +96,121 @@ def test_segment_edit_view(site, client, django_user_model):
     test_segment = SegmentFactory()
     new_panel = test_segment.panels[1].children[0].bind_to_model(Segment)
     assert new_panel.related.name == "wagtail_personalisation_timerules"
+
+
+@pytest.mark.django_db
+def test_segment_with_rules_prefetches_rules(django_assert_num_queries):
+    segment = SegmentFactory()
+    rule = TimeRule.objects.create(
+        start_time=datetime.time(8, 0, 0),
+        end_time=datetime.time(23, 0, 0),
+        segment=segment,
+    )
+    other_segment = SegmentFactory()
+
+    segments = list(Segment.objects.with_rules().order_by("pk"))
+    with django_assert_num_queries(0):
+        assert segments[0].get_rules() == [rule]
+        assert segments[1].get_rules() == []
+    assert segments == [segment, other_segment]
+
+
+@pytest.mark.django_db
+def test_segment_with_rules_uses_one_query_per_rule_model(django_assert_num_queries):
+    for _ in range(3):
+        segment = SegmentFactory()
+        TimeRule.objects.create(
+            start_time=datetime.time(8, 0, 0),
+            end_time=datetime.time(23, 0, 0),
+            segment=segment,
+        )
+
+    rule_model_count = len(AbstractBaseRule.get_descendant_models())
+    with django_assert_num_queries(1 + rule_model_count):
+        for segment in Segment.objects.with_rules():
+            segment.get_rules()
+
+
+@pytest.mark.django_db
+def test_segment_reserve_slot_stops_at_count():
+    segment = SegmentFactory(type=Segment.TYPE_STATIC, count=2)
+
+    assert segment.reserve_slot()
+    assert segment.reserve_slot()
+    assert not segment.reserve_slot()
+    assert segment.is_full
+
+    segment.refresh_from_db()
+    assert segment.member_count == 2
+
+
+@pytest.mark.django_db
+def test_segment_reserve_slot_uses_stored_count():
+    segment = SegmentFactory(type=Segment.TYPE_STATIC, count=2)
+    stale_segment = Segment.objects.get(pk=segment.pk)
+
+    assert segment.reserve_slot()
+    assert segment.reserve_slot()
+    assert not stale_segment.is_full
+    assert not stale_segment.reserve_slot()
+    assert stale_segment.is_full
+
+
+@pytest.mark.django_db
+def test_segment_reserve_slots_reserves_remaining_places(django_assert_num_queries):
+    segment = SegmentFactory(type=Segment.TYPE_STATIC, count=5)
+
+    with django_assert_num_queries(1):
+        assert segment.reserve_slots(3) == 3
+
+    # Places reserved concurrently are taken into account.
+    Segment.objects.filter(pk=segment.pk).update(member_count=4)
+    assert segment.reserve_slots(3) == 1
+    assert segment.reserve_slots(1) == 0
+    assert segment.is_full
+
+    segment.refresh_from_db()
+    assert segment.member_count == 5
+
+
+@pytest.mark.django_db
+def test_segment_member_count_follows_static_users(django_user_model):
+    user = django_user_model.objects.create(username="first")
+    other_user = django_user_model.objects.create(username="second")
+    segment = SegmentFactory(type=Segment.TYPE_STATIC, count=5)
+
+    segment.static_users.add(user, other_user)
+    segment.refresh_from_db()
+    assert segment.member_count == 2
+
+    segment.static_users.remove(user)
+    segment.refresh_from_db()
+    assert segment.member_count == 1
+
+    other_user.segment_set.clear()
+    segment.refresh_from_db()
+    assert segment.member_count == 0
+
+
+@pytest.mark.django_db
+def test_segment_member_count_follows_deleted_users(django_user_model):
+    user = django_user_model.objects.create(username="first")
+    segment = SegmentFactory(type=Segment.TYPE_STATIC, count=1)
+    segment.static_users.add(user)
+
+    user.delete()
+    segment.refresh_from_db()
+    assert segment.member_count == 0
+    assert not segment.is_full
+
+
+@pytest.mark.django_db
+def test_segment_member_count_keeps_reserved_slots(django_user_model):
+    user = django_user_model.objects.create(username="first")
+    segment = SegmentFactory(type=Segment.TYPE_STATIC, count=5)
+
+    assert segment.reserve_slot()
+    assert segment.reserve_slot()
+    segment.static_users.add(user)
+    segment.refresh_from_db()
+    assert segment.member_count == 2
@@ -0,0 +1,60 @@
+from unittest.mock import patch
+
+import pytest
+
+from tests.factories.rule import (
+    DeviceRuleFactory,
+    OriginCountryRuleFactory,
+    QueryRuleFactory,
+    ReferralRuleFactory,
+)
+from tests.factories.segment import SegmentFactory
+from wagtail_personalisation import adapters
+from wagtail_personalisation.planner import RuleStatistics, order_rules
+from wagtail_personalisation.rules import DeviceRule, OriginCountryRule
+
+
+@pytest.mark.django_db
+def test_order_rules_by_cost():
+    segment = SegmentFactory(name="segment")
+    country = OriginCountryRuleFactory(segment=segment, country="nl")
+    device = DeviceRuleFactory(segment=segment, mobile=True)
+    query = QueryRuleFactory(segment=segment, parameter="foo", value="bar")
+
+    assert order_rules([country, device, query]) == [query, device, country]
+
+
+@pytest.mark.django_db
+def test_order_rules_by_selectivity():
+    segment = SegmentFactory(name="segment")
+    query = QueryRuleFactory(segment=segment, parameter="foo", value="bar")
+    referral = ReferralRuleFactory(segment=segment, regex_string="test.test")
+
+    statistics = RuleStatistics()
+    for _ in range(50):
+        statistics.observe(query, True)
+        statistics.observe(referral, False)
+
+    # The referral rule almost never matches, so it decides all() sooner.
+    assert order_rules([query, referral], False, statistics) == [referral, query]
+    assert order_rules([query, referral], True, statistics) == [query, referral]
+
+
+@pytest.mark.django_db
+def test_test_rules_skips_expensive_rules(rf):
+    segment = SegmentFactory(name="segment")
+    country = OriginCountryRuleFactory(segment=segment, country="nl")
+    device = DeviceRuleFactory(segment=segment, mobile=True)
+    query = QueryRuleFactory(segment=segment, parameter="foo", value="bar")
+
+    request = rf.get("/?foo=baz")
+    adapter = adapters.SessionSegmentsAdapter(request)
+
+    with (
+        patch.object(DeviceRule, "test_user") as device_test,
+        patch.object(OriginCountryRule, "test_user") as country_test,
+    ):
+        assert not adapter._test_rules([country, device, query], request)
+
+    device_test.assert_not_called()
+    country_test.assert_not_called()
@@ -0,0 +1,144 @@
+import json
+
+import pytest
+
+from tests.factories.page import BlockPageFactory
+from tests.factories.rule import QueryRuleFactory
+from tests.factories.segment import SegmentFactory
+from wagtail_personalisation import adapters
+from wagtail_personalisation.references import (
+    collect_segment_references,
+    get_segment_references,
+)
+
+
+def personalised(segment_id, text="Hello"):
+    return {"type": "personalised", "value": {"segment": str(segment_id), "text": text}}
+
+
+@pytest.fixture
+def block_page(site):
+    return BlockPageFactory(parent=site.root_page, slug="blocks")
+
+
+@pytest.fixture
+def skip_unreferenced(settings):
+    settings.WAGTAIL_PERSONALISATION_SKIP_UNREFERENCED_SEGMENTS = True
+
+
+@pytest.mark.django_db
+def test_collect_segment_references(block_page):
+    block_page.body = json.dumps(
+        [
+            {"type": "text", "value": "Hello"},
+            personalised(1),
+            personalised(-1),
+            personalised(""),
+            {
+                "type": "section",
+                "value": {
+                    "items": [
+                        {"type": "item", "value": personalised(2)["value"]},
+                        personalised(3)["value"],
+                    ]
+                },
+            },
+            {"type": "removed", "value": personalised(4)["value"]},
+        ]
+    )
+    assert collect_segment_references(block_page) == {1, 2, 3}
+
+
+@pytest.mark.django_db
+def test_segment_references_are_stored_on_publish(
+    block_page, django_assert_num_queries
+):
+    segment = SegmentFactory(name="test")
+    block_page.body = json.dumps([personalised(segment.pk)])
+    block_page.save_revision().publish()
+
+    with django_assert_num_queries(0):
+        assert get_segment_references(block_page) == {segment.pk}
+
+    # A new revision is collected again.
+    block_page.body = json.dumps([])
+    block_page.save_revision().publish()
+    assert get_segment_references(block_page) == set()
+
+
+@pytest.mark.django_db
+def test_unreferenced_page_skips_segments(
+    client, block_page, skip_unreferenced, mocker
+):
+    block_page.save_revision().publish()
+    refresh = mocker.patch.object(adapters.SessionSegmentsAdapter, "refresh")
+
+    response = client.get("/blocks/")
+    assert response.status_code == 200
+    refresh.assert_called_once_with(segment_ids=set())
+
+
+@pytest.mark.django_db
+def test_unreferenced_page_counts_segment_visits(client, block_page, settings):
+    segment = SegmentFactory(name="test", persistent=True, visit_count=0)
+    QueryRuleFactory(segment=segment, parameter="foo", value="bar")
+    block_page.save_revision().publish()
+    client.get("/blocks/?foo=bar")
+
+    settings.WAGTAIL_PERSONALISATION_SKIP_UNREFERENCED_SEGMENTS = True
+    client.get("/blocks/")
+
+    segment.refresh_from_db()
+    assert segment.visit_count == 2
+
+
+@pytest.mark.django_db
+def test_referenced_page_refreshes_referenced_segments(
+    client, block_page, skip_unreferenced, mocker
+):
+    segment = SegmentFactory(name="test")
+    block_page.body = json.dumps([personalised(segment.pk)])
+    block_page.save_revision().publish()
+    refresh = mocker.patch.object(adapters.SessionSegmentsAdapter, "refresh")
+
+    response = client.get("/blocks/")
+    assert response.status_code == 200
+    refresh.assert_called_once_with(segment_ids={segment.pk})
+
+
+@pytest.mark.django_db
+def test_page_with_variants_refreshes_variant_segments(
+    client, segmented_page, skip_unreferenced, mocker
+):
+    SegmentFactory(name="other")
+    refresh = mocker.patch.object(adapters.SessionSegmentsAdapter, "refresh")
+
+    response = client.get("/personalised/")
+    assert response.status_code == 200
+    segment = segmented_page.personalisation_metadata.segment
+    refresh.assert_called_once_with(segment_ids={segment.pk})
+
+
+@pytest.mark.django_db
+def test_unreferenced_page_refreshes_by_default(client, block_page, mocker):
+    refresh = mocker.patch.object(adapters.SessionSegmentsAdapter, "refresh")
+
+    response = client.get("/blocks/")
+    assert response.status_code == 200
+    refresh.assert_called_once_with()
+
+
+@pytest.mark.django_db
+def test_refresh_only_tests_given_segments(rf, site):
+    segment = SegmentFactory(name="test", persistent=True)
+    other = SegmentFactory(name="other", persistent=True)
+    QueryRuleFactory(segment=segment, parameter="foo", value="bar")
+    QueryRuleFactory(segment=other, parameter="foo", value="bar")
+    request = rf.get("/?foo=bar")
+    adapter = adapters.SessionSegmentsAdapter(request)
+
+    adapter.refresh(segment_ids={segment.pk})
+    assert adapter.get_segments() == [segment]
+
+    adapter.refresh()
+    assert set(adapter.get_segments()) == {segment, other}
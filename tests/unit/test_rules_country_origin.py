@@ -5,7 +5,7 @@ import pytest
 
 from tests.factories.rule import OriginCountryRuleFactory
 from tests.factories.segment import SegmentFactory
-from wagtail_personalisation.rules import get_geoip_module
+from wagtail_personalisation.rules import geoip_country_cache, get_geoip_module
 
 skip_if_geoip2_installed = pytest.mark.skipif(
     find_spec("geoip2"), reason="requires GeoIP2 to be not installed"
@@ -65,6 +65,27 @@ def test_get_geoip_country_with_remote_addr(rf):
     assert geoip_mock.mock_calls[1] == call().country_code("173.254.89.34")
 
 
+@pytest.mark.django_db
+def test_get_geoip_country_reuses_reader_and_caches_countries(rf):
+    segment = SegmentFactory(name="Test segment")
+    rule = OriginCountryRuleFactory(segment=segment, country="GB")
+    geoip_mock = MagicMock()
+    geoip_mock().configure_mock(**{"country_code.return_value": "SE"})
+    geoip_mock.reset_mock()
+    with patch(
+        "wagtail_personalisation.rules.get_geoip_module", return_value=geoip_mock
+    ):
+        for ip in ("173.254.89.34", "173.254.89.34", "123.120.0.2"):
+            assert rule.get_geoip_country(rf.get("/", REMOTE_ADDR=ip)) == "se"
+
+    assert geoip_mock.mock_calls == [
+        call(),
+        call().country_code("173.254.89.34"),
+        call().country_code("123.120.0.2"),
+    ]
+    assert geoip_country_cache.stats["hits"] == 1
+
+
 @pytest.mark.django_db
 def test_get_country_calls_all_methods(rf):
     segment = SegmentFactory(name="Test segment")
@@ -103,6 +124,21 @@ def test_get_country_does_not_use_all_detection_methods_unnecessarily(rf):
     test_mock()
 
 
+@pytest.mark.django_db
+def test_get_country_shares_detected_country(rf):
+    segment = SegmentFactory(name="Test segment")
+    rule = OriginCountryRuleFactory(segment=segment, country="GB")
+    other_rule = OriginCountryRuleFactory(segment=segment, country="PL")
+    request = rf.get("/")
+
+    with patch(
+        "wagtail_personalisation.rules.get_cloudflare_country", return_value="pl"
+    ) as cloudflare_mock:
+        assert rule.get_country(request) == "pl"
+        assert other_rule.get_country(request) == "pl"
+    cloudflare_mock.assert_called_once_with(request)
+
+
 @pytest.mark.django_db
 def test_test_user_calls_get_country(rf):
     segment = SegmentFactory(name="Test segment")
@@ -1,7 +1,12 @@
+from unittest.mock import patch
+
 import pytest
+from django.core.exceptions import ValidationError
 
 from tests.factories.rule import ReferralRuleFactory
 from tests.factories.segment import SegmentFactory
+from wagtail_personalisation.referrals import ReferralMatcher
+from wagtail_personalisation.rules import ReferralRule
 
 
 @pytest.mark.django_db
@@ -10,3 +15,83 @@ def test_referral_rule_create():
     referral_rule = ReferralRuleFactory(regex_string="test.test", segment=segment)
 
     assert referral_rule.regex_string == "test.test"
+
+
+@pytest.mark.django_db
+def test_referral_rule_test_user(rf):
+    segment = SegmentFactory(name="Referral")
+    rule = ReferralRuleFactory(regex_string=r"test\.test", segment=segment)
+
+    assert rule.test_user(rf.get("/", HTTP_REFERER="http://test.test/"))
+    assert not rule.test_user(rf.get("/", HTTP_REFERER="http://example.com/"))
+    assert not rule.test_user(rf.get("/"))
+
+
+@pytest.mark.django_db
+def test_referral_rule_uses_catalog_matcher(rf):
+    segment = SegmentFactory(name="Referral")
+    rule = ReferralRuleFactory(regex_string=r"test\.test", segment=segment)
+    request = rf.get("/", HTTP_REFERER="http://test.test/")
+
+    with patch(
+        "wagtail_personalisation.rules.compile_pattern", side_effect=AssertionError
+    ):
+        assert rule.test_user(request)
+
+    # Unsaved changes to the pattern are not part of the catalog.
+    rule.regex_string = "example"
+    assert not rule.test_user(request)
+
+
+def test_referral_matcher():
+    matcher = ReferralMatcher(
+        {
+            1: r"^https?://(www\.)?google\.",
+            2: r"bing\.com",
+            3: r"(?i)CAMPAIGN",
+            4: r"(\w+)\.\1",
+            5: r"(?P<site>test)",
+        }
+    )
+
+    assert matcher.match("https://www.google.com/search?q=campaign") == {1, 3}
+    assert matcher.match("http://www.bing.com/") == {2}
+    assert matcher.match("http://test.test/") == {4, 5}
+    assert matcher.match("http://example.com/") == set()
+
+
+@pytest.mark.parametrize(
+    "regex_string",
+    [
+        r"(a+)+$",
+        r"(.*)*x",
+        r"(?:a|b*)+",
+        r"(.*,)+x",
+        r"(\w+\w)+x",
+        r"(?:[a-z]+\.?)+x",
+        r"(?i:[a-z]+A)+x",
+        "[a-",
+    ],
+)
+@pytest.mark.django_db
+def test_referral_rule_rejects_unsafe_patterns(regex_string):
+    segment = SegmentFactory(name="Referral")
+    rule = ReferralRule(segment=segment, regex_string=regex_string)
+
+    with pytest.raises(ValidationError):
+        rule.full_clean()
+
+
+@pytest.mark.django_db
+def test_referral_rule_accepts_safe_patterns():
+    segment = SegmentFactory(name="Referral")
+
+    for regex_string in [
+        r"^https?://(www\.)?google\.",
+        r"(ab*)\1",
+        r"(a{1,3})+",
+        r"(?:[a-z]+\.)*google\.com",
+        r"(\w+\.)+example\.org",
+        r"^https?://([^/.]+[./])+test/",
+    ]:
+        ReferralRule(segment=segment, regex_string=regex_string).full_clean()
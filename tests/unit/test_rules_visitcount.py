@@ -2,28 +2,27 @@ import pytest
 
 from tests.factories.rule import VisitCountRuleFactory
 from tests.factories.segment import SegmentFactory
+from wagtail_personalisation import adapters
+from wagtail_personalisation.models import UserSession
 from wagtail_personalisation.rules import VisitCountRule
 
 
 @pytest.mark.django_db
 def test_visit_count(site, client):
+    root_page_id = str(site.root_page.pk)
+    page_id = str(site.root_page.get_children().get(slug="page-1").pk)
+
     response = client.get("/")
     assert response.status_code == 200
-    visit_count = client.session["visit_count"]
-    assert visit_count[0]["path"] == "/"
-    assert visit_count[0]["count"] == 1
+    assert client.session["page_visits"] == {root_page_id: 1}
 
     response = client.get("/")
     assert response.status_code == 200
-    visit_count = client.session["visit_count"]
-    assert visit_count[0]["path"] == "/"
-    assert visit_count[0]["count"] == 2
+    assert client.session["page_visits"] == {root_page_id: 2}
 
     response = client.get("/page-1/")
     assert response.status_code == 200
-    visit_count = client.session["visit_count"]
-    assert visit_count[0]["count"] == 2
-    assert visit_count[1]["count"] == 1
+    assert client.session["page_visits"] == {root_page_id: 2, page_id: 1}
 
 
 @pytest.mark.django_db
@@ -38,7 +37,7 @@ def test_visit_count_call_test_user_with_user(site, client, user):
     rule = VisitCountRuleFactory(counted_page=site.root_page, segment=segment)
 
     session = client.session
-    session["visit_count"] = [{"path": "/", "count": 2}]
+    session["page_visits"] = {str(site.root_page.pk): 2}
     session.save()
     client.force_login(user)
 
@@ -51,7 +50,7 @@ def test_visit_count_call_test_user_with_user_or_request_fails(site, client, use
     rule = VisitCountRuleFactory(counted_page=site.root_page, segment=segment)
 
     session = client.session
-    session["visit_count"] = [{"path": "/", "count": 2}]
+    session["page_visits"] = {str(site.root_page.pk): 2}
     session.save()
     client.force_login(user)
 
@@ -72,8 +71,41 @@ def test_get_user_info_string_returns_count(site, client, user):
     rule = VisitCountRuleFactory(counted_page=site.root_page, segment=segment)
 
     session = client.session
-    session["visit_count"] = [{"path": "/", "count": 2}]
+    session["page_visits"] = {str(site.root_page.pk): 2}
     session.save()
     client.force_login(user)
 
     assert rule.get_user_info_string(user) == "2"
+
+
+@pytest.mark.django_db
+def test_get_user_session_uses_session_index(
+    site, client, user, django_assert_num_queries
+):
+    rule = VisitCountRule()
+    assert rule._get_user_session(user).session_key is None
+
+    client.force_login(user)
+    assert UserSession.get_session_key(user) == client.session.session_key
+
+    with django_assert_num_queries(1):
+        session = rule._get_user_session(user)
+    assert session.session_key == client.session.session_key
+
+    client.logout()
+    assert UserSession.get_session_key(user) is None
+
+
+@pytest.mark.django_db
+def test_adapter_updates_session_index_on_new_session_key(rf, user):
+    request = rf.get("/")
+    request.user = user
+    request.session.save()
+    adapter = adapters.SessionSegmentsAdapter(request)
+
+    adapter.refresh()
+    assert UserSession.get_session_key(user) == request.session.session_key
+
+    request.session.cycle_key()
+    adapter.refresh()
+    assert UserSession.get_session_key(user) == request.session.session_key
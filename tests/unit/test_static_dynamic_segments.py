@@ -2,11 +2,12 @@ import datetime
 
 import pytest
 from django.forms.models import model_to_dict
+from django.test import override_settings
 
 from tests.factories.segment import SegmentFactory
 from wagtail_personalisation.forms import SegmentAdminForm
-from wagtail_personalisation.models import Segment
-from wagtail_personalisation.rules import TimeRule, VisitCountRule
+from wagtail_personalisation.models import PageVisit, Segment, UserSession
+from wagtail_personalisation.rules import SessionStore, TimeRule, VisitCountRule
 
 
 def form_with_data(segment, *rules):
@@ -81,6 +82,46 @@ def test_user_not_added_to_full_static_segment_at_creation(
     assert len(instance.static_users.all()) == 1
 
 
+@pytest.mark.django_db
+def test_user_sessions_tested_at_creation(site, django_user_model):
+    visitor = django_user_model.objects.create(username="visitor")
+    django_user_model.objects.create(username="other")
+
+    session = SessionStore()
+    session["page_visits"] = {str(site.root_page.pk): 5}
+    session.save()
+    UserSession.update(visitor, session.session_key)
+
+    segment = SegmentFactory.build(type=Segment.TYPE_STATIC)
+    rule = VisitCountRule(counted_page=site.root_page, operator="more_than", count=1)
+    instance = form_with_data(segment, rule).save()
+
+    assert list(instance.static_users.all()) == [visitor]
+    assert instance.matched_users_count == 1
+
+
+@pytest.mark.django_db
+def test_static_segment_places_reserved_at_once_at_creation(
+    site, django_user_model, mocker
+):
+    for username in ("first", "second", "third"):
+        django_user_model.objects.create(username=username)
+    segment = SegmentFactory.build(type=Segment.TYPE_STATIC, count=2)
+    rule = VisitCountRule(counted_page=site.root_page)
+    form = form_with_data(segment, rule)
+    mocker.patch(
+        "wagtail_personalisation.rules.VisitCountRule.test_user", return_value=True
+    )
+    reserve_slot = mocker.spy(Segment, "reserve_slot")
+    reserve_slots = mocker.spy(Segment, "reserve_slots")
+    instance = form.save()
+
+    assert instance.static_users.count() == 2
+    assert instance.matched_users_count == 3
+    reserve_slot.assert_not_called()
+    reserve_slots.assert_called_once_with(instance, 2)
+
+
 @pytest.mark.django_db
 def test_anonymous_user_not_added_to_static_segment_at_creation(site, client, mocker):
     session = client.session
@@ -212,6 +253,30 @@ def test_session_not_added_to_static_segment_after_full(
     assert other_user not in instance.static_users.all()
 
 
+@pytest.mark.django_db
+def test_session_added_to_static_segment_after_place_freed(
+    site, client, django_user_model
+):
+    user = django_user_model.objects.create(username="first")
+    other_user = django_user_model.objects.create(username="second")
+    segment = SegmentFactory.build(type=Segment.TYPE_STATIC, count=1)
+    rule = VisitCountRule(counted_page=site.root_page)
+    form = form_with_data(segment, rule)
+    instance = form.save()
+
+    client.force_login(user)
+    client.get(site.root_page.url)
+    assert list(instance.static_users.all()) == [user]
+
+    # The catalog must not keep the segment full once the place is freed.
+    instance.static_users.remove(user)
+    client.cookies.clear()
+    client.force_login(other_user)
+    client.get(site.root_page.url)
+
+    assert list(instance.static_users.all()) == [other_user]
+
+
 @pytest.mark.django_db
 def test_sessions_not_added_to_static_segment_if_rule_not_static(mocker):
     segment = SegmentFactory.build(type=Segment.TYPE_STATIC, count=1)
@@ -647,3 +712,23 @@ def test_count_matching_users_handles_match_all(
 
     assert form.count_matching_users([first_rule, second_rule], False) == 1
     mock_test_user.call_count == 4  # noqa: B015
+
+
+@override_settings(
+    WAGTAIL_PERSONALISATION_VISIT_STORE={
+        "BACKEND": "wagtail_personalisation.visits.DatabaseVisitStore"
+    }
+)
+@pytest.mark.django_db
+def test_static_segment_uses_visits_of_each_user(site, user, django_user_model):
+    other_user = django_user_model.objects.create(username="other")
+    PageVisit.objects.create(
+        visitor_key=f"user:{user.pk}", page=site.root_page, count=5
+    )
+
+    segment = SegmentFactory.build(type=Segment.TYPE_STATIC)
+    rule = VisitCountRule(counted_page=site.root_page, operator="more_than", count=1)
+    instance = form_with_data(segment, rule).save()
+
+    assert list(instance.static_users.all()) == [user]
+    assert other_user not in instance.static_users.all()
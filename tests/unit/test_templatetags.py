@@ -5,18 +5,19 @@ from django.template import TemplateSyntaxError
 
 from tests.factories.segment import SegmentFactory
 from tests.utils import render_template
+from wagtail_personalisation import adapters
 
 
 @pytest.mark.django_db
 def test_segment_template_block(rf, site):
-    SegmentFactory(name="test", persistent=True)
+    segment = SegmentFactory(name="test", persistent=True)
 
     request = rf.get("/")
 
     request.session["segments"] = [
         {
             "encoded_name": "test",
-            "id": 1,
+            "id": segment.pk,
             "timestamp": int(time.time()),
             "persistent": True,
         }
@@ -50,3 +51,70 @@ def test_segment_template_block(rf, site):
         """,
             request=request,
         ).strip()
+
+
+@pytest.mark.django_db
+def test_segment_template_block_needs_no_queries(rf, site, django_assert_num_queries):
+    segment = SegmentFactory(name="member", persistent=True)
+    SegmentFactory(name="other", persistent=True)
+
+    request = rf.get("/")
+    adapters.get_segment_adapter(request).set_segments([segment])
+    template = """
+        {% load wagtail_personalisation_tags %}
+        {% segment name='member' %}Member{% endsegment %}
+        {% segment name='other' %}Other{% endsegment %}
+        {% segment name='member' %}Member{% endsegment %}
+    """
+    render_template(template, request=request)
+
+    with django_assert_num_queries(0):
+        content = render_template(template, request=request)
+    assert content.split() == ["Member", "Member"]
+
+
+SWITCH_TEMPLATE = """
+    {% load wagtail_personalisation_tags %}
+    {% segment_switch %}
+        {% case "first" %}First
+        {% case "second" second_name %}Second
+        {% default %}Default
+    {% endsegment_switch %}
+"""
+
+
+@pytest.mark.django_db
+def test_segment_switch_renders_first_matching_case(
+    rf, site, django_assert_num_queries
+):
+    first = SegmentFactory(name="first", persistent=True)
+    second = SegmentFactory(name="second", persistent=True)
+    third = SegmentFactory(name="third", persistent=True)
+
+    request = rf.get("/")
+    adapter = adapters.get_segment_adapter(request)
+    assert render_template(SWITCH_TEMPLATE, request=request).strip() == "Default"
+
+    adapter.set_segments([second, first])
+    with django_assert_num_queries(0):
+        content = render_template(SWITCH_TEMPLATE, request=request)
+    assert content.strip() == "First"
+
+    adapter.set_segments([third])
+    content = render_template(
+        SWITCH_TEMPLATE, request=request, second_name="third"
+    ).strip()
+    assert content == "Second"
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        "{% segment_switch name='first' %}{% endsegment_switch %}",
+        "{% segment_switch %}{% case %}{% endsegment_switch %}",
+        "{% segment_switch %}{% default %}{% case 'first' %}{% endsegment_switch %}",
+    ],
+)
+def test_segment_switch_syntax_errors(value):
+    with pytest.raises(TemplateSyntaxError):
+        render_template("{% load wagtail_personalisation_tags %}" + value)
@@ -4,6 +4,7 @@ from wagtail.models import Page as WagtailPage
 
 from tests.factories.page import ContentPageFactory, PersonalisablePageMetadataFactory
 from wagtail_personalisation.utils import (
+    LRUCache,
     can_delete_pages,
     exclude_variants,
     get_client_ip,
@@ -142,3 +143,17 @@ def test_exclude_variants_with_pages_querysets_meta_none():
     assert set(result.values_list("pk", flat=True)) == set(
         pages.values_list("pk", flat=True)
     )
+
+
+def test_lru_cache():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats == {"hits": 3, "misses": 1, "size": 2, "maxsize": 2}
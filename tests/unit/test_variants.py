@@ -0,0 +1,68 @@
+import pytest
+from wagtail.models import Page
+
+from tests.factories.segment import SegmentFactory
+from wagtail_personalisation import adapters, wagtail_hooks
+from wagtail_personalisation.variants import get_page_variants, get_variant
+
+
+@pytest.mark.django_db
+def test_page_without_variants_needs_no_queries(site, rf, django_assert_num_queries):
+    page = Page.objects.get(pk=site.root_page.pk).specific
+    assert get_page_variants(page) == {}
+
+    page = Page.objects.get(pk=site.root_page.pk).specific
+    with django_assert_num_queries(0):
+        assert wagtail_hooks.serve_variant(page, rf.get("/"), (), {}) is None
+
+
+@pytest.mark.django_db
+def test_variant_is_loaded_with_one_query(segmented_page, django_assert_num_queries):
+    metadata = segmented_page.personalisation_metadata
+    canonical_page = metadata.canonical_page
+    assert get_page_variants(canonical_page) == {
+        metadata.segment_id: (segmented_page.pk, segmented_page.content_type_id)
+    }
+    assert get_page_variants(segmented_page) is None
+
+    with django_assert_num_queries(1):
+        variant = get_variant(canonical_page, [metadata.segment])
+    assert variant == segmented_page
+    assert isinstance(variant, type(segmented_page))
+
+    assert get_variant(canonical_page, [SegmentFactory(name="other")]) is None
+
+
+@pytest.mark.django_db
+def test_variants_are_invalidated(segmented_page, rf):
+    canonical_page = segmented_page.personalisation_metadata.canonical_page
+    assert len(get_page_variants(canonical_page)) == 1
+
+    segment = SegmentFactory(name="new")
+    variant = canonical_page.personalisation_metadata.copy_for_segment(segment)
+    assert get_page_variants(canonical_page)[segment.pk][0] == variant.pk
+
+    variant.delete()
+    assert segment.pk not in get_page_variants(canonical_page)
+
+
+@pytest.mark.django_db
+def test_variants_are_invalidated_on_publish(segmented_page, mocker):
+    canonical_page = segmented_page.personalisation_metadata.canonical_page
+    get_page_variants(canonical_page)
+
+    invalidate = mocker.patch(
+        "wagtail_personalisation.receivers.invalidate_page_variants"
+    )
+    segmented_page.save_revision().publish()
+    invalidate.assert_called_once_with([segmented_page.pk, canonical_page.pk])
+
+
+@pytest.mark.django_db
+def test_serve_variant_uses_variant_map(segmented_page, rf):
+    metadata = segmented_page.personalisation_metadata
+    request = rf.get("/")
+    adapters.get_segment_adapter(request).set_segments([metadata.segment])
+
+    response = wagtail_hooks.serve_variant(metadata.canonical_page, request, (), {})
+    assert response.status_code == 200
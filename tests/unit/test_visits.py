@@ -0,0 +1,140 @@
+import datetime
+
+import pytest
+from django.test import override_settings
+from django.utils import timezone
+
+from tests.factories.page import ContentPageFactory
+from tests.factories.rule import VisitCountRuleFactory
+from tests.factories.segment import SegmentFactory
+from wagtail_personalisation import adapters
+from wagtail_personalisation.models import PageVisit
+from wagtail_personalisation.visits import DatabaseVisitStore
+
+VISIT_STORE = {"BACKEND": "wagtail_personalisation.visits.DatabaseVisitStore"}
+
+
+@pytest.mark.django_db
+def test_visit_store_writes_in_bulk(site, django_assert_num_queries):
+    page = ContentPageFactory(parent=site.root_page, slug="page")
+    store = DatabaseVisitStore()
+    store.add("user:1", site.root_page.pk)
+    store.add("user:1", site.root_page.pk)
+    store.add("user:2", site.root_page.pk)
+
+    assert store.get_counts("user:1") == {site.root_page.pk: 2}
+
+    with django_assert_num_queries(2):
+        store.flush()
+
+    store.add("user:1", site.root_page.pk)
+    store.add("user:1", page.pk)
+    with django_assert_num_queries(2):
+        store.flush()
+
+    assert store.get_counts("user:1") == {site.root_page.pk: 3, page.pk: 1}
+    assert store.get_counts("user:2") == {site.root_page.pk: 1}
+
+
+@pytest.mark.django_db
+def test_visit_store_updates_last_visit(site):
+    last_visit = timezone.now() - datetime.timedelta(days=1)
+    PageVisit.objects.create(
+        visitor_key="session:key", page=site.root_page, last_visit=last_visit
+    )
+    store = DatabaseVisitStore()
+    store.add("session:key", site.root_page.pk)
+    store.flush()
+
+    assert PageVisit.objects.get().last_visit > last_visit
+
+
+@pytest.mark.django_db
+def test_visit_store_keeps_concurrently_written_visits(site, mocker):
+    store = DatabaseVisitStore()
+    store.add("user:1", site.root_page.pk)
+
+    # Another process inserts the same count while this one is writing.
+    bulk_create = PageVisit.objects.bulk_create
+
+    def concurrent_bulk_create(*args, **kwargs):
+        PageVisit.objects.create(
+            visitor_key="user:1", page_id=site.root_page.pk, count=3
+        )
+        return bulk_create(*args, **kwargs)
+
+    mocker.patch.object(
+        PageVisit.objects, "bulk_create", side_effect=concurrent_bulk_create
+    )
+    store.flush()
+
+    assert store.get_counts("user:1") == {site.root_page.pk: 4}
+
+
+@pytest.mark.django_db
+def test_visit_store_flushes_after_interval(site):
+    store = DatabaseVisitStore(interval=3600, threshold=2)
+    store.add("user:1", site.root_page.pk)
+    store.flush_if_due()
+    assert not PageVisit.objects.exists()
+
+    store.add("user:1", site.root_page.pk)
+    store.flush_if_due()
+    assert PageVisit.objects.get().count == 2
+
+
+@override_settings(WAGTAIL_PERSONALISATION_VISIT_STORE=VISIT_STORE)
+@pytest.mark.django_db
+def test_page_visits_are_stored_in_database(site, client, user):
+    client.force_login(user)
+    client.get("/")
+    client.get("/")
+
+    assert "visit_count" not in client.session
+    visit = PageVisit.objects.get()
+    assert visit.visitor_key == f"user:{user.pk}"
+    assert visit.page_id == site.root_page.pk
+    assert visit.count == 2
+
+
+@override_settings(WAGTAIL_PERSONALISATION_VISIT_STORE=VISIT_STORE)
+@pytest.mark.django_db
+def test_anonymous_page_visits_use_session_key(site, rf):
+    request = rf.get("/")
+    adapter = adapters.SessionSegmentsAdapter(request)
+
+    adapter.add_page_visit(site.root_page)
+    adapter.add_page_visit(site.root_page)
+
+    assert adapter.get_visitor_key() == f"session:{request.session.session_key}"
+    assert adapter.get_visit_count(site.root_page) == 2
+
+
+@override_settings(WAGTAIL_PERSONALISATION_VISIT_STORE=VISIT_STORE)
+@pytest.mark.django_db
+def test_visit_count_rule_uses_visit_store(site, user, django_assert_num_queries):
+    segment = SegmentFactory(name="VisitCount")
+    rule = VisitCountRuleFactory(counted_page=site.root_page, segment=segment, count=1)
+    PageVisit.objects.create(
+        visitor_key=f"user:{user.pk}", page=site.root_page, count=2
+    )
+
+    with django_assert_num_queries(1):
+        assert rule.test_user(None, user)
+    assert rule.get_user_info_string(user) == "2"
+
+
+@override_settings(WAGTAIL_PERSONALISATION_VISIT_STORE=VISIT_STORE)
+@pytest.mark.django_db
+def test_visit_counts_follow_the_request_user(site, rf, user, django_user_model):
+    other_user = django_user_model.objects.create(username="other")
+    PageVisit.objects.create(
+        visitor_key=f"user:{user.pk}", page=site.root_page, count=5
+    )
+    request = rf.get("/")
+    request.user = user
+    adapter = adapters.SessionSegmentsAdapter(request)
+    assert adapter.get_visit_count(site.root_page) == 5
+
+    request.user = other_user
+    assert adapter.get_visit_count(site.root_page) == 0
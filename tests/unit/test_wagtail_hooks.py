@@ -1,5 +1,7 @@
 import pytest
 from django.http import Http404
+from django.test import override_settings
+from django.urls import reverse
 from wagtail.models import Page
 
 from tests.factories.page import ContentPageFactory
@@ -138,3 +140,56 @@ def test_custom_delete_page_view_deletes_variants_of_child_pages(
     )
     # A ProtectedError would be raised if the bug persists
     wagtail_hooks.delete_related_variants(post_request, canonical_page)
+
+
+@pytest.mark.django_db
+def test_userbar_shows_segment_links(site, client, django_user_model):
+    segment = SegmentFactory(name="userbar segment")
+    admin = django_user_model.objects.create_superuser("admin", "", "password")
+    client.force_login(admin)
+
+    response = client.get("/page-1/")
+    assert f"?segment={segment.pk}" in response.text
+    assert "Show as segment: userbar segment" in response.text
+
+
+@override_settings(WAGTAIL_PERSONALISATION_USERBAR_SEGMENTS=1)
+@pytest.mark.django_db
+def test_userbar_loads_many_segments_on_demand(site, client, django_user_model):
+    segments = [SegmentFactory(name=f"segment-{i}") for i in range(2)]
+    admin = django_user_model.objects.create_superuser("admin", "", "password")
+    client.force_login(admin)
+
+    response = client.get("/page-1/")
+    assert "?segment=" not in response.text
+    assert reverse("segment:userbar_segments") in response.text
+    assert "js/userbar_segment_picker.js" in response.text
+    assert "onfocus" not in response.text
+
+    response = client.get(reverse("segment:userbar_segments"))
+    assert response.json() == {
+        "segments": [{"id": segment.pk, "name": segment.name} for segment in segments]
+    }
+
+
+@pytest.mark.parametrize("value", ["pk", "name", "unknown", "-1"])
+@pytest.mark.django_db
+def test_superuser_shows_page_as_segment(site, client, django_user_model, value):
+    segment = SegmentFactory(name="Shown segment")
+    admin = django_user_model.objects.create_superuser("admin", "", "password")
+    client.force_login(admin)
+
+    forced = {"pk": segment.pk, "name": segment.name}.get(value, value)
+    response = client.get("/page-1/", {"segment": forced})
+    assert response.status_code == 200
+
+    segment_ids = [s["id"] for s in client.session.get("segments", [])]
+    assert segment_ids == ([segment.pk] if value in ("pk", "name") else [])
+
+
+@pytest.mark.django_db
+def test_userbar_segments_are_only_shown_to_superusers(site, rf, user):
+    SegmentFactory(name="segment")
+    request = rf.get("/")
+    request.user = user
+    assert wagtail_hooks.add_segment_link_items(request, [], site.root_page) == []